@@ -4,10 +4,19 @@ Utiliza ChromaDB para embeddings y OpenAI para análisis
 """
 import os
 import json
+import hashlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from typing import List, Dict, Optional
 import chromadb
 from openai import OpenAI
+from embeddings import NOMBRE_ONNX, crear_proveedor_embeddings
+from ingesta import ALIAS_TIPOS
+from busqueda import (metadata_registro, construir_where, extraer_filtros_pregunta,
+                      extraer_periodo_pregunta, traducir_where, PREFIJO_CAMPO,
+                      es_token_exacto, fusionar_rrf, normalizar_consulta, CacheLRU)
 import pandas as pd
 from datetime import datetime
 import matplotlib
@@ -19,6 +28,19 @@ import base64
 
 logger = logging.getLogger(__name__)
 
+# Incrementar al cambiar los prompts o el modelo de generar_analisis_ia (invalida analisis_cache)
+VERSION_PROMPT_ANALISIS = 'gpt-4o/1'
+
+# Secciones IA de generar_informe_completo que se piden al modelo a la vez
+INFORME_CONCURRENCIA = int(os.getenv('INFORME_CONCURRENCIA', 3))
+SECCIONES_INFORME = (('analisis_general', 'general'), ('tendencias', 'tendencias'), ('anomalias', 'anomalias'))
+
+# Bucle de function calling del chat: rondas máximas, presupuesto de tiempo y
+# funciones de una misma ronda ejecutadas a la vez
+AGENTE_MAX_PASOS = int(os.getenv('AGENTE_MAX_PASOS', 4))
+AGENTE_PRESUPUESTO_SEG = float(os.getenv('AGENTE_PRESUPUESTO_SEG', 60))
+AGENTE_CONCURRENCIA = int(os.getenv('AGENTE_CONCURRENCIA', 4))
+
 # Configurar estilo de gráficos
 sns.set_style("whitegrid")
 plt.rcParams['figure.figsize'] = (12, 6)
@@ -27,10 +49,25 @@ plt.rcParams['font.size'] = 10
 class DataAnalysisAgent:
     """Agente para análisis y consulta de datos con IA"""
     
-    def __init__(self, db_manager, openai_api_key: Optional[str] = None):
+    def __init__(self, db_manager, openai_api_key: Optional[str] = None, embedding_function=None):
         self.db_manager = db_manager
         self._chroma_client = None
+        self._embedding_function = embedding_function  # None: según EMBEDDINGS_PROVEEDOR
         self._openai_client = None
+        self.chroma_modo = os.getenv('CHROMA_MODE', 'http').lower()
+        self._pool_busqueda = ThreadPoolExecutor(max_workers=4, thread_name_prefix='busqueda')
+        # Pool aparte para las funciones del chat: una ronda lenta no ocupa los hilos que
+        # buscar_hibrido usa para sus dos búsquedas en paralelo
+        self._pool_funciones = ThreadPoolExecutor(max_workers=max(1, AGENTE_CONCURRENCIA),
+                                                  thread_name_prefix='agente')
+        # Cache de resultados de búsqueda; la versión del índice de cada reporte se
+        # incrementa con cada cambio del índice y forma parte de la clave
+        self.cache_busqueda = CacheLRU(int(os.getenv('BUSQUEDA_CACHE_MAX', 512)))
+        self._version_indice = {}  # {codigo_reporte: int}
+        # Una sola indexación por reporte a la vez, venga de la cola, del endpoint
+        # síncrono o de la indexación perezosa de la búsqueda
+        self._locks_indexacion = {}  # {codigo_reporte: RLock}
+        self._locks_indexacion_guardia = threading.Lock()
         
         # Guardar API key para lazy loading
         self.openai_key = openai_api_key or os.getenv('OPENAI_API_KEY')
@@ -54,15 +91,63 @@ class DataAnalysisAgent:
     
     @property
     def chroma_client(self):
-        """Lazy loading de ChromaDB client"""
+        """
+        Lazy loading de ChromaDB client
+        CHROMA_MODE=http (por defecto) usa el servicio chroma; CHROMA_MODE=local abre un
+        PersistentClient embebido en CHROMA_PATH, sin saltos de red ni contenedor aparte
+        """
         if self._chroma_client is None:
             try:
-                self._chroma_client = chromadb.HttpClient(host='chroma', port=8000)
+                if self.chroma_modo == 'local':
+                    ruta = os.getenv('CHROMA_PATH', os.path.join(os.path.dirname(__file__), 'chroma_data'))
+                    self._chroma_client = chromadb.PersistentClient(path=ruta)
+                    logger.info(f"ChromaDB embebido en {ruta}")
+                else:
+                    self._chroma_client = chromadb.HttpClient(
+                        host=os.getenv('CHROMA_HOST', 'chroma'),
+                        port=int(os.getenv('CHROMA_PORT', 8000))
+                    )
             except Exception as e:
                 logger.error(f"Error conectando a ChromaDB: {e}")
                 raise Exception("ChromaDB no disponible. Asegúrate de que el servicio esté corriendo.")
         return self._chroma_client
     
+    @property
+    def embedding_function(self):
+        """Proveedor de embeddings de las colecciones (lazy: el modelo ONNX se carga al primer uso)"""
+        if self._embedding_function is None:
+            self._embedding_function = crear_proveedor_embeddings()
+        return self._embedding_function
+    
+    @property
+    def nombre_embeddings(self) -> str:
+        """Proveedor de embeddings actual, tal como se guarda en la metadata de las colecciones"""
+        return getattr(self.embedding_function, 'nombre', type(self.embedding_function).__name__)
+    
+    def _embeddings_compatibles(self, collection) -> bool:
+        """
+        La colección fue indexada con el proveedor actual
+        Los proveedores comparten dimensión, así que ChromaDB aceptaría consultar con
+        vectores de otro modelo y devolvería resultados sin sentido
+        """
+        guardado = (collection.metadata or {}).get('embeddings', NOMBRE_ONNX)
+        return guardado == self.nombre_embeddings
+    
+    @property
+    def chroma_batch_size(self) -> int:
+        """
+        Documentos por llamada a ChromaDB (CHROMA_BATCH_SIZE)
+        En modo local no hay payload HTTP que acotar: lotes grandes amortizan cada escritura
+        """
+        por_defecto = 1000 if self.chroma_modo == 'local' else 100
+        tamano = int(os.getenv('CHROMA_BATCH_SIZE', por_defecto))
+        # Respetar el máximo que acepta el cliente (SQLite limita variables por sentencia)
+        try:
+            tamano = min(tamano, self.chroma_client.get_max_batch_size())
+        except Exception:
+            pass
+        return tamano
+    
     # ============================================
     # SISTEMA DE MEMORIA CONVERSACIONAL
     # ============================================
@@ -411,9 +496,52 @@ class DataAnalysisAgent:
                         "required": ["campo"]
                     }
                 }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "buscar_registros",
+                    "description": "Busca registros concretos por significado (cliente, factura, producto, descripción), opcionalmente filtrando por fechas o valores exactos de campos. Útil para '¿qué facturas de enero tuvo el cliente X?'",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "consulta": {
+                                "type": "string",
+                                "description": "Texto a buscar"
+                            },
+                            "fecha_inicio": {
+                                "type": "string",
+                                "description": "Fecha de inicio en formato YYYY-MM-DD (opcional)"
+                            },
+                            "fecha_fin": {
+                                "type": "string",
+                                "description": "Fecha de fin en formato YYYY-MM-DD (opcional)"
+                            },
+                            "filtros": {
+                                "type": "object",
+                                "description": "Valores exactos por campo, ej: {\"sede\": \"Norte\"} (opcional)"
+                            },
+                            "limite": {
+                                "type": "integer",
+                                "description": "Máximo de registros a devolver (por defecto 10)"
+                            }
+                        },
+                        "required": ["consulta"]
+                    }
+                }
             }
         ]
     
+    def _ejecutar_funcion_medida(self, nombre_funcion: str, argumentos: Dict, codigo_reporte: str):
+        """Ejecutar una función del chat devolviendo (resultado, segundos); los errores van en el resultado"""
+        inicio = time.perf_counter()
+        try:
+            resultado = self._ejecutar_funcion(nombre_funcion, argumentos, codigo_reporte)
+        except Exception as e:
+            logger.error(f"Error ejecutando {nombre_funcion}: {e}")
+            resultado = {"error": str(e)}
+        return resultado, round(time.perf_counter() - inicio, 3)
+    
     def _ejecutar_funcion(self, nombre_funcion: str, argumentos: Dict, codigo_reporte: str) -> Dict:
         """Ejecutar la función correspondiente"""
         funciones = {
@@ -421,7 +549,8 @@ class DataAnalysisAgent:
             "contar_registros": lambda args: self._contar_registros(codigo_reporte, **args),
             "agrupar_por_campo": lambda args: self._agrupar_por_campo(codigo_reporte, **args),
             "comparar_periodos": lambda args: self._comparar_periodos(codigo_reporte, **args),
-            "obtener_estadisticas": lambda args: self._obtener_estadisticas(codigo_reporte, **args)
+            "obtener_estadisticas": lambda args: self._obtener_estadisticas(codigo_reporte, **args),
+            "buscar_registros": lambda args: self._buscar_registros(codigo_reporte, **args)
         }
         
         if nombre_funcion in funciones:
@@ -430,224 +559,897 @@ class DataAnalysisAgent:
             return {"error": f"Función {nombre_funcion} no encontrada"}
     
 
-    def indexar_datos_reporte(self, codigo_reporte: str):
-        """Indexar datos de un reporte en ChromaDB para búsqueda semántica"""
-        try:
-            # Obtener configuración del reporte
-            reporte = self.db_manager.obtener_reporte(codigo_reporte)
-            if not reporte:
-                raise ValueError(f"Reporte {codigo_reporte} no encontrado")
-            
-            # Extraer contexto del reporte
-            contexto_reporte = reporte.get('contexto', '')
-            descripcion_reporte = reporte.get('descripcion', '')
-            campos_config = reporte.get('campos', [])
-            # Parsear JSON si viene como cadena
-            if isinstance(campos_config, str):
-                try:
-                    campos_config = json.loads(campos_config)
-                except Exception:
-                    logger.warning("campos_config no es JSON válido; usando lista vacía")
-                    campos_config = []
+    def _preparar_indexacion(self, codigo_reporte: str) -> Dict:
+        """Configuración del reporte y documentación de campos usada para construir documentos"""
+        # Obtener configuración del reporte
+        reporte = self.db_manager.obtener_reporte(codigo_reporte)
+        if not reporte:
+            raise ValueError(f"Reporte {codigo_reporte} no encontrado")
+        
+        # Extraer contexto del reporte
+        contexto_reporte = reporte.get('contexto', '')
+        descripcion_reporte = reporte.get('descripcion', '')
+        campos_config = reporte.get('campos', [])
+        # Parsear JSON si viene como cadena
+        if isinstance(campos_config, str):
+            try:
+                campos_config = json.loads(campos_config)
+            except Exception:
+                logger.warning("campos_config no es JSON válido; usando lista vacía")
+                campos_config = []
 
-            # Fallback: si no hay configuración de campos, inferir desde datos
-            if not campos_config:
-                try:
-                    muestra = self.db_manager.consultar_datos(codigo_reporte, limite=1)
-                    if muestra and isinstance(muestra, list):
-                        datos_dict = muestra[0].get('datos', {})
-                        campos_config = [
-                            {
-                                'nombre': k,
-                                'etiqueta': k,
-                                'descripcion': 'Campo inferido desde datos',
-                                'tipo_dato': 'texto'
-                            } for k in datos_dict.keys()
-                        ]
-                        logger.info(f"Campos inferidos: {[c['nombre'] for c in campos_config]}")
-                except Exception as e_inf:
-                    logger.warning(f"No se pudo inferir campos desde datos: {e_inf}")
-            
-            # Construir documentación de campos
-            docs_campos = {}
-            for campo in campos_config:
-                nombre_campo = campo.get('nombre', '')
-                docs_campos[nombre_campo] = {
-                    'etiqueta': campo.get('etiqueta', nombre_campo),
-                    'descripcion': campo.get('descripcion', ''),
-                    'tipo': campo.get('tipo_dato', 'texto'),
-                    'ejemplo': campo.get('ejemplo', '')
-                }
-            
-            # Obtener datos
-            datos = self.db_manager.consultar_datos(codigo_reporte, limite=5000)
-            
-            if not datos:
-                logger.info(f"No hay datos para indexar en {codigo_reporte}")
-                return {'indexed': 0}
-            
-            # Crear o obtener colección
-            collection_name = f"reporte_{codigo_reporte.replace(' ', '_')}"
-            collection = self.chroma_client.get_or_create_collection(
+        # Fallback: si no hay configuración de campos, inferir desde datos
+        if not campos_config:
+            try:
+                muestra = self.db_manager.consultar_datos(codigo_reporte, limite=1)
+                if muestra and isinstance(muestra, list):
+                    datos_dict = muestra[0].get('datos', {})
+                    campos_config = [
+                        {
+                            'nombre': k,
+                            'etiqueta': k,
+                            'descripcion': 'Campo inferido desde datos',
+                            'tipo_dato': 'texto'
+                        } for k in datos_dict.keys()
+                    ]
+                    logger.info(f"Campos inferidos: {[c['nombre'] for c in campos_config]}")
+            except Exception as e_inf:
+                logger.warning(f"No se pudo inferir campos desde datos: {e_inf}")
+        
+        # Construir documentación de campos
+        docs_campos = {}
+        for campo in campos_config:
+            nombre_campo = campo.get('nombre', '')
+            docs_campos[nombre_campo] = {
+                'etiqueta': campo.get('etiqueta', nombre_campo),
+                'descripcion': campo.get('descripcion', ''),
+                'tipo': campo.get('tipo_dato', 'texto'),
+                'ejemplo': campo.get('ejemplo', '')
+            }
+        
+        # Campos categóricos guardados como metadata filtrable: los marcados con
+        # 'filtrable' en la configuración o, si no hay, los primeros campos de texto
+        campos_filtro = [c.get('nombre') for c in campos_config if c.get('filtrable')]
+        if not campos_filtro:
+            campos_filtro = [
+                c.get('nombre') for c in campos_config
+                if c.get('tipo_dato', 'texto') in ('texto', 'categoria', 'lista')
+            ][:int(os.getenv('INDEX_CAMPOS_FILTRO_MAX', 5))]
+        
+        return {
+            'codigo': codigo_reporte,
+            'reporte': reporte,
+            'contexto': contexto_reporte,
+            'descripcion': descripcion_reporte,
+            'campos_config': campos_config,
+            'docs_campos': docs_campos,
+            'campo_fecha': reporte.get('campo_fecha'),
+            'campos_filtro': campos_filtro,
+            'plantilla': os.getenv('INDEX_PLANTILLA_REGISTRO', 'compacta').lower(),
+            # Política de registros crudos: todos, muestra o ninguno (los resúmenes siempre se indexan)
+            'politica_registros': reporte.get('indexacion_registros') or 'todos',
+            'muestra_pct': reporte.get('indexacion_muestra_pct') or 10,
+            'campos_numericos': [
+                c.get('nombre') for c in campos_config
+                if ALIAS_TIPOS.get(str(c.get('tipo_dato', '')).lower()) in ('numero', 'decimal')
+            ]
+        }
+    
+    def _coleccion_reporte(self, ctx: Dict):
+        """
+        Crear u obtener la colección ChromaDB del reporte
+        Si fue indexada con otro proveedor de embeddings se elimina y se recrea vacía,
+        reiniciando la marca (ctx['reconstruida'] = True)
+        """
+        collection_name = f"reporte_{ctx['codigo'].replace(' ', '_')}"
+        metadata = {
+            "reporte": ctx['codigo'],
+            "nombre": ctx['reporte'].get('nombre', ''),
+            "contexto": ctx['contexto'][:500] if ctx['contexto'] else '',
+            "descripcion": ctx['descripcion'][:500] if ctx['descripcion'] else '',
+            "embeddings": self.nombre_embeddings
+        }
+        collection = self.chroma_client.get_or_create_collection(
+            name=collection_name,
+            embedding_function=self.embedding_function,
+            metadata=metadata
+        )
+        if not self._embeddings_compatibles(collection):
+            logger.warning(
+                f"Colección {collection_name} indexada con "
+                f"{(collection.metadata or {}).get('embeddings', NOMBRE_ONNX)}; "
+                f"se reconstruye con {self.nombre_embeddings}"
+            )
+            self.chroma_client.delete_collection(collection_name)
+            self.db_manager.reiniciar_marca_indexacion(ctx['codigo'])
+            collection = self.chroma_client.create_collection(
                 name=collection_name,
-                metadata={
-                    "reporte": codigo_reporte,
-                    "nombre": reporte.get('nombre', ''),
-                    "contexto": contexto_reporte[:500] if contexto_reporte else '',
-                    "descripcion": descripcion_reporte[:500] if descripcion_reporte else ''
-                }
+                embedding_function=self.embedding_function,
+                metadata=metadata
             )
-            
-            # Preparar documentos para indexar
-            documents = []
-            metadatas = []
-            ids = []
-            
-            # DOCUMENTO MAESTRO: Contexto completo del reporte (siempre se indexa primero)
-            documento_maestro = f"""DOCUMENTACIÓN DEL REPORTE: {reporte['nombre']}
+            ctx['reconstruida'] = True
+        return collection
+    
+    def _documento_maestro(self, ctx: Dict):
+        """DOCUMENTO MAESTRO: Contexto completo del reporte -> (documento, metadata, id)"""
+        codigo_reporte = ctx['codigo']
+        documento_maestro = f"""DOCUMENTACIÓN DEL REPORTE: {ctx['reporte']['nombre']}
             
 📋 CÓDIGO: {codigo_reporte}
 
 📝 DESCRIPCIÓN:
-{descripcion_reporte}
+{ctx['descripcion']}
 
 🎯 CONTEXTO Y PROPÓSITO:
-{contexto_reporte}
+{ctx['contexto']}
 
 📊 ESTRUCTURA DE CAMPOS:
 """
-            for campo in campos_config:
-                documento_maestro += f"\n• {campo.get('etiqueta', campo.get('nombre'))}"
-                documento_maestro += f"\n  - Nombre técnico: {campo.get('nombre')}"
-                documento_maestro += f"\n  - Tipo: {campo.get('tipo_dato', 'texto')}"
-                if campo.get('descripcion'):
-                    documento_maestro += f"\n  - Descripción: {campo.get('descripcion')}"
-                if campo.get('ejemplo'):
-                    documento_maestro += f"\n  - Ejemplo: {campo.get('ejemplo')}"
-                documento_maestro += "\n"
-            
-            documents.append(documento_maestro)
-            metadatas.append({
-                'tipo': 'documentacion_reporte',
-                'reporte': codigo_reporte,
-                'es_maestro': True
-            })
-            ids.append(f"{codigo_reporte}_MAESTRO")
-            
-            # Agregar registros de datos
-            for idx, registro in enumerate(datos):
-                # Convertir datos a texto descriptivo con contexto
-                datos_dict = registro['datos']
+        for campo in ctx['campos_config']:
+            documento_maestro += f"\n• {campo.get('etiqueta', campo.get('nombre'))}"
+            documento_maestro += f"\n  - Nombre técnico: {campo.get('nombre')}"
+            documento_maestro += f"\n  - Tipo: {campo.get('tipo_dato', 'texto')}"
+            if campo.get('descripcion'):
+                documento_maestro += f"\n  - Descripción: {campo.get('descripcion')}"
+            if campo.get('ejemplo'):
+                documento_maestro += f"\n  - Ejemplo: {campo.get('ejemplo')}"
+            documento_maestro += "\n"
+        
+        metadata = {
+            'tipo': 'documentacion_reporte',
+            'reporte': codigo_reporte,
+            'es_maestro': True
+        }
+        return documento_maestro, metadata, f"{codigo_reporte}_MAESTRO"
+    
+    def _documento_registro(self, ctx: Dict, registro: Dict):
+        """
+        Convertir un registro a texto -> (documento, metadata, id)
+        
+        Plantilla (INDEX_PLANTILLA_REGISTRO):
+        - compacta (por defecto): solo "Etiqueta: valor" separados por " | "; el nombre,
+          contexto y descripción de campos viven una sola vez en el documento maestro
+        - detallada: formato anterior, con contexto y descripción de cada campo por registro
+        """
+        datos_dict = registro['datos']
+        docs_campos = ctx['docs_campos']
+        
+        if ctx.get('plantilla') == 'detallada':
+            # Encabezado con contexto del reporte
+            texto = f"Reporte: {ctx['reporte']['nombre']}\n"
+            if ctx['contexto']:
+                texto += f"Contexto: {ctx['contexto'][:200]}\n"
+            texto += "\n--- Registro ---\n"
+            
+            # Agregar cada campo con su descripción
+            for k, v in datos_dict.items():
+                if v is not None:
+                    # Usar documentación del campo si existe
+                    if k in docs_campos and docs_campos[k].get('descripcion'):
+                        texto += f"{docs_campos[k]['etiqueta']} ({docs_campos[k]['descripcion']}): {v}\n"
+                    else:
+                        texto += f"{k}: {v}\n"
+        else:
+            texto = " | ".join(
+                f"{docs_campos[k]['etiqueta'] if k in docs_campos else k}: {v}"
+                for k, v in datos_dict.items()
+                if v is not None and v != ''
+            )
+        
+        metadata = {
+            'tipo': 'registro',
+            'id_registro': str(registro['id']),
+            'fecha_carga': str(registro['created_at']),
+            'reporte': ctx['codigo'],
+            **metadata_registro(registro, ctx['campo_fecha'], ctx['campos_filtro'])
+        }
+        return texto, metadata, f"{ctx['codigo']}_{registro['id']}"
+    
+    def _upsert_documentos(self, collection, documentos, batch_size: int = None) -> Dict:
+        """
+        Upsert de (documento, metadata, id) enviando a embeber solo lo que cambió
+        
+        Cada documento guarda en metadata el SHA-256 de su texto (hash_contenido).
+        Por lote se leen las metadatas existentes con un solo get: si el hash
+        coincide no se reenvía el texto; si solo cambió la metadata se actualiza
+        sin volver a calcular el embedding.
+        """
+        contadores = {'embebidos': 0, 'omitidos': 0, 'metadata_actualizada': 0}
+        batch_size = batch_size or self.chroma_batch_size
+        
+        for i in range(0, len(documentos), batch_size):
+            lote = documentos[i:i+batch_size]
+            existentes = collection.get(ids=[id_doc for _, _, id_doc in lote], include=['metadatas'])
+            previos = dict(zip(existentes['ids'], existentes['metadatas'] or []))
+            
+            por_embeber, por_actualizar = [], []
+            for documento, metadata, id_doc in lote:
+                metadata = dict(metadata, hash_contenido=hashlib.sha256(documento.encode('utf-8')).hexdigest())
+                previo = previos.get(id_doc) or {}
+                if previo.get('hash_contenido') != metadata['hash_contenido']:
+                    por_embeber.append((documento, metadata, id_doc))
+                elif previo != metadata:
+                    por_actualizar.append((metadata, id_doc))
+                else:
+                    contadores['omitidos'] += 1
+            
+            if por_embeber:
+                documents, metadatas, ids = (list(c) for c in zip(*por_embeber))
+                collection.upsert(documents=documents, metadatas=metadatas, ids=ids)
+                contadores['embebidos'] += len(por_embeber)
+            if por_actualizar:
+                metadatas, ids = (list(c) for c in zip(*por_actualizar))
+                collection.update(ids=ids, metadatas=metadatas)
+                contadores['metadata_actualizada'] += len(por_actualizar)
+        
+        return contadores
+    
+    def _documentos_resumen(self, ctx: Dict) -> List:
+        """
+        Documentos de resumen ("hechos") por mes: total del reporte y por valor de los
+        campos categóricos principales, con conteos, totales y variación frente al
+        periodo anterior calculados en SQL -> [(documento, metadata, id)]
+        """
+        if not ctx['campo_fecha']:
+            return []
+        
+        codigo = ctx['codigo']
+        etiquetas = {nombre: info['etiqueta'] for nombre, info in ctx['docs_campos'].items()}
+        dimensiones = [None] + ctx['campos_filtro'][:int(os.getenv('INDEX_RESUMEN_DIMENSIONES', 3))]
+        top = int(os.getenv('INDEX_RESUMEN_TOP', 20))
+        
+        def variacion(actual, anterior):
+            if actual is None or not anterior:
+                return ''
+            return f" ({(actual - anterior) / abs(anterior):+.1%} vs periodo anterior)"
+        
+        documentos = []
+        for dimension in dimensiones:
+            filas = self.db_manager.resumen_periodos(
+                codigo, ctx['campo_fecha'], ctx['campos_numericos'], dimension=dimension, top=top
+            )
+            for fila in filas:
+                periodo = fila['periodo']
+                partes = [f"Resumen mensual {periodo:%Y-%m} de {ctx['reporte']['nombre']}"]
+                if dimension:
+                    partes.append(f"{etiquetas.get(dimension, dimension)}: {fila['valor']}")
+                else:
+                    partes.append("Total del reporte")
+                partes.append(
+                    f"Registros: {fila['registros']}{variacion(fila['registros'], fila['registros_anterior'])}"
+                )
+                for campo, total in fila['totales'].items():
+                    if total is not None:
+                        partes.append(
+                            f"Total {etiquetas.get(campo, campo)}: {total:,.2f}"
+                            f"{variacion(total, fila['anteriores'][campo])}"
+                        )
+                
+                metadata = {
+                    'tipo': 'resumen',
+                    'reporte': codigo,
+                    'dimension': dimension or 'total',
+                    'fecha_periodo': periodo.year * 10000 + periodo.month * 100 + 1,
+                    'anio': periodo.year,
+                    'mes': periodo.month,
+                    'registros': int(fila['registros'])
+                }
+                if dimension:
+                    metadata[f"campo_{dimension}"] = str(fila['valor'])[:100]
+                clave = hashlib.sha1(str(fila['valor']).encode('utf-8')).hexdigest()[:12]
+                id_doc = f"{codigo}_RESUMEN_{dimension or 'total'}_{periodo:%Y%m}_{clave}"
+                documentos.append((" | ".join(partes), metadata, id_doc))
+        return documentos
+    
+    def _indexar_resumenes(self, ctx: Dict, collection, batch_size: int = None) -> Dict:
+        """
+        Regenerar los resúmenes (solo se reembeben los que cambiaron) y retirar los obsoletos
+        Las agregaciones recorren todo el reporte por cada dimensión: si los datos no
+        cambiaron desde la última generación (version_datos_reporte) no se recalculan
+        """
+        codigo = ctx['codigo']
+        version = self.db_manager.version_datos_reporte(codigo)
+        if self.db_manager.obtener_version_resumenes(codigo) == version:
+            return {'resumenes_omitidos': 1}
+        
+        documentos = self._documentos_resumen(ctx)
+        contadores = self._upsert_documentos(collection, documentos, batch_size)
+        
+        vigentes = {id_doc for _, _, id_doc in documentos}
+        existentes = collection.get(where={'tipo': 'resumen'}, include=[])['ids']
+        obsoletos = [id_doc for id_doc in existentes if id_doc not in vigentes]
+        if obsoletos:
+            collection.delete(ids=obsoletos)
+        
+        contadores['resumenes'] = len(documentos)
+        contadores['resumenes_eliminados'] = len(obsoletos)
+        # Versión leída antes de agregar: datos llegados durante la pasada fuerzan otra
+        self.db_manager.guardar_version_resumenes(codigo, version)
+        return contadores
+    
+    def indexar_resumenes(self, codigo_reporte: str, batch_size: int = None) -> Dict:
+        """
+        Regenerar solo los resúmenes por periodo del reporte (sin recorrer registros nuevos)
+        La cola de indexación lo ejecuta con su propia frecuencia, agrupando las
+        ejecuciones incrementales que ocurrieron entretanto
+        """
+        if os.getenv('INDEX_RESUMENES', '1') not in ('1', 'true', 'si'):
+            return {'resumenes': 0}
+        with self._lock_indexacion(codigo_reporte):
+            try:
+                ctx = self._preparar_indexacion(codigo_reporte)
+                collection = self._coleccion_reporte(ctx)
+                if ctx.get('reconstruida'):
+                    # Índice vacío tras cambiar de proveedor: reindexar todo (incluye resúmenes)
+                    return self.indexar_datos_reporte(codigo_reporte)
+                contadores = self._indexar_resumenes(ctx, collection, batch_size)
+                logger.info(f"Resúmenes de {codigo_reporte}: {contadores}")
+                return contadores
+            finally:
+                self._incrementar_version_indice(codigo_reporte)
+    
+    def _lock_indexacion(self, codigo_reporte: str) -> threading.RLock:
+        with self._locks_indexacion_guardia:
+            return self._locks_indexacion.setdefault(codigo_reporte, threading.RLock())
+    
+    def indexar_datos_reporte(self, codigo_reporte: str, completo: bool = False,
+                              tamano_pagina: int = 1000, batch_size: int = None,
+                              resumenes: bool = True):
+        """
+        Indexar datos de un reporte en ChromaDB para búsqueda semántica
+        
+        Incremental: recorre en páginas solo los registros con id mayor a la marca
+        guardada en indexacion_estado y la avanza después de cada página, así el
+        costo es proporcional a lo nuevo y un corte a mitad de camino se retoma.
+        
+        Los ids se asignan al insertar y no al confirmar: una transacción abierta
+        durante la ejecución anterior puede confirmar después filas con id menor a la
+        marca. Por eso cada ejecución vuelve a revisar las filas bajo la marca creadas
+        desde el inicio de la transacción más antigua que estaba abierta cuando empezó
+        la ejecución anterior (pendiente_desde); las que ya estaban indexadas se omiten
+        por hash sin recalcular embeddings.
+        
+        Args:
+            completo: Reiniciar la marca y reindexar todo el reporte
+            resumenes: Regenerar también los resúmenes por periodo; la cola de indexación
+                los programa aparte (indexar_resumenes) para no agregar el reporte
+                completo en cada ejecución incremental
+        """
+        with self._lock_indexacion(codigo_reporte):
+            try:
+                ctx = self._preparar_indexacion(codigo_reporte)
+                collection = self._coleccion_reporte(ctx)
                 
-                # Encabezado con contexto del reporte
-                texto = f"Reporte: {reporte['nombre']}\n"
-                if contexto_reporte:
-                    texto += f"Contexto: {contexto_reporte[:200]}\n"
-                texto += "\n--- Registro ---\n"
+                if completo:
+                    self.db_manager.reiniciar_marca_indexacion(codigo_reporte)
+                # Antes de leer: lo que aún no es visible pertenece a transacciones iniciadas desde aquí
+                ventana_siguiente = self.db_manager.inicio_transacciones_abiertas()
+                ventana = self.db_manager.obtener_ventana_indexacion(codigo_reporte)
+                marca = self.db_manager.obtener_marca_indexacion(codigo_reporte)
                 
-                # Agregar cada campo con su descripción
-                for k, v in datos_dict.items():
-                    if v is not None:
-                        # Usar documentación del campo si existe
-                        if k in docs_campos and docs_campos[k].get('descripcion'):
-                            texto += f"{docs_campos[k]['etiqueta']} ({docs_campos[k]['descripcion']}): {v}\n"
-                        else:
-                            texto += f"{k}: {v}\n"
+                # El maestro se revisa en cada ejecución (solo se reembebe si la configuración cambió)
+                contadores = self._upsert_documentos(collection, [self._documento_maestro(ctx)])
                 
-                documents.append(texto)
-                metadatas.append({
-                    'id_registro': str(registro['id']),
-                    'fecha_carga': str(registro['created_at']),
-                    'reporte': codigo_reporte
-                })
-                ids.append(f"{codigo_reporte}_{registro['id']}")
-            
-            # Indexar en lotes
-            batch_size = 100
-            total_indexed = 0
-            
-            for i in range(0, len(documents), batch_size):
-                batch_docs = documents[i:i+batch_size]
-                batch_metas = metadatas[i:i+batch_size]
-                batch_ids = ids[i:i+batch_size]
+                total_indexed = 0
+                revisados_ventana = 0
+                politica = ctx['politica_registros']
+                muestra_pct = ctx['muestra_pct'] if politica == 'muestra' else None
+                if politica == 'ninguno':
+                    if completo:
+                        collection.delete(where={'tipo': 'registro'})
+                else:
+                    if ventana is not None and marca:
+                        # Filas confirmadas tarde por debajo de la marca (no la mueven)
+                        tardias = self.db_manager.iterar_datos_reporte(
+                            codigo_reporte, hasta_id=marca, creados_desde=ventana,
+                            tamano_pagina=tamano_pagina, muestra_pct=muestra_pct
+                        )
+                        for pagina in tardias:
+                            documentos = [self._documento_registro(ctx, registro) for registro in pagina]
+                            for clave, valor in self._upsert_documentos(collection, documentos, batch_size).items():
+                                contadores[clave] += valor
+                            revisados_ventana += len(pagina)
+                    
+                    paginas = self.db_manager.iterar_datos_reporte(
+                        codigo_reporte, desde_id=marca, tamano_pagina=tamano_pagina,
+                        muestra_pct=muestra_pct
+                    )
+                    for pagina in paginas:
+                        documentos = [self._documento_registro(ctx, registro) for registro in pagina]
+                        for clave, valor in self._upsert_documentos(collection, documentos, batch_size).items():
+                            contadores[clave] += valor
+                        
+                        # Avanzar la marca solo cuando la página completa quedó en el índice
+                        marca = self.db_manager.avanzar_marca_indexacion(
+                            codigo_reporte, pagina[-1]['id'], len(pagina)
+                        )
+                        total_indexed += len(pagina)
+                
+                # Solo tras completar la pasada: si falla, la próxima revisa desde la ventana anterior
+                self.db_manager.guardar_ventana_indexacion(codigo_reporte, ventana_siguiente)
+                
+                # Resúmenes por periodo (totales y tendencias calculados en SQL)
+                if resumenes and os.getenv('INDEX_RESUMENES', '1') in ('1', 'true', 'si'):
+                    resumen = self._indexar_resumenes(ctx, collection, batch_size)
+                    for clave, valor in resumen.items():
+                        contadores[clave] = contadores.get(clave, 0) + valor
+                
+                if total_indexed:
+                    logger.info(
+                        f"Indexados {total_indexed} registros nuevos de {codigo_reporte} (marca {marca}): "
+                        f"{contadores['embebidos']} embebidos, {contadores['omitidos']} sin cambios"
+                    )
+                else:
+                    logger.info(f"No hay datos nuevos para indexar en {codigo_reporte}")
                 
-                collection.add(
-                    documents=batch_docs,
-                    metadatas=batch_metas,
-                    ids=batch_ids
+                return {
+                    'indexed': total_indexed,
+                    'revisados_ventana': revisados_ventana,
+                    'ultimo_id': marca,
+                    'collection': collection.name,
+                    **contadores
+                }
+                
+            except Exception as e:
+                import traceback
+                logger.error(f"Error indexando datos: {e}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                raise
+            finally:
+                self._incrementar_version_indice(codigo_reporte)
+    
+    def indexar_carga(self, codigo_reporte: str, carga_ids, batch_size: int = None,
+                      resumenes: bool = True):
+        """
+        Indexar solo los registros que aportaron una o varias cargas aprobadas
+        Usa upsert, por lo que repetir el trabajo no duplica documentos; el costo
+        depende del tamaño de la carga y no del tamaño total del índice
+        (resumenes: ver indexar_datos_reporte).
+        """
+        with self._lock_indexacion(codigo_reporte):
+            try:
+                ctx = self._preparar_indexacion(codigo_reporte)
+                collection = self._coleccion_reporte(ctx)
+                if ctx.get('reconstruida'):
+                    # Índice vacío tras cambiar de proveedor: indexar la carga sola lo dejaría incompleto
+                    return self.indexar_datos_reporte(codigo_reporte, resumenes=resumenes)
+                
+                # El maestro asegura contexto en colecciones nuevas (sin costo si no cambió)
+                contadores = self._upsert_documentos(collection, [self._documento_maestro(ctx)])
+                
+                total_indexed = 0
+                politica = ctx['politica_registros']
+                paginas = [] if politica == 'ninguno' else self.db_manager.consultar_datos_carga(
+                    codigo_reporte, carga_ids,
+                    muestra_pct=ctx['muestra_pct'] if politica == 'muestra' else None
                 )
-                total_indexed += len(batch_docs)
-            
-            logger.info(f"Indexados {total_indexed} registros de {codigo_reporte}")
-            
-            return {
-                'indexed': total_indexed,
-                'collection': collection_name
-            }
-            
-        except Exception as e:
-            import traceback
-            logger.error(f"Error indexando datos: {e}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            raise
+                for pagina in paginas:
+                    documentos = [self._documento_registro(ctx, registro) for registro in pagina]
+                    for clave, valor in self._upsert_documentos(collection, documentos, batch_size).items():
+                        contadores[clave] += valor
+                    total_indexed += len(documentos)
+                
+                # Las cargas aprobadas cambian los totales de sus periodos
+                if resumenes and os.getenv('INDEX_RESUMENES', '1') in ('1', 'true', 'si'):
+                    resumen = self._indexar_resumenes(ctx, collection, batch_size)
+                    for clave, valor in resumen.items():
+                        contadores[clave] = contadores.get(clave, 0) + valor
+                
+                logger.info(
+                    f"Indexados {total_indexed} registros de las cargas {carga_ids} ({codigo_reporte}): "
+                    f"{contadores['embebidos']} embebidos, {contadores['omitidos']} sin cambios"
+                )
+                
+                return {
+                    'indexed': total_indexed,
+                    'carga_ids': carga_ids,
+                    'collection': collection.name,
+                    **contadores
+                }
+                
+            except Exception as e:
+                import traceback
+                logger.error(f"Error indexando cargas {carga_ids}: {e}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                raise
+            finally:
+                self._incrementar_version_indice(codigo_reporte)
+    
+    # ============================================
+    # CACHE DE BÚSQUEDA
+    # ============================================
+    
+    def version_indice(self, codigo_reporte: str) -> int:
+        return self._version_indice.get(codigo_reporte, 0)
+    
+    def _incrementar_version_indice(self, codigo_reporte: str):
+        """Cambió el índice del reporte: sus entradas en cache dejan de ser alcanzables"""
+        self._version_indice[codigo_reporte] = self.version_indice(codigo_reporte) + 1
+        self.cache_busqueda.invalidar(lambda clave: clave[0] == codigo_reporte)
+    
+    def buscar_con_cache(self, codigo_reporte: str, consulta: str, limite: int = 5,
+                         modo: str = 'vector', **opciones) -> Dict:
+        """
+        Búsqueda (vectorial o híbrida) con cache LRU
+        Clave: (reporte, consulta normalizada, modo, límite, filtros, versión del índice)
+        
+        En modo híbrido la clave suma la versión de los datos: la búsqueda de texto lee
+        datos_reportes directamente y ve filas nuevas o purgadas antes que el índice.
+        Es el contador de datos_version (búsqueda por clave), así un acierto no recorre
+        los registros del reporte
+        """
+        clave = (
+            codigo_reporte,
+            normalizar_consulta(consulta),
+            modo,
+            int(limite),
+            json.dumps(opciones, sort_keys=True, default=str),
+            self.version_indice(codigo_reporte),
+            self.db_manager.version_datos_reporte(codigo_reporte) if modo == 'hibrido' else None
+        )
+        resultado = self.cache_busqueda.obtener(clave)
+        if resultado is not None:
+            return {**resultado, 'cache': 'hit'}
+        
+        if modo == 'hibrido':
+            resultado = self.buscar_hibrido(codigo_reporte, consulta, limite, **opciones)
+        else:
+            resultado = self.consultar_con_lenguaje_natural(
+                codigo_reporte, consulta, limite,
+                where=opciones.get('where'),
+                auto_filtros=opciones.get('auto_filtros', True)
+            )
+        self.cache_busqueda.guardar(clave, resultado)
+        return {**resultado, 'cache': 'miss'}
+    
+    # ============================================
+    # HIGIENE DEL ÍNDICE
+    # ============================================
+    
+    def _coleccion_existente(self, codigo_reporte: str):
+        """Colección del reporte si existe (sin crearla); None si no hay índice"""
+        try:
+            return self.chroma_client.get_collection(
+                f"reporte_{codigo_reporte.replace(' ', '_')}",
+                embedding_function=self.embedding_function
+            )
+        except Exception:
+            return None
+    
+    def eliminar_vectores(self, codigo_reporte: str, registro_ids=None, where: Dict = None,
+                          batch_size: int = None) -> int:
+        """
+        Retirar documentos de registros del índice por id de datos_reportes (en lotes)
+        o por filtro de metadata (p. ej. {'carga_id': 12})
+        """
+        collection = self._coleccion_existente(codigo_reporte)
+        if collection is None:
+            return 0
+        
+        eliminados = 0
+        if where:
+            antes = collection.count()
+            collection.delete(where=where)
+            eliminados += antes - collection.count()
+        if registro_ids:
+            ids = [f"{codigo_reporte}_{registro_id}" for registro_id in registro_ids]
+            batch_size = batch_size or self.chroma_batch_size
+            for i in range(0, len(ids), batch_size):
+                collection.delete(ids=ids[i:i+batch_size])
+            eliminados += len(ids)
+        
+        self._incrementar_version_indice(codigo_reporte)
+        logger.info(f"Vectores retirados de {codigo_reporte}: {eliminados}")
+        return eliminados
+    
+    def eliminar_indice_reporte(self, codigo_reporte: str) -> bool:
+        """Eliminar la colección completa del reporte y reiniciar su marca de indexación"""
+        collection = self._coleccion_existente(codigo_reporte)
+        self.db_manager.reiniciar_marca_indexacion(codigo_reporte)
+        # Aun sin colección: los datos cambiaron y las búsquedas en cache ya no valen
+        self._incrementar_version_indice(codigo_reporte)
+        if collection is None:
+            return False
+        self.chroma_client.delete_collection(collection.name)
+        logger.info(f"Índice de {codigo_reporte} eliminado")
+        return True
+    
+    def reconciliar_indice(self, codigo_reporte: str, tamano_pagina: int = 1000) -> Dict:
+        """
+        Comparar los ids de la colección con datos_reportes y eliminar los huérfanos
+        (registros borrados fuera de los flujos que ya limpian el índice)
+        """
+        collection = self._coleccion_existente(codigo_reporte)
+        if collection is None:
+            return {'reporte': codigo_reporte, 'revisados': 0, 'huerfanos': 0}
+        
+        prefijo = f"{codigo_reporte}_"
+        revisados = 0
+        huerfanos = []
+        offset = 0
+        while True:
+            pagina = collection.get(include=[], limit=tamano_pagina, offset=offset)
+            ids = pagina['ids']
+            if not ids:
+                break
+            offset += len(ids)
+            
+            # Solo documentos de registro ({codigo}_{id}); el maestro y otros se conservan
+            por_registro = {}
+            for id_doc in ids:
+                sufijo = id_doc[len(prefijo):] if id_doc.startswith(prefijo) else ''
+                if sufijo.isdigit():
+                    por_registro[int(sufijo)] = id_doc
+            revisados += len(por_registro)
+            existentes = self.db_manager.ids_datos_existentes(codigo_reporte, list(por_registro))
+            huerfanos.extend(id_doc for registro_id, id_doc in por_registro.items() if registro_id not in existentes)
+        
+        # Borrar al final para no desplazar el offset mientras se recorre
+        batch_size = self.chroma_batch_size
+        for i in range(0, len(huerfanos), batch_size):
+            collection.delete(ids=huerfanos[i:i+batch_size])
+        if huerfanos:
+            self._incrementar_version_indice(codigo_reporte)
+        
+        logger.info(f"Reconciliación de {codigo_reporte}: {revisados} revisados, {len(huerfanos)} huérfanos eliminados")
+        return {
+            'reporte': codigo_reporte,
+            'revisados': revisados,
+            'huerfanos': len(huerfanos),
+            'total_coleccion': collection.count()
+        }
     
-    def consultar_con_lenguaje_natural(self, codigo_reporte: str, pregunta: str, limite: int = 5):
-        """Buscar datos usando lenguaje natural"""
+    def consultar_con_lenguaje_natural(self, codigo_reporte: str, pregunta: str, limite: int = 5,
+                                       where: Dict = None, auto_filtros: bool = True):
+        """
+        Buscar datos usando lenguaje natural
+        
+        Args:
+            where: Filtro de metadata de ChromaDB (ver busqueda.construir_where)
+            auto_filtros: Sin where explícito, deducir mes/año de la pregunta
+        """
         try:
             collection_name = f"reporte_{codigo_reporte.replace(' ', '_')}"
             
             try:
                 collection = self.chroma_client.get_or_create_collection(
                     name=collection_name,
-                    metadata={"reporte": codigo_reporte}
+                    embedding_function=self.embedding_function,
+                    metadata={"reporte": codigo_reporte, "embeddings": self.nombre_embeddings}
                 )
-                # Si la colección existe pero está vacía, indexar
-                if collection.count() == 0:
-                    self.indexar_datos_reporte(codigo_reporte)
-                    collection = self.chroma_client.get_collection(collection_name)
+                # Si la colección existe pero está vacía o fue indexada con otro proveedor
+                # de embeddings, indexar (completo: la marca puede haber quedado de una
+                # colección ya borrada)
+                if collection.count() == 0 or not self._embeddings_compatibles(collection):
+                    self.indexar_datos_reporte(codigo_reporte, completo=True)
+                    collection = self.chroma_client.get_collection(collection_name, embedding_function=self.embedding_function)
             except Exception as e:
                 logger.error(f"Error al obtener/crear colección: {e}")
                 # Si no existe, indexar primero
-                self.indexar_datos_reporte(codigo_reporte)
-                collection = self.chroma_client.get_collection(collection_name)
+                self.indexar_datos_reporte(codigo_reporte, completo=True)
+                collection = self.chroma_client.get_collection(collection_name, embedding_function=self.embedding_function)
             
-            # Buscar en ChromaDB
+            filtro_deducido = None
+            if where is None and auto_filtros:
+                filtro_deducido = extraer_filtros_pregunta(pregunta)
+            filtro = where or filtro_deducido
+            
+            # Buscar en ChromaDB (solo sobre el subconjunto que cumple el filtro)
             resultados = collection.query(
                 query_texts=[pregunta],
-                n_results=limite
+                n_results=limite,
+                where=filtro
             )
             
+            # Un filtro deducido que no encuentra nada (p. ej. el campo de fecha no está
+            # configurado) no debe dejar la búsqueda vacía
+            if filtro_deducido and not (resultados['ids'] and resultados['ids'][0]):
+                filtro = None
+                resultados = collection.query(query_texts=[pregunta], n_results=limite)
+            
             return {
                 'pregunta': pregunta,
                 'resultados': resultados['documents'][0] if resultados['documents'] else [],
-                'metadatos': resultados['metadatas'][0] if resultados['metadatas'] else []
+                'metadatos': resultados['metadatas'][0] if resultados['metadatas'] else [],
+                'filtro': filtro
             }
             
         except Exception as e:
             logger.error(f"Error en consulta: {e}")
             raise
     
-    def generar_analisis_ia(self, codigo_reporte: str, tipo_analisis: str = 'general'):
-        """Generar análisis con IA de los datos"""
+    def buscar_hibrido(self, codigo_reporte: str, consulta: str, limite: int = 5,
+                       fecha_inicio=None, fecha_fin=None, carga_id=None, filtros: Dict = None,
+                       where: Dict = None, auto_filtros: bool = True) -> Dict:
+        """
+        Búsqueda híbrida: texto completo en Postgres (índice GIN) y vectorial en ChromaDB
+        en paralelo, fusionadas por Reciprocal Rank Fusion
+        
+        Una consulta de un solo identificador (factura, NIT) que ya encuentra coincidencias
+        exactas responde solo con el índice de texto, sin calcular embeddings.
+        
+        Ambos lados filtran el mismo subconjunto: un where crudo se traduce a SQL
+        (ValueError si usa operadores sin equivalente) y, sin filtros, el mes/año
+        deducido de la consulta también acota la búsqueda de texto.
+        """
+        inicio = time.perf_counter()
+        reporte = self.db_manager.obtener_reporte(codigo_reporte)
+        if not reporte:
+            raise ValueError(f"Reporte {codigo_reporte} no encontrado")
+        
+        if where:
+            filtro_texto = traducir_where(where)
+        else:
+            filtro_texto = {
+                'fecha_inicio': fecha_inicio,
+                'fecha_fin': fecha_fin,
+                'carga_id': carga_id,
+                'filtros': {
+                    campo[len(PREFIJO_CAMPO):] if campo.startswith(PREFIJO_CAMPO) else campo: valor
+                    for campo, valor in (filtros or {}).items()
+                }
+            }
+            where = construir_where(fecha_inicio=fecha_inicio, fecha_fin=fecha_fin,
+                                    carga_id=carga_id, filtros=filtros)
+            if where is None and auto_filtros:
+                # El lado vectorial deduce el mismo período en consultar_con_lenguaje_natural
+                filtro_texto['anios'], filtro_texto['meses'] = extraer_periodo_pregunta(consulta)
+        
+        candidatos = max(limite * 2, 10)
+        buscar_texto = lambda: self.db_manager.buscar_texto_datos(
+            codigo_reporte, consulta, limite=candidatos,
+            campo_fecha=reporte.get('campo_fecha'), **filtro_texto
+        )
+        
+        tiempos = {}
+        if es_token_exacto(consulta):
+            filas_texto = buscar_texto()
+            tiempos['texto_ms'] = round((time.perf_counter() - inicio) * 1000, 2)
+            vectorial = None
+            if not filas_texto:
+                vectorial = self.consultar_con_lenguaje_natural(
+                    codigo_reporte, consulta, candidatos, where=where, auto_filtros=auto_filtros
+                )
+        else:
+            futuro_texto = self._pool_busqueda.submit(buscar_texto)
+            futuro_vector = self._pool_busqueda.submit(
+                self.consultar_con_lenguaje_natural, codigo_reporte, consulta, candidatos,
+                where, auto_filtros
+            )
+            filas_texto = futuro_texto.result()
+            vectorial = futuro_vector.result()
+        
+        # Unificar por id de registro; el documento maestro no participa de la fusión
+        documentos = {}
+        ranking_vector = []
+        if vectorial:
+            for texto, metadata in zip(vectorial['resultados'], vectorial['metadatos']):
+                if metadata and metadata.get('id_registro'):
+                    registro_id = int(metadata['id_registro'])
+                    ranking_vector.append(registro_id)
+                    documentos[registro_id] = (texto, metadata)
+        
+        ranking_texto = [fila['id'] for fila in filas_texto]
+        solo_texto = [fila for fila in filas_texto if fila['id'] not in documentos]
+        if solo_texto:
+            ctx = self._preparar_indexacion(codigo_reporte)
+            for fila in solo_texto:
+                texto, metadata, _ = self._documento_registro(ctx, fila)
+                documentos[fila['id']] = (texto, metadata)
+        
+        fusionados = fusionar_rrf([ranking_texto, ranking_vector])[:limite]
+        en_texto, en_vector = set(ranking_texto), set(ranking_vector)
+        
+        tiempos['total_ms'] = round((time.perf_counter() - inicio) * 1000, 2)
+        return {
+            'pregunta': consulta,
+            'modo': 'hibrido',
+            'resultados': [documentos[registro_id][0] for registro_id, _ in fusionados],
+            'metadatos': [
+                {
+                    **documentos[registro_id][1],
+                    'puntaje_rrf': round(puntaje, 6),
+                    'fuentes': [f for f, ids in (('texto', en_texto), ('vector', en_vector)) if registro_id in ids]
+                }
+                for registro_id, puntaje in fusionados
+            ],
+            'filtro': vectorial['filtro'] if vectorial else None,
+            'tiempos': tiempos
+        }
+    
+    def _buscar_registros(self, codigo_reporte: str, consulta: str, fecha_inicio: str = None,
+                          fecha_fin: str = None, filtros: Dict = None, limite: int = 10) -> Dict:
+        """Búsqueda semántica filtrada (función disponible para el chat)"""
+        try:
+            where = construir_where(fecha_inicio=fecha_inicio, fecha_fin=fecha_fin, filtros=filtros)
+            resultado = self.consultar_con_lenguaje_natural(
+                codigo_reporte, consulta, limite=min(int(limite), 50), where=where
+            )
+            return {
+                'consulta': consulta,
+                'filtro': resultado['filtro'],
+                'registros': resultado['resultados']
+            }
+        except Exception as e:
+            logger.error(f"Error buscando registros: {e}")
+            return {"error": str(e)}
+    
+    def _instantanea_analisis(self, codigo_reporte: str, limite: int = 100) -> Optional[Dict]:
+        """
+        Datos compartidos por los análisis IA de un reporte: configuración, muestra,
+        estadísticas, gráficos y versión de datos (se consulta una sola vez por informe)
+        """
+        reporte = self.db_manager.obtener_reporte(codigo_reporte)
+        datos = self.db_manager.consultar_datos(codigo_reporte, limite=limite)
+        if not datos:
+            return None
+        
+        # Convertir a DataFrame para estadísticas
+        df_datos = pd.DataFrame([d['datos'] for d in datos])
+        try:
+            version_datos = self.db_manager.version_datos_reporte(codigo_reporte)
+        except Exception as e:
+            logger.warning(f"No se pudo calcular la versión de datos de {codigo_reporte}: {e}")
+            version_datos = None
+        
+        return {
+            'reporte': reporte,
+            'datos': datos,
+            'df': df_datos,
+            'version_datos': version_datos
+        }
+    
+    def generar_analisis_ia(self, codigo_reporte: str, tipo_analisis: str = 'general', forzar: bool = False,
+                            instantanea: Dict = None):
+        """
+        Generar análisis con IA de los datos
+        
+        El resultado se guarda en analisis_cache por versión de datos y de prompt; mientras
+        los datos no cambien y no venza ANALISIS_CACHE_TTL_HORAS se reutiliza sin llamar
+        al modelo. forzar=True regenera siempre.
+        
+        Args:
+            instantanea: Datos ya consultados (_instantanea_analisis) para compartir entre secciones
+        """
         if not self.openai_client:
             return {'error': 'OpenAI no configurado'}
         
         try:
-            # Obtener muestra de datos
-            reporte = self.db_manager.obtener_reporte(codigo_reporte)
-            datos = self.db_manager.consultar_datos(codigo_reporte, limite=100)
-            
-            if not datos:
-                return {'error': 'No hay datos para analizar'}
+            if instantanea is None:
+                instantanea = self._instantanea_analisis(codigo_reporte)
+        except Exception as e:
+            logger.error(f"Error en análisis IA: {e}")
+            return {'error': str(e)}
+        if not instantanea:
+            return {'error': 'No hay datos para analizar'}
+        
+        version_datos = instantanea['version_datos']
+        try:
+            if version_datos and not forzar:
+                cacheado = self.db_manager.obtener_analisis_cache(
+                    codigo_reporte, tipo_analisis, version_datos, VERSION_PROMPT_ANALISIS,
+                    float(os.getenv('ANALISIS_CACHE_TTL_HORAS', 24))
+                )
+                if cacheado:
+                    logger.info(f"Análisis {tipo_analisis} de {codigo_reporte} servido desde cache")
+                    return {
+                        **cacheado['resultado'],
+                        'cache': {'hit': True, 'generado': cacheado['creado_en'].isoformat()}
+                    }
+        except Exception as e:
+            # Sin tabla de cache (migración pendiente) el análisis se genera igual
+            logger.warning(f"Cache de análisis no disponible: {e}")
+        
+        try:
+            reporte = instantanea['reporte']
+            datos = instantanea['datos']
+            df_datos = instantanea['df']
             
             # Obtener contexto del reporte
             contexto_reporte = reporte.get('contexto', '')
             descripcion_reporte = reporte.get('descripcion', '')
             campos_config = reporte.get('campos', [])
             
-            # Convertir a DataFrame para estadísticas
-            df_datos = pd.DataFrame([d['datos'] for d in datos])
-            
             # Generar resumen estadístico
             resumen = {
                 'total_registros': len(datos),
@@ -745,7 +1547,7 @@ Capacidades del sistema:
             
             analisis = response.choices[0].message.content
             
-            return {
+            resultado = {
                 'tipo_analisis': tipo_analisis,
                 'reporte': reporte['nombre'],
                 'total_registros': resumen['total_registros'],
@@ -754,6 +1556,16 @@ Capacidades del sistema:
                 'timestamp': datetime.now().isoformat()
             }
             
+            if version_datos:
+                try:
+                    self.db_manager.guardar_analisis_cache(
+                        codigo_reporte, tipo_analisis, version_datos, VERSION_PROMPT_ANALISIS, resultado
+                    )
+                except Exception as e:
+                    logger.warning(f"No se pudo guardar el análisis en cache: {e}")
+            
+            return {**resultado, 'cache': {'hit': False}}
+            
         except Exception as e:
             logger.error(f"Error generando análisis: {e}")
             raise
@@ -814,26 +1626,33 @@ Capacidades del sistema:
         if not self.openai_client:
             return {'error': 'OpenAI no configurado'}
         
-        try:
-            # Obtener info del reporte
-            reporte = self.db_manager.obtener_reporte(codigo_reporte)
-            
-            # Obtener contexto y descripción del reporte
-            contexto_reporte = reporte.get('contexto', 'No especificado')
-            descripcion_reporte = reporte.get('descripcion', '')
-            campos_config = reporte.get('campos', [])
-            
-            # Documentación de campos
-            docs_campos_texto = "\n".join([
-                f"  • {c.get('etiqueta', c.get('nombre'))}: {c.get('descripcion', 'Sin descripción')} (Tipo: {c.get('tipo_dato', c.get('tipo', 'texto'))})"
-                for c in campos_config
-            ])
-            
-            # Obtener lista de campos disponibles
-            campos_disponibles = [c.get('nombre') for c in campos_config]
-            
-            # Preparar contexto del sistema con información del reporte
-            system_context = f"""Eres un analista de datos experto con capacidad de ejecutar funciones para analizar datos.
+        # Mismo flujo que el modo streaming: se consumen los eventos y se devuelve el final
+        for evento in self.responder_pregunta_stream(codigo_reporte, pregunta, session_id):
+            if evento['evento'] in ('fin', 'error'):
+                return {k: v for k, v in evento.items() if k != 'evento'}
+        return {'error': 'La respuesta terminó sin resultado'}
+    
+    def _mensajes_pregunta(self, codigo_reporte: str, pregunta: str, session_id: str) -> List[Dict]:
+        """Prompt del sistema con el contexto del reporte + historial de la sesión + pregunta"""
+        # Obtener info del reporte
+        reporte = self.db_manager.obtener_reporte(codigo_reporte)
+        
+        # Obtener contexto y descripción del reporte
+        contexto_reporte = reporte.get('contexto', 'No especificado')
+        descripcion_reporte = reporte.get('descripcion', '')
+        campos_config = reporte.get('campos', [])
+        
+        # Documentación de campos
+        docs_campos_texto = "\n".join([
+            f"  • {c.get('etiqueta', c.get('nombre'))}: {c.get('descripcion', 'Sin descripción')} (Tipo: {c.get('tipo_dato', c.get('tipo', 'texto'))})"
+            for c in campos_config
+        ])
+        
+        # Obtener lista de campos disponibles
+        campos_disponibles = [c.get('nombre') for c in campos_config]
+        
+        # Preparar contexto del sistema con información del reporte
+        system_context = f"""Eres un analista de datos experto con capacidad de ejecutar funciones para analizar datos.
 
 🎯 REPORTE ACTUAL: {reporte['nombre']}
 📋 CÓDIGO: {codigo_reporte}
@@ -855,6 +1674,7 @@ CONTEXTO DEL NEGOCIO:
 - Para cálculos, SIEMPRE usa calcular_total_campo
 - Para rankings/tops, usa agrupar_por_campo  
 - Para comparaciones temporales, usa comparar_periodos
+- Puedes pedir varias funciones a la vez y encadenar rondas: usa los resultados de una para decidir la siguiente (ej. comparar y luego desglosar el mayor)
 - Responde en español con números específicos
 - Presenta resultados de forma clara y profesional
 - Si necesitas fechas y no las especifican, pregunta o asume el mes actual (febrero 2026)
@@ -862,102 +1682,184 @@ CONTEXTO DEL NEGOCIO:
 CAMPOS NUMÉRICOS COMUNES: {', '.join([c.get('nombre') for c in campos_config if c.get('tipo_dato') in ['numero', 'decimal'] or c.get('tipo') in ['numero', 'decimal']])}
 """
 
-            # Obtener historial de conversación
-            historial = self.obtener_historial(session_id)
-            
-            # Construir mensajes para OpenAI
-            messages = [{"role": "system", "content": system_context}]
-            messages.extend(historial)  # Agregar historial previo
-            messages.append({"role": "user", "content": pregunta})
-            
-            # Primera llamada con function calling
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                tools=self._get_available_functions(),
-                tool_choice="auto",
-                temperature=0.2
-            )
-            
-            response_message = response.choices[0].message
-            tool_calls = response_message.tool_calls
-            
-            # Si el modelo decidió usar funciones
-            if tool_calls:
-                # Agregar la respuesta del asistente al historial
-                messages.append(response_message)
-                
-                # Ejecutar cada función solicitada
-                for tool_call in tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-                    
-                    logger.info(f"🔧 Ejecutando función: {function_name} con args: {function_args}")
-                    
-                    # Ejecutar la función
-                    function_response = self._ejecutar_funcion(function_name, function_args, codigo_reporte)
-                    
-                    # Agregar resultado de la función a los mensajes
-                    messages.append({
-                        "tool_call_id": tool_call.id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": json.dumps(function_response, ensure_ascii=False)
-                    })
-                
-                # Segunda llamada para obtener respuesta final con los resultados de las funciones  
-                second_response = self.openai_client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=messages,
-                    temperature=0.2
+        # Obtener historial de conversación
+        historial = self.obtener_historial(session_id)
+        
+        # Construir mensajes para OpenAI
+        messages = [{"role": "system", "content": system_context}]
+        messages.extend(historial)  # Agregar historial previo
+        messages.append({"role": "user", "content": pregunta})
+        return messages
+    
+    def _completar_stream(self, messages: List[Dict], tools: List[Dict] = None):
+        """
+        Llamada a chat.completions en streaming
+        Produce ('token', texto) por cada fragmento de contenido y al final
+        ('mensaje', (contenido, llamadas)) con las tool calls ya reensambladas
+        """
+        parametros = {"model": "gpt-4o", "messages": messages, "temperature": 0.2, "stream": True}
+        if tools:
+            parametros.update(tools=tools, tool_choice="auto")
+        
+        contenido = []
+        llamadas = {}  # {index: {'id', 'nombre', 'argumentos'}}: los argumentos llegan por partes
+        for chunk in self.openai_client.chat.completions.create(**parametros):
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                contenido.append(delta.content)
+                yield 'token', delta.content
+            for tc in delta.tool_calls or []:
+                llamada = llamadas.setdefault(tc.index, {'id': None, 'nombre': '', 'argumentos': ''})
+                if tc.id:
+                    llamada['id'] = tc.id
+                if tc.function:
+                    llamada['nombre'] += tc.function.name or ''
+                    llamada['argumentos'] += tc.function.arguments or ''
+        
+        yield 'mensaje', (''.join(contenido), [llamadas[i] for i in sorted(llamadas)])
+    
+    def responder_pregunta_stream(self, codigo_reporte: str, pregunta: str, session_id: str = "default"):
+        """
+        Responder pregunta emitiendo eventos a medida que avanza (modo SSE del chat)
+        - funcion_inicio {paso, nombre, argumentos} / funcion_fin {paso, nombre, resultado, duracion_seg}
+        - token {texto}: fragmentos de la respuesta a medida que llegan del modelo
+        - fin: el mismo resultado que devuelve responder_pregunta
+        - error {error}
+        El modelo puede encadenar hasta AGENTE_MAX_PASOS rondas de funciones dentro de
+        AGENTE_PRESUPUESTO_SEG; las funciones de una ronda corren en paralelo. Las que no
+        terminan dentro del presupuesto se informan al modelo como {'error': 'tiempo agotado'}
+        (siguen en su hilo, sin esperarlas) y la ronda siguiente es la final.
+        Texto emitido antes de una llamada a funciones es preámbulo: la respuesta es la
+        que trae el evento fin, que además se guarda en el historial de la sesión.
+        """
+        if not self.openai_client:
+            yield {'evento': 'error', 'error': 'OpenAI no configurado'}
+            return
+        
+        try:
+            messages = self._mensajes_pregunta(codigo_reporte, pregunta, session_id)
+            
+            inicio = time.perf_counter()
+            funciones_ejecutadas = []
+            respuesta_final = ''
+            paso = 0
+            presupuesto_agotado = False
+            
+            # Bucle de function calling: cada ronda puede pedir funciones sobre los resultados
+            # de la anterior; en la última ronda (o sin presupuesto) se fuerza la respuesta
+            while True:
+                paso += 1
+                ultima_ronda = (
+                    paso >= AGENTE_MAX_PASOS
+                    or presupuesto_agotado
+                    or time.perf_counter() - inicio >= AGENTE_PRESUPUESTO_SEG
                 )
+                tools = None if ultima_ronda else self._get_available_functions()
                 
-                respuesta_final = second_response.choices[0].message.content
+                respuesta_final, llamadas = '', []
+                for tipo, valor in self._completar_stream(messages, tools=tools):
+                    if tipo == 'token':
+                        yield {'evento': 'token', 'texto': valor}
+                    else:
+                        respuesta_final, llamadas = valor
                 
-                # Guardar en historial
-                self.agregar_mensaje(session_id, "user", pregunta)
-                self.agregar_mensaje(session_id, "assistant", respuesta_final)
+                if not llamadas:
+                    break
                 
-                return {
-                    'pregunta': pregunta,
-                    'respuesta': respuesta_final,
-                    'funciones_ejecutadas': [tc.function.name for tc in tool_calls],
-                    'session_id': session_id,
-                    'timestamp': datetime.now().isoformat()
-                }
-            else:
-                # No se usaron funciones, respuesta directa
-                respuesta_final = response_message.content
+                # Agregar la respuesta del asistente con sus tool calls
+                messages.append({
+                    "role": "assistant",
+                    "content": respuesta_final or None,
+                    "tool_calls": [
+                        {"id": ll['id'], "type": "function",
+                         "function": {"name": ll['nombre'], "arguments": ll['argumentos']}}
+                        for ll in llamadas
+                    ]
+                })
                 
-                # Guardar en historial
-                self.agregar_mensaje(session_id, "user", pregunta)
-                self.agregar_mensaje(session_id, "assistant", respuesta_final)
+                # Las funciones de una ronda son independientes: se ejecutan a la vez
+                inicio_ronda = time.perf_counter()
+                futuros = {}
+                for llamada in llamadas:
+                    try:
+                        function_args = json.loads(llamada['argumentos'] or '{}')
+                    except json.JSONDecodeError:
+                        function_args = {}
+                    llamada['args'] = function_args
+                    logger.info(f"🔧 Paso {paso}: ejecutando {llamada['nombre']} con args: {function_args}")
+                    yield {'evento': 'funcion_inicio', 'paso': paso, 'nombre': llamada['nombre'],
+                           'argumentos': function_args}
+                    futuros[self._pool_funciones.submit(
+                        self._ejecutar_funcion_medida, llamada['nombre'], function_args, codigo_reporte
+                    )] = llamada
                 
-                return {
-                    'pregunta': pregunta,
-                    'respuesta': respuesta_final,
-                    'funciones_ejecutadas': [],
-                    'session_id': session_id,
-                    'timestamp': datetime.now().isoformat()
-                }
-            
-        except Exception as e:
-            logger.error(f"Error respondiendo pregunta: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return {'error': str(e), 'traceback': traceback.format_exc()}
+                restante = max(0.0, AGENTE_PRESUPUESTO_SEG - (time.perf_counter() - inicio))
+                try:
+                    for futuro in as_completed(futuros, timeout=restante):
+                        llamada = futuros[futuro]
+                        llamada['resultado'], llamada['duracion_seg'] = futuro.result()
+                        yield {
+                            'evento': 'funcion_fin',
+                            'paso': paso,
+                            'nombre': llamada['nombre'],
+                            'resultado': llamada['resultado'],
+                            'duracion_seg': llamada['duracion_seg']
+                        }
+                except FuturesTimeoutError:
+                    presupuesto_agotado = True
+                    for futuro, llamada in futuros.items():
+                        if 'resultado' in llamada:
+                            continue
+                        futuro.cancel()  # Solo evita las que aún no empezaron
+                        logger.warning(f"⏱️ Paso {paso}: {llamada['nombre']} no terminó dentro del presupuesto")
+                        llamada['resultado'] = {'error': 'tiempo agotado'}
+                        llamada['duracion_seg'] = round(time.perf_counter() - inicio_ronda, 3)
+                        yield {
+                            'evento': 'funcion_fin',
+                            'paso': paso,
+                            'nombre': llamada['nombre'],
+                            'resultado': llamada['resultado'],
+                            'duracion_seg': llamada['duracion_seg']
+                        }
+                
+                # Resultados en el orden de las tool calls
+                for llamada in llamadas:
+                    funciones_ejecutadas.append({
+                        'paso': paso,
+                        'nombre': llamada['nombre'],
+                        'argumentos': llamada['args'],
+                        'duracion_seg': llamada['duracion_seg'],
+                        'error': llamada['resultado'].get('error') if isinstance(llamada['resultado'], dict) else None
+                    })
+                    messages.append({
+                        "tool_call_id": llamada['id'],
+                        "role": "tool",
+                        "name": llamada['nombre'],
+                        "content": json.dumps(llamada['resultado'], ensure_ascii=False, default=str)
+                    })
             
-            # Generar gráfico si se solicitó
-            if solicita_grafico:
-                grafico = self._generar_grafico_personalizado(pregunta, df_datos)
-                if grafico:
-                    resultado['grafico'] = grafico
+            # Guardar en historial
+            self.agregar_mensaje(session_id, "user", pregunta)
+            self.agregar_mensaje(session_id, "assistant", respuesta_final)
             
-            return resultado
+            yield {
+                'evento': 'fin',
+                'pregunta': pregunta,
+                'respuesta': respuesta_final,
+                'funciones_ejecutadas': funciones_ejecutadas,
+                'pasos': paso,
+                'duracion_seg': round(time.perf_counter() - inicio, 3),
+                'session_id': session_id,
+                'timestamp': datetime.now().isoformat()
+            }
             
         except Exception as e:
             logger.error(f"Error respondiendo pregunta: {e}")
-            raise
+            import traceback
+            logger.error(traceback.format_exc())
+            yield {'evento': 'error', 'error': str(e), 'traceback': traceback.format_exc()}
     
     def _generar_grafico_personalizado(self, pregunta: str, df: pd.DataFrame):
         """Generar gráfico basado en la pregunta del usuario"""
@@ -1120,33 +2022,77 @@ CAMPOS NUMÉRICOS COMUNES: {', '.join([c.get('nombre') for c in campos_config if
             logger.error(f"Error generando gráfico personalizado: {e}")
             return None
     
-    def generar_informe_completo(self, codigo_reporte: str):
-        """Generar informe completo con múltiples análisis"""
+    def generar_informe_completo(self, codigo_reporte: str, forzar: bool = False):
+        """
+        Generar informe completo con múltiples análisis
+        
+        Los datos se consultan una sola vez: las estadísticas usan hasta 10000 registros y
+        las tres secciones IA la muestra de los 100 más recientes de esa misma consulta,
+        de modo que todo el informe describe la misma instantánea. Las secciones se piden
+        al modelo en paralelo (máximo INFORME_CONCURRENCIA a la vez).
+        """
         try:
+            inicio = time.perf_counter()
             informe = {
                 'reporte': codigo_reporte,
                 'fecha_generacion': datetime.now().isoformat(),
                 'secciones': {}
             }
             
-            # Análisis general
-            if self.openai_client:
-                informe['secciones']['analisis_general'] = self.generar_analisis_ia(codigo_reporte, 'general')
-                informe['secciones']['tendencias'] = self.generar_analisis_ia(codigo_reporte, 'tendencias')
-                informe['secciones']['anomalias'] = self.generar_analisis_ia(codigo_reporte, 'anomalias')
-            
-            # Estadísticas básicas
+            reporte = self.db_manager.obtener_reporte(codigo_reporte)
             datos = self.db_manager.consultar_datos(codigo_reporte, limite=10000)
             df_datos = pd.DataFrame([d['datos'] for d in datos])
+            tiempos = {'consulta_datos': round(time.perf_counter() - inicio, 3)}
             
+            # Análisis IA por sección sobre la misma instantánea
+            if self.openai_client and datos:
+                try:
+                    version_datos = self.db_manager.version_datos_reporte(codigo_reporte)
+                except Exception as e:
+                    logger.warning(f"No se pudo calcular la versión de datos de {codigo_reporte}: {e}")
+                    version_datos = None
+                muestra = datos[:100]
+                instantanea = {
+                    'reporte': reporte,
+                    'datos': muestra,
+                    # Construido desde la muestra: columnas y tipos iguales a los del análisis suelto
+                    'df': pd.DataFrame([d['datos'] for d in muestra]),
+                    'version_datos': version_datos
+                }
+                
+                def generar_seccion(tipo):
+                    t0 = time.perf_counter()
+                    try:
+                        resultado = self.generar_analisis_ia(
+                            codigo_reporte, tipo, forzar=forzar, instantanea=instantanea
+                        )
+                    except Exception as e:
+                        # Una sección fallida no descarta las demás
+                        resultado = {'error': str(e)}
+                    return resultado, round(time.perf_counter() - t0, 3)
+                
+                t0 = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=max(1, INFORME_CONCURRENCIA),
+                                        thread_name_prefix='informe') as pool:
+                    futuros = {
+                        nombre: pool.submit(generar_seccion, tipo)
+                        for nombre, tipo in SECCIONES_INFORME
+                    }
+                    for nombre, futuro in futuros.items():
+                        informe['secciones'][nombre], tiempos[nombre] = futuro.result()
+                tiempos['secciones_ia'] = round(time.perf_counter() - t0, 3)
+            
+            # Estadísticas básicas
             informe['estadisticas'] = {
                 'total_registros': len(datos),
                 'columnas': list(df_datos.columns),
                 'tipos_datos': df_datos.dtypes.astype(str).to_dict(),
                 'valores_nulos': df_datos.isnull().sum().to_dict(),
-                'estadisticas_numericas': df_datos.describe().to_dict()
+                'estadisticas_numericas': df_datos.describe().to_dict() if not df_datos.empty else {}
             }
             
+            tiempos['total'] = round(time.perf_counter() - inicio, 3)
+            informe['tiempos_seg'] = tiempos
             return informe
             
         except Exception as e:
@@ -1488,8 +2434,10 @@ Responde en formato JSON:
             
             # Si hay campo de valor numérico
             if campo_valor and campo_valor in df.columns:
-                # Convertir a numérico si no lo es
-                df[campo_valor] = pd.to_numeric(df[campo_valor], errors='coerce')
+                # Los datos ya llegan tipados desde la ingesta; solo se convierten
+                # registros cargados antes de la coerción por tipo_dato
+                if not pd.api.types.is_numeric_dtype(df[campo_valor]):
+                    df[campo_valor] = pd.to_numeric(df[campo_valor], errors='coerce')
                 
                 # Agrupar y sumar
                 df_agrupado = df.groupby(campo_agrupacion)[campo_valor].agg(['sum', 'count', 'mean']).reset_index()
@@ -1,5 +1,6 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, Request, request, jsonify, render_template, send_file, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 from dotenv import load_dotenv
 import logging
@@ -7,6 +8,8 @@ import pandas as pd
 from io import BytesIO
 from datetime import datetime
 import json
+import tempfile
+import uuid
 from flask_mail import Mail, Message
 import base64
 
@@ -15,6 +18,12 @@ import threading
 from models import ReporteConfig, CampoConfig, RelacionConfig
 from analysis_agent import DataAnalysisAgent
 from aclaraciones_manager import AclaracionesManager
+from indexador import ColaIndexacion
+from busqueda import construir_where, traducir_where
+from ingesta import (
+    iterar_ndjson, en_lotes, coercionar_columnas, coercionar_registros,
+    leer_muestra_excel, inferir_esquema, calcular_sha256
+)
 
 load_dotenv()
 
@@ -31,6 +40,56 @@ app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', 'noreply@si
 
 mail = Mail(app)
 
+# Tamaño de lote para el webhook NDJSON en streaming
+WEBHOOK_STREAM_LOTE = int(os.getenv('WEBHOOK_STREAM_LOTE', 1000))
+WEBHOOK_STREAM_LOTE_MAX = int(os.getenv('WEBHOOK_STREAM_LOTE_MAX', 10000))
+WEBHOOK_STREAM_MAX_LINEA = int(os.getenv('WEBHOOK_STREAM_MAX_LINEA', 1024 * 1024))
+ANALISIS_EXCEL_MUESTRA = int(os.getenv('ANALISIS_EXCEL_MUESTRA', 1000))
+ANALISIS_EXCEL_MUESTRA_MAX = int(os.getenv('ANALISIS_EXCEL_MUESTRA_MAX', 50000))
+
+# Límites de carga de archivos: global (MAX_UPLOAD_MB) y por reporte (reportes_config.limite_carga_mb)
+MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', 100))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
+# Archivos por encima de este tamaño se vuelcan a disco en lugar de quedar en memoria
+UPLOAD_SPOOL_MEMORIA = int(os.getenv('UPLOAD_SPOOL_MEMORIA_KB', 512)) * 1024
+UPLOAD_TMP_DIR = os.getenv('UPLOAD_TMP_DIR') or None
+# Máximo de Excel grandes parseados a la vez (cada uno ocupa su DataFrame en memoria)
+parseo_excel_semaforo = threading.BoundedSemaphore(int(os.getenv('UPLOAD_PARSEO_CONCURRENTE', 2)))
+# Cargas reanudables por partes: directorio de partes y tamaño máximo de cada PUT
+UPLOAD_SESIONES_DIR = os.getenv('UPLOAD_SESIONES_DIR', os.path.join(tempfile.gettempdir(), 'cargas_reanudables'))
+UPLOAD_PARTE_MAX_MB = int(os.getenv('UPLOAD_PARTE_MAX_MB', 16))
+# Sesiones abiertas sin actividad por más de estas horas se expiran y se borran sus partes
+UPLOAD_SESION_EXPIRA_HORAS = float(os.getenv('UPLOAD_SESION_EXPIRA_HORAS', 24))
+# Endpoints que leen el cuerpo en streaming y no deben quedar sujetos a MAX_CONTENT_LENGTH
+ENDPOINTS_SIN_LIMITE_CARGA = {'webhook_upload_stream'}
+# Indexación en segundo plano: espera para agrupar disparos del mismo reporte y reportes en paralelo
+INDEXACION_DEBOUNCE_SEG = float(os.getenv('INDEXACION_DEBOUNCE_SEG', 5))
+INDEXACION_CONCURRENCIA = int(os.getenv('INDEXACION_CONCURRENCIA', 2))
+# Tope de espera desde el primer disparo, para reportes que reciben datos sin pausa
+INDEXACION_MAX_ESPERA_SEG = float(os.getenv('INDEXACION_MAX_ESPERA_SEG', 60))
+# Los resúmenes por periodo agregan el reporte completo: como mucho una regeneración por intervalo
+INDEXACION_RESUMENES_INTERVALO_SEG = float(os.getenv('INDEXACION_RESUMENES_INTERVALO_SEG', 300))
+
+
+class SolicitudConCargaEnDisco(Request):
+    """Request que vuelca los archivos grandes a un archivo temporal con nombre en disco"""
+    
+    @property
+    def max_content_length(self):
+        if self.endpoint in ENDPOINTS_SIN_LIMITE_CARGA:
+            return None
+        return super().max_content_length
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_MEMORIA:
+            return BytesIO()
+        # Se borra al cerrarse, cuando Werkzeug libera los archivos al terminar la petición
+        sufijo = os.path.splitext(filename or '')[1]
+        return tempfile.NamedTemporaryFile(prefix='carga_', suffix=sufijo, dir=UPLOAD_TMP_DIR)
+
+
+app.request_class = SolicitudConCargaEnDisco
+
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -50,9 +109,169 @@ db_manager = DatabaseManager(DB_CONFIG)
 # Inicializar agente de análisis
 analysis_agent = DataAnalysisAgent(db_manager, openai_api_key=os.getenv('OPENAI_API_KEY'))
 
+# Cola de indexación en segundo plano (agrupa disparos por reporte)
+cola_indexacion = ColaIndexacion(
+    analysis_agent,
+    debounce_seg=INDEXACION_DEBOUNCE_SEG,
+    concurrencia=INDEXACION_CONCURRENCIA,
+    max_espera_seg=INDEXACION_MAX_ESPERA_SEG,
+    intervalo_resumenes_seg=INDEXACION_RESUMENES_INTERVALO_SEG
+)
+
 # Inicializar gestor de aclaraciones
 aclaraciones_manager = AclaracionesManager(db_manager)
 
+# ============================================
+# CARGA DE ARCHIVOS
+# ============================================
+
+def _es_verdadero(valor) -> bool:
+    """Interpretar flags de query string / JSON (1, true, si)"""
+    if isinstance(valor, bool):
+        return valor
+    return str(valor or '').strip().lower() in ('1', 'true', 'si', 'sí')
+
+def _programar_indexacion(codigo: str, registros_insertados: int) -> dict:
+    """
+    Programar la indexación incremental del reporte tras insertar datos
+    Devuelve los campos auto_indexado / estado_indexacion para la respuesta
+    """
+    if registros_insertados <= 0:
+        return {'auto_indexado': 'no_requerido'}
+    try:
+        cola_indexacion.encolar(codigo)
+    except Exception as e:
+        logger.warning(f"Error programando auto-indexación (no crítico): {e}")
+        return {'auto_indexado': 'error'}
+    return {
+        'auto_indexado': 'programado',
+        'estado_indexacion': f"/api/analysis/{codigo}/indexar/estado"
+    }
+
+@app.errorhandler(413)
+def carga_demasiado_grande(e):
+    """Respuesta JSON cuando el cuerpo supera MAX_CONTENT_LENGTH"""
+    return jsonify({'error': f'Archivo demasiado grande. Máximo permitido: {MAX_UPLOAD_MB} MB'}), 413
+
+def _fuente_archivo(file):
+    """
+    Ruta en disco del archivo subido si fue volcado a un temporal; si es pequeño
+    y quedó en memoria se devuelve su stream. Evita copiar el archivo a un BytesIO.
+    """
+    ruta = getattr(file.stream, 'name', None)
+    if isinstance(ruta, str) and os.path.isfile(ruta):
+        file.stream.flush()
+        return ruta
+    file.stream.seek(0)
+    return file.stream
+
+def _leer_excel_subido(fuente) -> pd.DataFrame:
+    """
+    Leer el Excel subido directamente desde su archivo temporal (ver _fuente_archivo)
+    (preferir hoja 'Datos' ignorando mayúsculas/espacios; si no existe usar primera hoja)
+    """
+    with parseo_excel_semaforo:
+        try:
+            xls = pd.ExcelFile(fuente)
+            sheet_names = xls.sheet_names
+            normalized = [s.strip().lower() for s in sheet_names]
+            hoja = sheet_names[normalized.index('datos')] if 'datos' in normalized else sheet_names[0]
+            logger.info(f"Hojas del Excel: {sheet_names}. Usando hoja: {hoja}")
+            return xls.parse(sheet_name=hoja)
+        except Exception as e:
+            logger.warning(f"Fallo leyendo hoja específica, intentando fallback a primera hoja. Error: {e}")
+            if hasattr(fuente, 'seek'):
+                fuente.seek(0)
+            return pd.read_excel(fuente, sheet_name=0)
+
+def _tamano_archivo(file) -> int:
+    """Tamaño en bytes del archivo subido sin leerlo"""
+    file.stream.seek(0, os.SEEK_END)
+    tamano = file.stream.tell()
+    file.stream.seek(0)
+    return tamano
+
+def _buscar_archivo_duplicado(codigo: str, sha256: str):
+    """Respuesta con referencia a la carga original si el archivo ya fue ingerido en el reporte"""
+    try:
+        original = db_manager.buscar_archivo_cargado(codigo, sha256)
+    except Exception as e:
+        logger.warning(f"No se pudo verificar duplicado de archivo (no crítico): {e}")
+        return None
+    if not original:
+        return None
+    logger.info(f"Archivo duplicado en '{codigo}' ({sha256[:12]}...), se omite el procesamiento")
+    return {
+        'success': True,
+        'duplicado': True,
+        'message': 'Este archivo ya fue cargado en el reporte; no se volvió a procesar',
+        'archivo_original': {
+            'nombre_archivo': original['nombre_archivo'],
+            'sha256': original['sha256'],
+            'carga_id': original['carga_id'],
+            'estado_carga': original['estado_carga'],
+            'registros_insertados': original['registros_insertados'],
+            'usuario': original['usuario'],
+            'confirmado': original.get('confirmado', True),
+            'fecha': original['created_at'].isoformat() if original['created_at'] else None
+        }
+    }
+
+def _reservar_archivo(codigo: str, sha256: str, nombre_archivo: str, tamano_bytes: int, usuario: str = None):
+    """
+    Reservar la huella del archivo antes de procesarlo
+    Devuelve (reserva_id, None) o (None, respuesta) si ya fue ingerido o se está
+    ingiriendo en paralelo. Si la reserva no se puede hacer (no crítico) se procesa sin ella.
+    """
+    try:
+        reserva_id = db_manager.reservar_archivo_cargado(codigo, sha256, nombre_archivo, tamano_bytes,
+                                                         usuario=usuario)
+    except Exception as e:
+        logger.warning(f"No se pudo reservar SHA-256 del archivo (no crítico): {e}")
+        return None, None
+    if reserva_id:
+        return reserva_id, None
+    
+    duplicado = _buscar_archivo_duplicado(codigo, sha256)
+    if duplicado and not duplicado['archivo_original'].get('confirmado', True):
+        duplicado['en_proceso'] = True
+        duplicado['message'] = 'Este archivo se está procesando en otra carga del reporte'
+    return None, duplicado or {
+        'success': True,
+        'duplicado': True,
+        'en_proceso': True,
+        'message': 'Este archivo se está procesando en otra carga del reporte'
+    }
+
+def _cerrar_reserva_archivo(reserva_id: int, exito: bool, carga_id: int = None, registros: int = None):
+    """Confirmar la reserva si el archivo se ingirió; si no, liberarla para permitir reintentos"""
+    if not reserva_id:
+        return
+    try:
+        if exito:
+            db_manager.confirmar_archivo_cargado(reserva_id, carga_id=carga_id, registros_insertados=registros)
+        else:
+            db_manager.liberar_archivo_cargado(reserva_id)
+    except Exception as e:
+        logger.warning(f"No se pudo cerrar la reserva del archivo (no crítico): {e}")
+
+def _verificar_tamano_carga(reporte: dict, file=None, tamano: int = None):
+    """
+    Validar el tamaño de la carga contra el límite del reporte (o el global)
+    Sin archivo se usa Content-Length, lo que permite rechazar antes de leer el cuerpo.
+    Devuelve None si está dentro del límite o la respuesta 413 a retornar.
+    """
+    limite_mb = (reporte or {}).get('limite_carga_mb') or MAX_UPLOAD_MB
+    if tamano is None:
+        tamano = _tamano_archivo(file) if file is not None else request.content_length
+    if tamano and tamano > limite_mb * 1024 * 1024:
+        return jsonify({
+            'error': f'Archivo demasiado grande para este reporte. Máximo permitido: {limite_mb} MB',
+            'tamano_mb': round(tamano / (1024 * 1024), 2),
+            'limite_mb': limite_mb
+        }), 413
+    return None
+
 # ============================================
 # RUTAS PÚBLICAS
 # ============================================
@@ -248,10 +467,16 @@ def actualizar_reporte(codigo):
 
 @app.route('/api/admin/reportes/<codigo>', methods=['DELETE'])
 def eliminar_reporte(codigo):
-    """Desactivar un reporte"""
+    """Desactivar un reporte y retirar su índice semántico"""
     try:
         success = db_manager.actualizar_reporte(codigo, {'activo': False})
         if success:
+            # Un reporte desactivado no debe seguir apareciendo en búsquedas;
+            # si se reactiva, la indexación incremental lo reconstruye desde cero
+            try:
+                analysis_agent.eliminar_indice_reporte(codigo)
+            except Exception as e:
+                logger.warning(f"No se pudo eliminar el índice de {codigo}: {e}")
             return jsonify({
                 'success': True,
                 'message': f"Reporte '{codigo}' desactivado"
@@ -531,67 +756,34 @@ def analizar_excel():
         if not file.filename.endswith('.xlsx'):
             return jsonify({'error': 'Solo archivos .xlsx permitidos'}), 400
         
-        # Leer Excel
-        df = pd.read_excel(file, nrows=1)  # Solo primera fila de datos
+        # Leer solo una muestra (streaming con openpyxl, nunca la hoja completa)
+        tamano_muestra = request.args.get('muestra', ANALISIS_EXCEL_MUESTRA, type=int)
+        tamano_muestra = max(1, min(tamano_muestra, ANALISIS_EXCEL_MUESTRA_MAX))
+        modo = request.args.get('modo', 'primeras')
+        if modo not in ('primeras', 'reservorio'):
+            return jsonify({'error': "modo debe ser 'primeras' o 'reservorio'"}), 400
         
-        # Inferir tipo de dato
-        def inferir_tipo(valor, nombre_columna):
-            """Inferir tipo de dato basado en el valor de ejemplo"""
-            if pd.isna(valor):
-                return 'texto'
-            
-            # Intentar convertir a diferentes tipos
-            valor_str = str(valor).lower()
-            
-            # Fecha
-            try:
-                pd.to_datetime(valor)
-                return 'fecha'
-            except:
-                pass
-            
-            # Número entero
-            try:
-                if float(valor) == int(float(valor)):
-                    return 'numero'
-            except:
-                pass
-            
-            # Decimal
-            try:
-                float(valor)
-                return 'decimal'
-            except:
-                pass
-            
-            # Email
-            if '@' in valor_str and '.' in valor_str:
-                return 'email'
-            
-            # Teléfono
-            if valor_str.replace('-', '').replace(' ', '').replace('+', '').isdigit():
-                return 'telefono'
-            
-            # Booleano
-            if valor_str in ['si', 'no', 'true', 'false', '1', '0', 'sí']:
-                return 'booleano'
-            
-            # Por defecto texto
-            return 'texto'
+        df, filas_recorridas = leer_muestra_excel(_fuente_archivo(file), filas=tamano_muestra, modo=modo)
+        columnas, campo_fecha_sugerido = inferir_esquema(df)
+        
+        def normalizar_nombre(columna):
+            return str(columna).lower().replace(' ', '_').replace('ñ', 'n')
         
         # Extraer campos
         campos = []
-        for idx, columna in enumerate(df.columns):
-            valor_ejemplo = df[columna].iloc[0] if len(df) > 0 else None
-            
+        for idx, info in enumerate(columnas):
             campo = {
-                'nombre': str(columna).lower().replace(' ', '_').replace('ñ', 'n'),
-                'etiqueta': str(columna),
-                'tipo_dato': inferir_tipo(valor_ejemplo, columna),
+                'nombre': normalizar_nombre(info['columna']),
+                'etiqueta': info['columna'],
+                'tipo_dato': info['tipo_dato'],
                 'obligatorio': True if idx < 3 else False,  # Primeros 3 campos obligatorios
-                'descripcion': f'Campo {columna}',
-                'ejemplo': str(valor_ejemplo) if valor_ejemplo is not None else '',
-                'orden': idx
+                'descripcion': f"Campo {info['columna']}",
+                'ejemplo': info['ejemplo'],
+                'orden': idx,
+                'confianza': info['confianza'],
+                'proporcion_nulos': info['proporcion_nulos'],
+                'cardinalidad': info['cardinalidad'],
+                'puntajes': info['puntajes']
             }
             campos.append(campo)
         
@@ -599,9 +791,13 @@ def analizar_excel():
             'success': True,
             'campos': campos,
             'total_campos': len(campos),
+            'campo_fecha_sugerido': normalizar_nombre(campo_fecha_sugerido) if campo_fecha_sugerido else None,
+            'muestra': {'modo': modo, 'filas': len(df), 'filas_recorridas': filas_recorridas},
             'message': f'Se detectaron {len(campos)} campos automáticamente'
         }), 200
         
+    except RequestEntityTooLarge as e:
+        return carga_demasiado_grande(e)
     except Exception as e:
         logger.error(f"Error analizando Excel: {e}")
         return jsonify({'error': str(e)}), 500
@@ -724,22 +920,11 @@ def upload_file():
         if not reporte:
             return jsonify({'error': 'Reporte no encontrado'}), 404
         
-        # Leer Excel (preferir hoja 'Datos' ignorando mayúsculas/espacios; si no existe usar primera hoja)
-        try:
-            xls = pd.ExcelFile(file)
-            sheet_names = xls.sheet_names
-            normalized = [s.strip().lower() for s in sheet_names]
-            hoja = sheet_names[normalized.index('datos')] if 'datos' in normalized else sheet_names[0]
-            logger.info(f"Hojas del Excel: {sheet_names}. Usando hoja: {hoja}")
-            df = xls.parse(sheet_name=hoja)
-        except Exception as e:
-            logger.warning(f"Fallo leyendo hoja específica, intentando fallback a primera hoja. Error: {e}")
-            try:
-                # Reiniciar el puntero del archivo y leer la primera hoja
-                file.seek(0)
-                df = pd.read_excel(file, sheet_name=0)
-            except Exception as e2:
-                raise e2
+        excedido = _verificar_tamano_carga(reporte, file)
+        if excedido:
+            return excedido
+        
+        df = _leer_excel_subido(_fuente_archivo(file))
         
         # Validar estructura
         campos_config = reporte.get('campos', [])
@@ -759,7 +944,8 @@ def upload_file():
                 'error': f"Faltan campos obligatorios: {', '.join(faltantes)}"
             }), 400
         
-        # Convertir a lista de diccionarios
+        # Convertir columnas según tipo_dato y luego a lista de diccionarios
+        df, errores_coercion = coercionar_columnas(df, campos_config)
         datos_lista = df.to_dict('records')
         
         # Insertar en BD
@@ -769,17 +955,72 @@ def upload_file():
             'success': True,
             'records': resultado['registros_insertados'],
             'file': file.filename,
-            'message': f"Se procesaron {resultado['registros_insertados']} registros"
+            'message': f"Se procesaron {resultado['registros_insertados']} registros",
+            'errores_coercion': errores_coercion
         }), 200
         
+    except RequestEntityTooLarge as e:
+        return carga_demasiado_grande(e)
     except Exception as e:
         logger.error(f"Error subiendo archivo: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _ingerir_excel_reporte(codigo: str, reporte: dict, fuente, usuario: str = 'usuario'):
+    """
+    Validar, convertir e insertar directamente en datos_reportes un Excel ya subido
+    Devuelve (cuerpo_respuesta, status_http)
+    """
+    df = _leer_excel_subido(fuente)
+    
+    # Validar estructura
+    campos_config = reporte.get('campos', [])
+    if isinstance(campos_config, str):
+        try:
+            campos_config = json.loads(campos_config)
+        except Exception:
+            logger.warning("No se pudo parsear campos_config como JSON en subir_datos; usando valor original si es lista")
+    campos_requeridos = [c['nombre'] for c in campos_config if c.get('obligatorio')]
+    campos_excel = df.columns.tolist()
+    
+    # Verificar campos obligatorios
+    faltantes = [c for c in campos_requeridos if c not in campos_excel]
+    if faltantes:
+        return {
+            'error': f"Faltan campos obligatorios: {', '.join(faltantes)}"
+        }, 400
+    
+    # Convertir columnas según tipo_dato y luego a lista de diccionarios
+    df, errores_coercion = coercionar_columnas(df, campos_config)
+    datos_lista = df.to_dict('records')
+    
+    # Insertar en BD
+    resultado = db_manager.insertar_datos(codigo, datos_lista, usuario=usuario)
+    
+    # Auto-indexar en ChromaDB en segundo plano para evitar bloqueos largos
+    auto_indexado = _programar_indexacion(codigo, resultado['registros_insertados'])
+    
+    return {
+        'success': True,
+        'registros_insertados': resultado['registros_insertados'],
+        'registros_error': resultado['registros_error'],
+        'message': f"Se procesaron {resultado['registros_insertados']} registros",
+        'errores_coercion': errores_coercion,
+        **auto_indexado
+    }, 200
+
 @app.route('/api/reportes/<codigo>/upload', methods=['POST'])
 def subir_datos(codigo):
     """Subir datos de un reporte"""
     try:
+        # Obtener configuración del reporte y rechazar por Content-Length antes de leer el cuerpo
+        reporte = db_manager.obtener_reporte(codigo)
+        if not reporte:
+            return jsonify({'error': 'Reporte no encontrado'}), 404
+        
+        excedido = _verificar_tamano_carga(reporte)
+        if excedido:
+            return excedido
+        
         if 'file' not in request.files:
             return jsonify({'error': 'No se proporcionó archivo'}), 400
         
@@ -789,68 +1030,248 @@ def subir_datos(codigo):
         if not (file.filename.lower().endswith('.xlsx') or file.filename.lower().endswith('.xls')):
             return jsonify({'error': 'Solo archivos .xlsx o .xls permitidos'}), 400
         
-        # Obtener configuración del reporte
-        reporte = db_manager.obtener_reporte(codigo)
+        excedido = _verificar_tamano_carga(reporte, file)
+        if excedido:
+            return excedido
+        
+        # Mismo archivo ya ingerido en este reporte: no se vuelve a procesar
+        sha256 = calcular_sha256(_fuente_archivo(file))
+        reserva_id, duplicado = _reservar_archivo(codigo, sha256, file.filename, _tamano_archivo(file), 'usuario')
+        if duplicado:
+            return jsonify(duplicado), 200
+        
+        exito, registros = False, None
+        try:
+            cuerpo, status = _ingerir_excel_reporte(codigo, reporte, _fuente_archivo(file))
+            exito = status == 200 and cuerpo['registros_insertados'] > 0
+            registros = cuerpo.get('registros_insertados')
+        finally:
+            _cerrar_reserva_archivo(reserva_id, exito, registros=registros)
+        return jsonify(cuerpo), status
+        
+    except RequestEntityTooLarge as e:
+        return carga_demasiado_grande(e)
+    except Exception as e:
+        logger.error(f"Error subiendo datos: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# ============================================
+# CARGAS REANUDABLES POR PARTES (init → PUT partes → completar)
+# ============================================
+
+def _ruta_parte_sesion(sesion_id: str) -> str:
+    return os.path.join(UPLOAD_SESIONES_DIR, f"{sesion_id}.part")
+
+def _expirar_sesiones_carga():
+    """Expirar sesiones abiertas abandonadas y borrar sus partes en disco (no crítico)"""
+    try:
+        vencidas = db_manager.expirar_sesiones_carga(UPLOAD_SESION_EXPIRA_HORAS)
+    except Exception as e:
+        logger.warning(f"No se pudieron expirar sesiones de carga (no crítico): {e}")
+        return
+    for sesion_id in vencidas:
+        try:
+            os.remove(_ruta_parte_sesion(sesion_id))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"No se pudo borrar la parte de la sesión {sesion_id}: {e}")
+    if vencidas:
+        logger.info(f"Sesiones de carga expiradas: {len(vencidas)}")
+
+def _estado_sesion(sesion: dict) -> dict:
+    return {
+        'sesion_id': sesion['id'],
+        'reporte': sesion['reporte_codigo'],
+        'destino': sesion['destino'],
+        'nombre_archivo': sesion['nombre_archivo'],
+        'tamano_total': sesion['tamano_total'],
+        'offset': sesion['bytes_recibidos'],
+        'estado': sesion['estado'],
+        'tamano_parte_max': UPLOAD_PARTE_MAX_MB * 1024 * 1024
+    }
+
+def _obtener_reporte_destino(codigo: str, destino: str):
+    if destino == 'cargar-datos':
+        return db_manager.obtener_reporte_por_codigo(codigo)
+    return db_manager.obtener_reporte(codigo)
+
+@app.route('/api/reportes/<codigo>/upload/sesiones', methods=['POST'])
+def iniciar_carga_reanudable(codigo):
+    """
+    Iniciar una carga por partes
+    Body: { nombre_archivo, tamano, sha256 (opcional), destino: 'upload' | 'cargar-datos' }
+    Si se envía sha256 y el archivo ya fue ingerido, responde con la carga original sin subir nada.
+    """
+    try:
+        data = request.get_json() or {}
+        nombre_archivo = data.get('nombre_archivo', '')
+        destino = data.get('destino', 'upload')
+        sha256 = (data.get('sha256') or '').lower() or None
+        
+        try:
+            tamano = int(data.get('tamano', 0))
+        except (TypeError, ValueError):
+            tamano = 0
+        if tamano <= 0:
+            return jsonify({'error': 'Debe indicar el tamaño total del archivo en bytes (tamano)'}), 400
+        if destino not in ('upload', 'cargar-datos'):
+            return jsonify({'error': "destino debe ser 'upload' o 'cargar-datos'"}), 400
+        if not nombre_archivo.lower().endswith(('.xlsx', '.xls')):
+            return jsonify({'error': 'Solo archivos .xlsx o .xls permitidos'}), 400
+        
+        reporte = _obtener_reporte_destino(codigo, destino)
         if not reporte:
             return jsonify({'error': 'Reporte no encontrado'}), 404
         
-        # Leer Excel (preferir hoja 'Datos' ignorando mayúsculas/espacios; si no existe usar primera hoja)
-        try:
-            xls = pd.ExcelFile(file)
-            sheet_names = xls.sheet_names
-            normalized = [s.strip().lower() for s in sheet_names]
-            hoja = sheet_names[normalized.index('datos')] if 'datos' in normalized else sheet_names[0]
-            logger.info(f"Hojas del Excel: {sheet_names}. Usando hoja: {hoja}")
-            df = xls.parse(sheet_name=hoja)
-        except Exception as e:
-            logger.warning(f"Fallo leyendo hoja específica, intentando fallback a primera hoja. Error: {e}")
-            try:
-                file.seek(0)
-                df = pd.read_excel(file, sheet_name=0)
-            except Exception as e2:
-                raise e2
+        excedido = _verificar_tamano_carga(reporte, tamano=tamano)
+        if excedido:
+            return excedido
         
-        # Validar estructura
-        campos_config = reporte.get('campos', [])
-        if isinstance(campos_config, str):
-            try:
-                campos_config = json.loads(campos_config)
-            except Exception:
-                logger.warning("No se pudo parsear campos_config como JSON en subir_datos; usando valor original si es lista")
-        campos_requeridos = [c['nombre'] for c in campos_config if c.get('obligatorio')]
-        campos_excel = df.columns.tolist()
+        if sha256:
+            duplicado = _buscar_archivo_duplicado(codigo, sha256)
+            if duplicado:
+                return jsonify(duplicado), 200
         
-        # Verificar campos obligatorios
-        faltantes = [c for c in campos_requeridos if c not in campos_excel]
-        if faltantes:
+        # Cada nueva sesión barre las abandonadas (usa el índice por estado y updated_at)
+        _expirar_sesiones_carga()
+        
+        os.makedirs(UPLOAD_SESIONES_DIR, exist_ok=True)
+        sesion_id = str(uuid.uuid4())
+        open(_ruta_parte_sesion(sesion_id), 'wb').close()
+        
+        sesion = db_manager.crear_sesion_carga(
+            sesion_id, codigo, destino, nombre_archivo, tamano,
+            sha256_esperado=sha256, usuario=request.headers.get('X-User', 'usuario')
+        )
+        return jsonify({'success': True, **_estado_sesion(sesion)}), 201
+        
+    except Exception as e:
+        logger.error(f"Error iniciando carga reanudable: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/reportes/<codigo>/upload/sesiones/<sesion_id>', methods=['GET'])
+def estado_carga_reanudable(codigo, sesion_id):
+    """Consultar el offset actual para reanudar una carga interrumpida"""
+    sesion = db_manager.obtener_sesion_carga(sesion_id)
+    if not sesion or sesion['reporte_codigo'] != codigo:
+        return jsonify({'error': 'Sesión de carga no encontrada'}), 404
+    estado = _estado_sesion(sesion)
+    if sesion['resultado']:
+        estado['resultado'] = sesion['resultado']
+    return jsonify(estado), 200
+
+@app.route('/api/reportes/<codigo>/upload/sesiones/<sesion_id>', methods=['PUT'])
+def subir_parte_carga(codigo, sesion_id):
+    """
+    Subir una parte del archivo (cuerpo binario crudo)
+    Query param: offset (debe coincidir con los bytes ya recibidos; si no, 409 con el offset actual)
+    """
+    try:
+        sesion = db_manager.obtener_sesion_carga(sesion_id)
+        if not sesion or sesion['reporte_codigo'] != codigo:
+            return jsonify({'error': 'Sesión de carga no encontrada'}), 404
+        if sesion['estado'] != 'abierta':
+            return jsonify({'error': f"La sesión está {sesion['estado']}", **_estado_sesion(sesion)}), 409
+        
+        offset = request.args.get('offset', type=int)
+        if offset is None or offset != sesion['bytes_recibidos']:
+            return jsonify({'error': 'Offset no coincide con los bytes recibidos', **_estado_sesion(sesion)}), 409
+        
+        tamano_parte = request.content_length
+        limite_parte = UPLOAD_PARTE_MAX_MB * 1024 * 1024
+        if tamano_parte is not None and tamano_parte > limite_parte:
+            return jsonify({'error': f'Cada parte admite hasta {UPLOAD_PARTE_MAX_MB} MB'}), 413
+        
+        # Escribir en la posición indicada: reenviar la misma parte es idempotente
+        restante = sesion['tamano_total'] - offset
+        escritos = 0
+        with open(_ruta_parte_sesion(sesion_id), 'r+b') as destino:
+            destino.seek(offset)
+            while True:
+                bloque = request.stream.read(1024 * 1024)
+                if not bloque:
+                    break
+                escritos += len(bloque)
+                if escritos > restante or escritos > limite_parte:
+                    return jsonify({'error': 'La parte excede el tamaño declarado del archivo'}), 413
+                destino.write(bloque)
+            destino.truncate(offset + escritos)
+        
+        if not db_manager.avanzar_sesion_carga(sesion_id, offset, offset + escritos):
+            sesion = db_manager.obtener_sesion_carga(sesion_id)
+            return jsonify({'error': 'Otra parte se escribió en paralelo', **_estado_sesion(sesion)}), 409
+        
+        sesion['bytes_recibidos'] = offset + escritos
+        return jsonify({'success': True, **_estado_sesion(sesion)}), 200
+        
+    except Exception as e:
+        logger.error(f"Error subiendo parte de carga: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/reportes/<codigo>/upload/sesiones/<sesion_id>/completar', methods=['POST'])
+def completar_carga_reanudable(codigo, sesion_id):
+    """
+    Completar la carga: verifica tamaño y SHA-256, y la procesa por el mismo
+    pipeline de /upload o /cargar-datos (según destino) salvo que sea duplicada
+    """
+    try:
+        sesion = db_manager.obtener_sesion_carga(sesion_id)
+        if not sesion or sesion['reporte_codigo'] != codigo:
+            return jsonify({'error': 'Sesión de carga no encontrada'}), 404
+        if sesion['estado'] != 'abierta':
+            # Reintento de completar: devolver el resultado ya calculado
+            return jsonify(sesion['resultado'] or _estado_sesion(sesion)), 200
+        if sesion['bytes_recibidos'] != sesion['tamano_total']:
+            return jsonify({'error': 'Faltan partes por subir', **_estado_sesion(sesion)}), 409
+        
+        ruta = _ruta_parte_sesion(sesion_id)
+        sha256 = calcular_sha256(ruta)
+        if sesion['sha256_esperado'] and sesion['sha256_esperado'] != sha256:
             return jsonify({
-                'error': f"Faltan campos obligatorios: {', '.join(faltantes)}"
-            }), 400
+                'error': 'El SHA-256 del archivo recibido no coincide con el declarado',
+                'sha256_recibido': sha256,
+                **_estado_sesion(sesion)
+            }), 422
         
-        # Convertir a lista de diccionarios
-        datos_lista = df.to_dict('records')
+        reporte = _obtener_reporte_destino(codigo, sesion['destino'])
+        if not reporte:
+            return jsonify({'error': 'Reporte no encontrado'}), 404
         
-        # Insertar en BD
-        resultado = db_manager.insertar_datos(codigo, datos_lista, usuario='usuario')
+        usuario = sesion['usuario'] or 'usuario'
+        reserva_id, duplicado = _reservar_archivo(codigo, sha256, sesion['nombre_archivo'],
+                                                  sesion['tamano_total'], usuario)
+        if duplicado:
+            if not duplicado.get('en_proceso'):
+                db_manager.cerrar_sesion_carga(sesion_id, 'duplicada', duplicado)
+                os.remove(ruta)
+            return jsonify(duplicado), 200
         
-        # Auto-indexar en ChromaDB en segundo plano para evitar bloqueos largos
+        exito, carga_id, registros = False, None, None
         try:
-            if resultado['registros_insertados'] > 0:
-                logger.info(f"Auto-indexación en background de {resultado['registros_insertados']} registros en ChromaDB...")
-                threading.Thread(target=lambda: analysis_agent.indexar_datos_reporte(codigo), daemon=True).start()
-        except Exception as e:
-            logger.warning(f"Error lanzando auto-indexación en background (no crítico): {e}")
-        
-        return jsonify({
-            'success': True,
-            'registros_insertados': resultado['registros_insertados'],
-            'registros_error': resultado['registros_error'],
-            'message': f"Se procesaron {resultado['registros_insertados']} registros",
-            'auto_indexado': 'en_progreso'
-        }), 200
+            if sesion['destino'] == 'cargar-datos':
+                with parseo_excel_semaforo:
+                    datos = pd.read_excel(ruta).to_dict('records')
+                cuerpo, status = _crear_carga_staging(codigo, reporte, datos, sesion['nombre_archivo'], usuario)
+                exito = status == 201
+                carga_id = cuerpo.get('carga_id')
+            else:
+                cuerpo, status = _ingerir_excel_reporte(codigo, reporte, ruta, usuario=usuario)
+                exito = status == 200 and cuerpo['registros_insertados'] > 0
+                registros = cuerpo.get('registros_insertados')
+        finally:
+            _cerrar_reserva_archivo(reserva_id, exito, carga_id=carga_id, registros=registros)
+        
+        if exito:
+            db_manager.cerrar_sesion_carga(sesion_id, 'completada', cuerpo)
+            os.remove(ruta)
+        # Si falla la validación la sesión sigue abierta con el archivo completo para reintentar
+        return jsonify(cuerpo), status
         
     except Exception as e:
-        logger.error(f"Error subiendo datos: {e}")
+        logger.error(f"Error completando carga reanudable: {e}")
+        import traceback
+        traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/reportes/<codigo>/datos', methods=['GET'])
@@ -1304,16 +1725,14 @@ def webhook_upload(codigo):
         if not isinstance(datos_lista, list):
             return jsonify({'error': 'Los datos deben ser una lista'}), 400
         
+        # Convertir según tipo_dato de cada campo
+        datos_lista, errores_coercion = coercionar_registros(datos_lista, reporte.get('campos', []))
+        
         # Insertar en BD
         resultado = db_manager.insertar_datos(codigo, datos_lista, usuario='webhook')
         
         # Auto-indexar en ChromaDB en background
-        try:
-            if resultado['registros_insertados'] > 0:
-                logger.info(f"Auto-indexación en background de {resultado['registros_insertados']} registros desde webhook...")
-                threading.Thread(target=lambda: analysis_agent.indexar_datos_reporte(codigo), daemon=True).start()
-        except Exception as e:
-            logger.warning(f"Error lanzando auto-indexación en background: {e}")
+        auto_indexado = _programar_indexacion(codigo, resultado['registros_insertados'])
         
         return jsonify({
             'success': True,
@@ -1321,30 +1740,215 @@ def webhook_upload(codigo):
             'registros_insertados': resultado['registros_insertados'],
             'registros_error': resultado['registros_error'],
             'mensaje': f"Se procesaron {resultado['registros_insertados']} registros correctamente",
-            'auto_indexado': 'en_progreso'
+            'errores_coercion': errores_coercion,
+            **auto_indexado
         }), 200
         
     except Exception as e:
         logger.error(f"Error en webhook upload: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/webhook/upload/<codigo>/stream', methods=['POST'])
+def webhook_upload_stream(codigo):
+    """
+    Webhook en streaming: recibe NDJSON (un registro JSON por línea), opcionalmente gzip.
+    Los registros se leen de forma incremental y se insertan en lotes fijos; la respuesta
+    es NDJSON con un acuse por lote y una línea final de resumen.
+    El cuerpo solo se lee a medida que se insertan los lotes, por lo que el emisor
+    queda frenado por TCP (backpressure) si la BD va más lenta que la red.
+    Query params: lote (tamaño de lote), gzip=1 (si no se envía Content-Encoding: gzip)
+    Si el envío se corta, el resumen trae success=false, parcial=true y
+    ultima_linea_confirmada: las líneas posteriores no se guardaron.
+    """
+    reporte = db_manager.obtener_reporte(codigo)
+    if not reporte:
+        return jsonify({'error': 'Reporte no encontrado'}), 404
+    
+    comprimido = (
+        request.headers.get('Content-Encoding', '').lower() == 'gzip'
+        or request.args.get('gzip', '').lower() in ('1', 'true')
+    )
+    tamano_lote = request.args.get('lote', WEBHOOK_STREAM_LOTE, type=int)
+    tamano_lote = max(1, min(tamano_lote, WEBHOOK_STREAM_LOTE_MAX))
+    
+    def generar_acuses():
+        errores_lectura = []
+        totales = {'lotes': 0, 'registros_insertados': 0, 'registros_error': 0, 'lineas_invalidas': 0}
+        # Última línea del cuerpo cuyo lote quedó confirmado en BD (para reanudar un envío cortado)
+        ultima_linea_confirmada = 0
+        interrumpido = False
+        
+        def registros_validos():
+            for numero_linea, registro, error in iterar_ndjson(
+                request.stream, comprimido=comprimido, max_linea=WEBHOOK_STREAM_MAX_LINEA
+            ):
+                if error:
+                    errores_lectura.append(error)
+                    totales['lineas_invalidas'] += 1
+                    continue
+                yield numero_linea, registro
+        
+        try:
+            for numero_lote, lote in enumerate(en_lotes(registros_validos(), tamano_lote), start=1):
+                lineas = [numero_linea for numero_linea, _ in lote]
+                lote, errores_coercion = coercionar_registros([r for _, r in lote], reporte.get('campos', []))
+                resultado = db_manager.insertar_datos(codigo, lote, usuario='webhook', tamano_lote=tamano_lote)
+                totales['lotes'] = numero_lote
+                totales['registros_insertados'] += resultado['registros_insertados']
+                totales['registros_error'] += resultado['registros_error']
+                ultima_linea_confirmada = lineas[-1]
+                
+                yield json.dumps({
+                    'lote': numero_lote,
+                    'registros_recibidos': len(lote),
+                    'registros_insertados': resultado['registros_insertados'],
+                    'registros_error': resultado['registros_error'],
+                    'hasta_linea': ultima_linea_confirmada,
+                    'errores': (errores_lectura + resultado['errores'])[:10],
+                    'errores_coercion': errores_coercion
+                }, ensure_ascii=False) + '\n'
+                errores_lectura.clear()
+        except (OSError, EOFError) as e:
+            # gzip corrupto o conexión cortada: se confirma lo ya insertado
+            logger.error(f"Error leyendo stream NDJSON: {e}")
+            errores_lectura.append(f"Stream interrumpido: {e}")
+            interrumpido = True
+        except Exception as e:
+            logger.error(f"Error en webhook stream: {e}")
+            errores_lectura.append(str(e))
+            interrumpido = True
+        
+        # Auto-indexar en ChromaDB en background
+        auto_indexado = _programar_indexacion(codigo, totales['registros_insertados'])
+        
+        # Los lotes se confirman uno a uno: una interrupción deja una carga parcial
+        yield json.dumps({
+            'resumen': True,
+            'success': not interrumpido and (not errores_lectura or totales['registros_insertados'] > 0),
+            'parcial': interrumpido and totales['registros_insertados'] > 0,
+            'ultima_linea_confirmada': ultima_linea_confirmada,
+            'reporte': reporte['nombre'],
+            **totales,
+            'errores': errores_lectura[:10],
+            **auto_indexado
+        }, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generar_acuses()), mimetype='application/x-ndjson')
+
 # ============================================
 # ENDPOINTS DE ANÁLISIS E IA
 # ============================================
 
 @app.route('/api/analysis/<codigo>/indexar', methods=['POST'])
 def indexar_datos_reporte(codigo):
-    """Indexar datos de un reporte para búsqueda semántica"""
+    """
+    Indexar datos de un reporte para búsqueda semántica
+    Incremental por defecto (solo registros posteriores a la marca);
+    ?completo=1 reinicia la marca y reindexa todo el reporte
+    """
     try:
-        resultado = analysis_agent.indexar_datos_reporte(codigo)
+        completo = _es_verdadero(request.args.get('completo'))
+        resultado = analysis_agent.indexar_datos_reporte(codigo, completo=completo)
         return jsonify(resultado), 200
     except Exception as e:
         logger.error(f"Error indexando datos: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/analysis/<codigo>/indexar/estado', methods=['GET'])
+def estado_indexacion_reporte(codigo):
+    """Estado de la indexación en segundo plano de un reporte"""
+    estado = cola_indexacion.estado(codigo)
+    try:
+        estado['ultimo_id_indexado'] = db_manager.obtener_marca_indexacion(codigo)
+    except Exception as e:
+        logger.warning(f"No se pudo leer la marca de indexación de {codigo}: {e}")
+    return jsonify(estado), 200
+
+@app.route('/api/analysis/<codigo>/indexar/reconciliar', methods=['POST'])
+def reconciliar_indice_reporte(codigo):
+    """Eliminar del índice los documentos cuyos registros ya no existen"""
+    try:
+        return jsonify(analysis_agent.reconciliar_indice(codigo)), 200
+    except Exception as e:
+        logger.error(f"Error reconciliando índice de {codigo}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/indexacion/reconciliar', methods=['POST'])
+def reconciliar_indices():
+    """Reconciliar el índice de todos los reportes activos"""
+    resultados = []
+    for reporte in db_manager.listar_reportes():
+        try:
+            resultados.append(analysis_agent.reconciliar_indice(reporte['codigo']))
+        except Exception as e:
+            logger.error(f"Error reconciliando índice de {reporte['codigo']}: {e}")
+            resultados.append({'reporte': reporte['codigo'], 'error': str(e)})
+    return jsonify({
+        'reportes': resultados,
+        'huerfanos': sum(r.get('huerfanos', 0) for r in resultados)
+    }), 200
+
+@app.route('/api/reportes/<codigo>/datos', methods=['DELETE'])
+def purgar_datos_reporte(codigo):
+    """
+    Purgar registros definitivos de un reporte (todos o los cargados antes de ?hasta=YYYY-MM-DD)
+    y retirar sus vectores del índice
+    """
+    try:
+        hasta = request.args.get('hasta')
+        ids = db_manager.purgar_datos_reporte(codigo, fecha_hasta=hasta)
+        
+        vectores_eliminados = 0
+        try:
+            if hasta:
+                vectores_eliminados = analysis_agent.eliminar_vectores(codigo, registro_ids=ids)
+            else:
+                # Sin registros no hay nada que buscar: se descarta la colección entera
+                analysis_agent.eliminar_indice_reporte(codigo)
+                vectores_eliminados = len(ids)
+        except Exception as e:
+            logger.warning(f"No se pudieron retirar vectores de {codigo}: {e}")
+        
+        # Los resúmenes por periodo siguen mostrando los totales anteriores a la purga
+        if ids:
+            cola_indexacion.encolar(codigo)
+        
+        return jsonify({
+            'success': True,
+            'registros_eliminados': len(ids),
+            'vectores_eliminados': vectores_eliminados
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error purgando datos de {codigo}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/indexacion/estado', methods=['GET'])
+def estado_indexacion():
+    """Resumen de la cola de indexación (pendientes, en curso y últimos resultados)"""
+    estado = cola_indexacion.estado_general()
+    # Aciertos de la cache de embeddings (solo si el proveedor ya se cargó)
+    proveedor = analysis_agent._embedding_function
+    if proveedor is not None and hasattr(proveedor, 'estadisticas'):
+        estado['embeddings'] = proveedor.estadisticas()
+    estado['cache_busqueda'] = analysis_agent.cache_busqueda.estadisticas()
+    return jsonify(estado), 200
+
+def _solicita_stream(data: dict) -> bool:
+    """Modo streaming por parámetro stream o por cabecera Accept: text/event-stream"""
+    return _es_verdadero(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+
+def _evento_sse(evento: dict) -> str:
+    """Formato Server-Sent Events: línea event con el tipo y data con el JSON completo"""
+    return f"event: {evento['evento']}\ndata: {json.dumps(evento, ensure_ascii=False, default=str)}\n\n"
+
 @app.route('/api/analysis/<codigo>/pregunta', methods=['POST'])
 def hacer_pregunta(codigo):
-    """Hacer una pregunta sobre los datos del reporte con memoria conversacional"""
+    """
+    Hacer una pregunta sobre los datos del reporte con memoria conversacional
+    Con "stream": true (o Accept: text/event-stream) responde como SSE con eventos
+    funcion_inicio, funcion_fin, token, fin y error
+    """
     try:
         data = request.get_json()
         pregunta = data.get('pregunta')
@@ -1432,6 +2036,14 @@ def hacer_pregunta(codigo):
                 # 🆕 Usar session_id en la respuesta
                 resultado = analysis_agent.responder_pregunta(codigo, pregunta, session_id)
                 return jsonify(resultado), 200
+        elif _solicita_stream(data):
+            # Eventos SSE: progreso de funciones y tokens de la respuesta a medida que llegan
+            eventos = analysis_agent.responder_pregunta_stream(codigo, pregunta, session_id)
+            return Response(
+                stream_with_context(_evento_sse(evento) for evento in eventos),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
         else:
             # 🆕 Respuesta con memoria conversacional y function calling
             resultado = analysis_agent.responder_pregunta(codigo, pregunta, session_id)
@@ -1475,7 +2087,7 @@ def generar_analisis(codigo):
     """Generar análisis IA de los datos"""
     try:
         tipo = request.args.get('tipo', 'general')
-        resultado = analysis_agent.generar_analisis_ia(codigo, tipo)
+        resultado = analysis_agent.generar_analisis_ia(codigo, tipo, forzar=_es_verdadero(request.args.get('force')))
         return jsonify(resultado), 200
         
     except Exception as e:
@@ -1486,7 +2098,7 @@ def generar_analisis(codigo):
 def generar_informe_completo(codigo):
     """Generar informe completo con múltiples análisis"""
     try:
-        resultado = analysis_agent.generar_informe_completo(codigo)
+        resultado = analysis_agent.generar_informe_completo(codigo, forzar=_es_verdadero(request.args.get('force')))
         return jsonify(resultado), 200
         
     except Exception as e:
@@ -1495,16 +2107,52 @@ def generar_informe_completo(codigo):
 
 @app.route('/api/analysis/<codigo>/buscar', methods=['POST'])
 def buscar_con_lenguaje_natural(codigo):
-    """Buscar datos usando lenguaje natural"""
+    """
+    Buscar datos usando lenguaje natural
+    Filtros opcionales: where (sintaxis ChromaDB) o fecha_inicio/fecha_fin/carga_id/filtros
+    ({campo: valor}); sin ellos se deduce mes/año de la consulta (auto_filtros=false lo evita)
+    modo: vector (por defecto) o hibrido (texto completo + vectorial fusionados por RRF);
+    en modo hibrido el where solo admite igualdad/$in y rangos de fecha_periodo
+    """
     try:
         data = request.get_json()
         consulta = data.get('consulta')
         limite = data.get('limite', 5)
+        modo = data.get('modo', 'vector')
         
         if not consulta:
             return jsonify({'error': 'Se requiere una consulta'}), 400
+        if modo not in ('vector', 'hibrido'):
+            return jsonify({'error': "modo debe ser 'vector' o 'hibrido'"}), 400
+        
+        if modo == 'hibrido':
+            if data.get('where'):
+                # La búsqueda de texto debe aplicar el mismo filtro que la vectorial
+                try:
+                    traducir_where(data['where'])
+                except ValueError as ve:
+                    return jsonify({'error': str(ve)}), 400
+            opciones = {
+                'fecha_inicio': data.get('fecha_inicio'),
+                'fecha_fin': data.get('fecha_fin'),
+                'carga_id': data.get('carga_id'),
+                'filtros': data.get('filtros'),
+                'where': data.get('where'),
+                'auto_filtros': data.get('auto_filtros', True)
+            }
+        else:
+            opciones = {
+                'where': data.get('where') or construir_where(
+                    fecha_inicio=data.get('fecha_inicio'),
+                    fecha_fin=data.get('fecha_fin'),
+                    carga_id=data.get('carga_id'),
+                    filtros=data.get('filtros')
+                ),
+                'auto_filtros': data.get('auto_filtros', True)
+            }
         
-        resultado = analysis_agent.consultar_con_lenguaje_natural(codigo, consulta, limite)
+        # Resultados repetidos se sirven desde cache mientras el índice no cambie
+        resultado = analysis_agent.buscar_con_cache(codigo, consulta, limite, modo, **opciones)
         return jsonify(resultado), 200
         
     except Exception as e:
@@ -1517,8 +2165,8 @@ def exportar_analisis_excel(codigo):
     try:
         tipo = request.args.get('tipo', 'general')
         
-        # Generar análisis
-        analisis = analysis_agent.generar_analisis_ia(codigo, tipo)
+        # Generar análisis (reutiliza el de cache si los datos no cambiaron)
+        analisis = analysis_agent.generar_analisis_ia(codigo, tipo, forzar=_es_verdadero(request.args.get('force')))
         
         # Obtener datos del reporte
         datos = db_manager.consultar_datos(codigo, limite=1000)
@@ -1620,8 +2268,8 @@ def enviar_analisis_correo(codigo):
         if not app.config['MAIL_USERNAME']:
             return jsonify({'error': 'Configuración de correo no disponible. Configure MAIL_USERNAME y MAIL_PASSWORD en el archivo .env'}), 400
         
-        # Generar análisis
-        analisis = analysis_agent.generar_analisis_ia(codigo, tipo)
+        # Generar análisis (reutiliza el de cache si los datos no cambiaron)
+        analisis = analysis_agent.generar_analisis_ia(codigo, tipo, forzar=_es_verdadero(data.get('force')))
         
         # Generar gráficas como imágenes
         graficas_html = ""
@@ -2452,6 +3100,119 @@ def crear_reporte_con_validacion():
         return jsonify({"error": str(e)}), 500
 
 
+def _crear_carga_staging(codigo: str, reporte_config: dict, datos: list, archivo_nombre: str, usuario: str):
+    """
+    Validar periodo y estructura de los registros y crear la carga en staging
+    Devuelve (cuerpo_respuesta, status_http)
+    """
+    from validador_ia import validador_ia
+    from datetime import date
+    
+    # Validar mínimo 2 registros
+    if len(datos) < 2:
+        return {"error": "Se requieren al menos 2 registros"}, 400
+    
+    # Convertir según tipo_dato de cada campo (se guarda JSON ya tipado)
+    datos, errores_coercion = coercionar_registros(datos, reporte_config.get('campos', []))
+    
+    # Obtener periodo de la carga
+    tipo_periodo = reporte_config.get('tipo_periodo', 'mensual')
+    campo_fecha = reporte_config.get('campo_fecha')
+    
+    if not campo_fecha:
+        return {"error": "El reporte no tiene configurado campo de fecha"}, 400
+    
+    # Extraer fechas y calcular periodo
+    fechas = []
+    for registro in datos:
+        fecha_str = registro.get(campo_fecha)
+        if fecha_str:
+            try:
+                if isinstance(fecha_str, str):
+                    fecha = datetime.strptime(fecha_str[:10], '%Y-%m-%d').date()
+                elif isinstance(fecha_str, date):
+                    fecha = fecha_str
+                else:
+                    fecha = datetime.fromisoformat(str(fecha_str)).date()
+                fechas.append(fecha)
+            except:
+                pass
+    
+    if not fechas:
+        return {"error": f"No se encontraron fechas válidas en el campo '{campo_fecha}'"}, 400
+    
+    # Calcular periodo
+    fecha_referencia = min(fechas)
+    periodo_calc = db_manager.ejecutar_query(
+        "SELECT * FROM calcular_periodo(%s, %s)",
+        (tipo_periodo, fecha_referencia)
+    )[0]
+    
+    periodo_inicio = periodo_calc[0]
+    periodo_fin = periodo_calc[1]
+    
+    # Validar que no se solape con cargas existentes
+    validacion_periodo = db_manager.ejecutar_query(
+        "SELECT * FROM validar_periodo(%s, %s, %s)",
+        (codigo, periodo_inicio, periodo_fin)
+    )[0]
+    
+    if not validacion_periodo[0]:  # No es válido
+        return {
+            "error": "Periodo solapado",
+            "mensaje": validacion_periodo[1],
+            "cargas_conflicto": validacion_periodo[2]
+        }, 409
+    
+    # Validar estructura con IA
+    validacion_datos = validador_ia.validar_datos_carga(
+        reporte_codigo=codigo,
+        reporte_nombre=reporte_config['nombre'],
+        campos_esperados=reporte_config.get('campos', []),
+        datos=datos,
+        periodo_esperado={
+            'tipo': tipo_periodo,
+            'campo_fecha': campo_fecha,
+            'inicio': periodo_inicio,
+            'fin': periodo_fin
+        }
+    )
+    
+    if not validacion_datos['valido']:
+        return {
+            "validacion_requerida": True,
+            "validacion": validacion_datos,
+            "mensaje": "Los datos tienen errores de validación"
+        }, 400
+    
+    # Crear registro de carga y staging (COPY + periodos vectorizados, una sola transacción)
+    carga_id = db_manager.insertar_carga_temporal(
+        reporte_codigo=codigo,
+        datos=datos,
+        periodo_inicio=periodo_inicio,
+        periodo_fin=periodo_fin,
+        tipo_periodo=tipo_periodo,
+        campo_fecha=campo_fecha,
+        archivo_original=archivo_nombre,
+        usuario=usuario,
+        validacion_previa=validacion_datos
+    )
+    
+    return {
+        "success": True,
+        "carga_id": carga_id,
+        "periodo": {
+            "inicio": str(periodo_inicio),
+            "fin": str(periodo_fin),
+            "tipo": tipo_periodo
+        },
+        "cantidad_registros": len(datos),
+        "validacion": validacion_datos,
+        "errores_coercion": errores_coercion,
+        "mensaje": f"Carga creada exitosamente. Pendiente de aprobación."
+    }, 201
+
+
 @app.route('/api/reportes/<codigo>/cargar-datos', methods=['POST'])
 def cargar_datos_reporte(codigo):
     """
@@ -2459,14 +3220,18 @@ def cargar_datos_reporte(codigo):
     Crea registro en datos_temporales para aprobación
     """
     try:
-        from validador_ia import validador_ia
-        from datetime import datetime, date
-        
         # Obtener configuración del reporte
         reporte_config = db_manager.obtener_reporte_por_codigo(codigo)
         if not reporte_config:
             return jsonify({"error": "Reporte no encontrado"}), 404
         
+        excedido = _verificar_tamano_carga(reporte_config)
+        if excedido:
+            return excedido
+        
+        usuario = request.headers.get('X-User', 'admin')  # Obtener de sesión
+        reserva_id = None
+        
         # Obtener datos (JSON o archivo)
         if request.is_json:
             data = request.get_json()
@@ -2480,128 +3245,33 @@ def cargar_datos_reporte(codigo):
             file = request.files['file']
             archivo_nombre = file.filename
             
-            # Procesar Excel
-            import pandas as pd
-            df = pd.read_excel(file)
-            datos = df.to_dict('records')
-        
-        # Validar mínimo 2 registros
-        if len(datos) < 2:
-            return jsonify({"error": "Se requieren al menos 2 registros"}), 400
-        
-        # Obtener periodo de la carga
-        tipo_periodo = reporte_config.get('tipo_periodo', 'mensual')
-        campo_fecha = reporte_config.get('campo_fecha')
-        
-        if not campo_fecha:
-            return jsonify({"error": "El reporte no tiene configurado campo de fecha"}), 400
-        
-        # Extraer fechas y calcular periodo
-        fechas = []
-        for registro in datos:
-            fecha_str = registro.get(campo_fecha)
-            if fecha_str:
-                try:
-                    if isinstance(fecha_str, str):
-                        fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-                    elif isinstance(fecha_str, date):
-                        fecha = fecha_str
-                    else:
-                        fecha = datetime.fromisoformat(str(fecha_str)).date()
-                    fechas.append(fecha)
-                except:
-                    pass
-        
-        if not fechas:
-            return jsonify({"error": f"No se encontraron fechas válidas en el campo '{campo_fecha}'"}), 400
-        
-        # Calcular periodo
-        fecha_referencia = min(fechas)
-        periodo_calc = db_manager.ejecutar_query(
-            "SELECT * FROM calcular_periodo(%s, %s)",
-            (tipo_periodo, fecha_referencia)
-        )[0]
-        
-        periodo_inicio = periodo_calc[0]
-        periodo_fin = periodo_calc[1]
-        
-        # Validar que no se solape con cargas existentes
-        validacion_periodo = db_manager.ejecutar_query(
-            "SELECT * FROM validar_periodo(%s, %s, %s)",
-            (codigo, periodo_inicio, periodo_fin)
-        )[0]
-        
-        if not validacion_periodo[0]:  # No es válido
-            return jsonify({
-                "error": "Periodo solapado",
-                "mensaje": validacion_periodo[1],
-                "cargas_conflicto": validacion_periodo[2]
-            }), 409
-        
-        # Validar estructura con IA
-        validacion_datos = validador_ia.validar_datos_carga(
-            reporte_codigo=codigo,
-            reporte_nombre=reporte_config['nombre'],
-            campos_esperados=reporte_config.get('campos', []),
-            datos=datos,
-            periodo_esperado={
-                'tipo': tipo_periodo,
-                'campo_fecha': campo_fecha,
-                'inicio': periodo_inicio,
-                'fin': periodo_fin
-            }
-        )
-        
-        if not validacion_datos['valido']:
-            return jsonify({
-                "validacion_requerida": True,
-                "validacion": validacion_datos,
-                "mensaje": "Los datos tienen errores de validación"
-            }), 400
-        
-        # Crear registro de carga
-        usuario = request.headers.get('X-User', 'admin')  # Obtener de sesión
-        
-        carga_id = db_manager.ejecutar_query(
-            """
-            INSERT INTO cargas_datos 
-            (reporte_codigo, periodo_inicio, periodo_fin, periodo_tipo, cantidad_registros, 
-             archivo_original, usuario_carga, estado, validacion_previa)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-            """,
-            (codigo, periodo_inicio, periodo_fin, tipo_periodo, len(datos),
-             archivo_nombre, usuario, 'pendiente', json.dumps(validacion_datos)),
-            commit=True
-        )[0][0]
-        
-        # Insertar datos en tabla temporal
-        for idx, registro in enumerate(datos, start=1):
-            db_manager.ejecutar_query(
-                """
-                INSERT INTO datos_temporales 
-                (carga_id, reporte_codigo, datos, fila_numero)
-                VALUES (%s, %s, %s, %s)
-                """,
-                (carga_id, codigo, json.dumps(registro), idx),
-                commit=False
-            )
-        
-        db_manager.commit()
-        
-        return jsonify({
-            "success": True,
-            "carga_id": carga_id,
-            "periodo": {
-                "inicio": str(periodo_inicio),
-                "fin": str(periodo_fin),
-                "tipo": tipo_periodo
-            },
-            "cantidad_registros": len(datos),
-            "validacion": validacion_datos,
-            "mensaje": f"Carga creada exitosamente. Pendiente de aprobación."
-        }), 201
+            excedido = _verificar_tamano_carga(reporte_config, file)
+            if excedido:
+                return excedido
+            
+            # Mismo archivo ya ingerido en este reporte: no se vuelve a procesar
+            sha256 = calcular_sha256(_fuente_archivo(file))
+            reserva_id, duplicado = _reservar_archivo(codigo, sha256, archivo_nombre, _tamano_archivo(file), usuario)
+            if duplicado:
+                return jsonify(duplicado), 200
         
+        exito, carga_id = False, None
+        try:
+            if not request.is_json:
+                # Procesar Excel desde el archivo temporal en disco
+                with parseo_excel_semaforo:
+                    df = pd.read_excel(_fuente_archivo(file))
+                datos = df.to_dict('records')
+            
+            cuerpo, status = _crear_carga_staging(codigo, reporte_config, datos, archivo_nombre, usuario)
+            exito = status == 201
+            carga_id = cuerpo.get('carga_id')
+        finally:
+            _cerrar_reserva_archivo(reserva_id, exito, carga_id=carga_id)
+        return jsonify(cuerpo), status
+        
+    except RequestEntityTooLarge as e:
+        return carga_demasiado_grande(e)
     except Exception as e:
         logger.error(f"Error cargando datos: {e}")
         import traceback
@@ -2658,85 +3328,98 @@ def obtener_carga(carga_id):
         return jsonify({"error": str(e)}), 500
 
 
+def _post_aprobacion(por_reporte: dict):
+    """
+    Tareas posteriores a aprobar cargas, una sola vez por reporte afectado
+    (indexación incremental de todas sus cargas aprobadas en el lote)
+    """
+    for reporte_codigo, carga_ids in por_reporte.items():
+        try:
+            cola_indexacion.encolar(reporte_codigo, carga_ids=carga_ids)
+        except Exception as e:
+            logger.warning(f"Error encolando indexación después de aprobar ({reporte_codigo}): {e}")
+
+def _respuesta_aprobacion(resultado: dict):
+    """Traducir el resultado de db_manager.aprobar_cargas a status HTTP"""
+    errores = resultado['errores']
+    if any(e['error'] == 'Carga no encontrada' for e in errores):
+        return 404
+    if any('solapado' in e['error'] for e in errores):
+        return 409
+    return 400
+
 @app.route('/api/cargas/<int:carga_id>/aprobar', methods=['POST'])
 def aprobar_carga(carga_id):
     """Aprobar carga y mover datos a tabla definitiva"""
     try:
-        from datetime import datetime
-        
-        # Obtener información de la carga
-        carga = db_manager.ejecutar_query(
-            "SELECT reporte_codigo, estado, cantidad_registros FROM cargas_datos WHERE id = %s",
-            (carga_id,)
-        )
+        # Obtener usuario que aprueba
+        data = request.get_json(silent=True) or {}
+        usuario = data.get('usuario', request.headers.get('X-User', 'admin'))
+        notas = data.get('notas', '')
         
-        if not carga:
-            return jsonify({"error": "Carga no encontrada"}), 404
+        resultado = db_manager.aprobar_cargas([carga_id], usuario, notas)
+        if not resultado['success']:
+            return jsonify({
+                "error": resultado['errores'][0]['error'],
+                "errores": resultado['errores']
+            }), _respuesta_aprobacion(resultado)
         
-        reporte_codigo, estado, cantidad = carga[0]
+        _post_aprobacion(resultado['por_reporte'])
+        reporte_codigo = next(iter(resultado['por_reporte']))
         
-        if estado == 'aprobado':
-            return jsonify({"error": "La carga ya fue aprobada"}), 400
+        return jsonify({
+            "success": True,
+            "mensaje": f"Carga aprobada. {resultado['registros_movidos']} registros movidos a datos definitivos.",
+            "reporte_codigo": reporte_codigo,
+            "indexacion": "encolada"
+        }), 200
         
-        # Obtener usuario que aprueba
-        data = request.get_json() or {}
+    except Exception as e:
+        logger.error(f"Error aprobando carga: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/cargas/aprobar-lote', methods=['POST'])
+def aprobar_cargas_lote():
+    """
+    Aprobar varias cargas en una sola transacción (todo o nada)
+    Body: { "carga_ids": [1, 2, 3], "usuario": "...", "notas": "..." }
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        carga_ids = data.get('carga_ids') or []
         usuario = data.get('usuario', request.headers.get('X-User', 'admin'))
         notas = data.get('notas', '')
         
-        # Mover datos de temporal a definitivo
-        db_manager.ejecutar_query(
-            """
-            INSERT INTO datos_reportes (reporte_codigo, datos, carga_id, fecha_periodo, periodo_inicio, periodo_fin, uploaded_by)
-            SELECT 
-                reporte_codigo,
-                datos,
-                carga_id,
-                fecha_extraida,
-                periodo_inicio,
-                periodo_fin,
-                %s
-            FROM datos_temporales
-            WHERE carga_id = %s
-            """,
-            (usuario, carga_id),
-            commit=False
-        )
+        if not isinstance(carga_ids, list) or not carga_ids:
+            return jsonify({"error": "Debe enviar carga_ids como lista no vacía"}), 400
+        try:
+            carga_ids = [int(i) for i in carga_ids]
+        except (TypeError, ValueError):
+            return jsonify({"error": "carga_ids debe contener solo números"}), 400
         
-        # Actualizar estado de carga
-        db_manager.ejecutar_query(
-            """
-            UPDATE cargas_datos 
-            SET estado = 'aprobado', 
-                fecha_aprobacion = %s, 
-                aprobado_por = %s,
-                notas = %s
-            WHERE id = %s
-            """,
-            (datetime.now(), usuario, notas, carga_id),
-            commit=False
-        )
+        resultado = db_manager.aprobar_cargas(carga_ids, usuario, notas)
+        if not resultado['success']:
+            return jsonify({
+                "error": "No se aprobó ninguna carga",
+                "errores": resultado['errores']
+            }), _respuesta_aprobacion(resultado)
         
-        # Borrar datos temporales (ya están en definitiva)
-        db_manager.ejecutar_query(
-            "DELETE FROM datos_temporales WHERE carga_id = %s",
-            (carga_id,),
-            commit=True
-        )
-        
-        # Reindexar en ChromaDB
-        try:
-            indexar_datos_reporte(reporte_codigo)
-        except Exception as e:
-            logger.warning(f"Error reindexando después de aprobar: {e}")
+        _post_aprobacion(resultado['por_reporte'])
         
         return jsonify({
             "success": True,
-            "mensaje": f"Carga aprobada. {cantidad} registros movidos a datos definitivos.",
-            "reporte_codigo": reporte_codigo
+            "mensaje": f"{len(resultado['aprobadas'])} cargas aprobadas. {resultado['registros_movidos']} registros movidos a datos definitivos.",
+            "aprobadas": resultado['aprobadas'],
+            "registros_movidos": resultado['registros_movidos'],
+            "reportes": resultado['por_reporte'],
+            "indexacion": "encolada"
         }), 200
         
     except Exception as e:
-        logger.error(f"Error aprobando carga: {e}")
+        logger.error(f"Error aprobando cargas en lote: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
@@ -2750,29 +3433,29 @@ def rechazar_carga(carga_id):
         razon = data.get('razon', 'No especificada')
         usuario = data.get('usuario', request.headers.get('X-User', 'admin'))
         
-        # Actualizar estado
-        db_manager.ejecutar_query(
-            """
-            UPDATE cargas_datos 
-            SET estado = 'rechazado', 
-                errores_validacion = %s,
-                aprobado_por = %s
-            WHERE id = %s
-            """,
-            (razon, usuario, carga_id),
-            commit=False
-        )
+        # Actualizar estado, contadores y eliminar datos temporales (una transacción)
+        resultado = db_manager.rechazar_carga(carga_id, razon, usuario)
+        if resultado is None:
+            return jsonify({"error": "Carga no encontrada"}), 404
         
-        # Eliminar datos temporales
-        db_manager.ejecutar_query(
-            "DELETE FROM datos_temporales WHERE carga_id = %s",
-            (carga_id,),
-            commit=True
-        )
+        # Carga aprobada que se reemplaza: sus registros salen también del índice
+        vectores_eliminados = 0
+        if resultado['registros_eliminados']:
+            try:
+                vectores_eliminados = analysis_agent.eliminar_vectores(
+                    resultado['reporte_codigo'], where={'carga_id': carga_id}
+                )
+            except Exception as e:
+                logger.warning(f"No se pudieron retirar vectores de la carga {carga_id}: {e}")
+            # Regenerar los resúmenes por periodo sin los registros de la carga
+            cola_indexacion.encolar(resultado['reporte_codigo'])
         
         return jsonify({
             "success": True,
-            "mensaje": "Carga rechazada y datos temporales eliminados"
+            "mensaje": "Carga rechazada y datos temporales eliminados",
+            "estado_anterior": resultado['estado_anterior'],
+            "registros_eliminados": resultado['registros_eliminados'],
+            "vectores_eliminados": vectores_eliminados
         }), 200
         
     except Exception as e:
@@ -0,0 +1,242 @@
+"""
+Filtros de metadata y fusión de resultados para la búsqueda de registros
+Los documentos de registro llevan fecha_periodo (YYYYMMDD como entero), anio, mes,
+carga_id y los campos categóricos del reporte como campo_<nombre>, de modo que la
+búsqueda vectorial recorra solo el subconjunto que cumple el filtro. El modo híbrido
+combina esa búsqueda con la de texto completo en Postgres mediante RRF.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+MESES = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6,
+    'julio': 7, 'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10,
+    'noviembre': 11, 'diciembre': 12
+}
+
+PREFIJO_CAMPO = 'campo_'
+MAX_VALOR_METADATA = 100
+
+
+def fecha_a_entero(valor) -> Optional[int]:
+    """'2024-01-15', '2024-01-15T00:00:00' o date -> 20240115 (None si no es fecha)"""
+    if valor is None:
+        return None
+    if hasattr(valor, 'year') and hasattr(valor, 'month'):
+        return valor.year * 10000 + valor.month * 100 + valor.day
+    coincidencia = re.match(r'^(\d{4})-(\d{2})-(\d{2})', str(valor))
+    if not coincidencia:
+        return None
+    anio, mes, dia = (int(g) for g in coincidencia.groups())
+    return anio * 10000 + mes * 100 + dia
+
+
+def metadata_registro(registro: Dict, campo_fecha: Optional[str], campos_filtro: List[str]) -> Dict:
+    """Metadata tipada de un registro para filtrar (ChromaDB no admite None: se omiten)"""
+    datos = registro.get('datos') or {}
+    metadata = {}
+
+    fecha = fecha_a_entero(datos.get(campo_fecha)) if campo_fecha else None
+    if fecha:
+        metadata['fecha_periodo'] = fecha
+        metadata['anio'] = fecha // 10000
+        metadata['mes'] = fecha // 100 % 100
+
+    if registro.get('carga_id') is not None:
+        metadata['carga_id'] = int(registro['carga_id'])
+
+    for campo in campos_filtro:
+        valor = datos.get(campo)
+        if valor is None or isinstance(valor, (list, dict)):
+            continue
+        if isinstance(valor, bool) or isinstance(valor, (int, float)):
+            metadata[f"{PREFIJO_CAMPO}{campo}"] = valor
+        else:
+            metadata[f"{PREFIJO_CAMPO}{campo}"] = str(valor).strip()[:MAX_VALOR_METADATA]
+    return metadata
+
+
+def combinar_condiciones(condiciones: List[Dict]) -> Optional[Dict]:
+    """ChromaDB exige $and explícito cuando hay más de una condición"""
+    condiciones = [c for c in condiciones if c]
+    if not condiciones:
+        return None
+    if len(condiciones) == 1:
+        return condiciones[0]
+    return {'$and': condiciones}
+
+
+def construir_where(fecha_inicio=None, fecha_fin=None, carga_id=None, filtros: Dict = None,
+                    anio: int = None, mes: int = None) -> Optional[Dict]:
+    """
+    Filtro where de ChromaDB a partir de parámetros simples
+    filtros: {campo: valor} o {campo: [valores]} sobre los campos categóricos indexados
+    """
+    condiciones = []
+    inicio, fin = fecha_a_entero(fecha_inicio), fecha_a_entero(fecha_fin)
+    if inicio:
+        condiciones.append({'fecha_periodo': {'$gte': inicio}})
+    if fin:
+        condiciones.append({'fecha_periodo': {'$lte': fin}})
+    if anio:
+        condiciones.append({'anio': int(anio)})
+    if mes:
+        condiciones.append({'mes': int(mes)})
+    if carga_id is not None:
+        if isinstance(carga_id, (list, tuple)):
+            condiciones.append({'carga_id': {'$in': [int(c) for c in carga_id]}})
+        else:
+            condiciones.append({'carga_id': int(carga_id)})
+    for campo, valor in (filtros or {}).items():
+        clave = campo if campo.startswith(PREFIJO_CAMPO) else f"{PREFIJO_CAMPO}{campo}"
+        if isinstance(valor, (list, tuple)):
+            condiciones.append({clave: {'$in': list(valor)}})
+        else:
+            condiciones.append({clave: valor})
+    return combinar_condiciones(condiciones)
+
+
+def extraer_periodo_pregunta(pregunta: str) -> Tuple[List[int], List[int]]:
+    """Años y meses mencionados en el texto -> ([anios], [meses]), ordenados y sin repetir"""
+    texto = pregunta.lower()
+    meses = sorted({num for nombre, num in MESES.items() if re.search(rf'\b{nombre}\b', texto)})
+    anios = sorted({int(a) for a in re.findall(r'\b(19\d{2}|20\d{2})\b', texto)})
+    return anios, meses
+
+
+def extraer_filtros_pregunta(pregunta: str) -> Optional[Dict]:
+    """
+    Filtro de fecha deducido del texto: "facturas de enero" -> mes 1,
+    "ventas de marzo 2024" -> 2024-03, "en 2023" -> año 2023
+    """
+    anios, meses = extraer_periodo_pregunta(pregunta)
+
+    condiciones = []
+    if len(anios) == 1:
+        condiciones.append({'anio': anios[0]})
+    elif anios:
+        condiciones.append({'anio': {'$in': anios}})
+    if len(meses) == 1:
+        condiciones.append({'mes': meses[0]})
+    elif meses:
+        condiciones.append({'mes': {'$in': meses}})
+    return combinar_condiciones(condiciones)
+
+
+def traducir_where(where: Dict) -> Dict:
+    """
+    Filtro where de ChromaDB -> parámetros de buscar_texto_datos, para que la búsqueda
+    de texto del modo híbrido recorra el mismo subconjunto que la vectorial
+    Admite igualdad e $in sobre campo_<nombre>, anio, mes y carga_id y $gte/$lte sobre
+    fecha_periodo, combinados con $and; cualquier otra cosa lanza ValueError
+    """
+    if not isinstance(where, dict) or not where:
+        raise ValueError('where debe ser un objeto con al menos una condición')
+    if set(where) == {'$and'}:
+        condiciones = where['$and']
+    else:
+        condiciones = [{clave: valor} for clave, valor in where.items()]
+
+    parametros = {'filtros': {}}
+    for condicion in condiciones:
+        if not isinstance(condicion, dict) or len(condicion) != 1:
+            raise ValueError(f"Condición no admitida en modo híbrido: {condicion}")
+        clave, valor = next(iter(condicion.items()))
+        operadores = valor if isinstance(valor, dict) else {'$eq': valor}
+        for operador, operando in operadores.items():
+            if clave == 'fecha_periodo' and operador in ('$gte', '$lte'):
+                destino = parametros
+                nombre = 'fecha_inicio' if operador == '$gte' else 'fecha_fin'
+                fecha = str(int(operando))
+                valores = f"{fecha[:4]}-{fecha[4:6]}-{fecha[6:8]}"
+            elif operador in ('$eq', '$in') and clave in ('anio', 'mes', 'carga_id'):
+                destino = parametros
+                nombre = {'anio': 'anios', 'mes': 'meses', 'carga_id': 'carga_id'}[clave]
+                valores = [int(v) for v in (operando if operador == '$in' else [operando])]
+            elif operador in ('$eq', '$in') and clave.startswith(PREFIJO_CAMPO):
+                destino = parametros['filtros']
+                nombre = clave[len(PREFIJO_CAMPO):]
+                valores = list(operando) if operador == '$in' else [operando]
+            else:
+                raise ValueError(f"Operador {operador} sobre {clave} no admitido en modo híbrido")
+            if nombre in destino:
+                raise ValueError(f"Condición repetida sobre {clave} en modo híbrido")
+            destino[nombre] = valores
+    return parametros
+
+
+def es_token_exacto(consulta: str) -> bool:
+    """Consulta de un solo identificador con dígitos (factura, NIT, documento)"""
+    consulta = consulta.strip()
+    return bool(re.fullmatch(r'[\w\-./]+', consulta)) and any(c.isdigit() for c in consulta)
+
+
+def fusionar_rrf(rankings: List[List], k: int = 60) -> List[tuple]:
+    """
+    Reciprocal Rank Fusion: puntaje = suma de 1 / (k + posición) en cada ranking
+    Devuelve [(clave, puntaje)] de mayor a menor
+    """
+    puntajes = {}
+    for ranking in rankings:
+        for posicion, clave in enumerate(ranking, start=1):
+            puntajes[clave] = puntajes.get(clave, 0.0) + 1.0 / (k + posicion)
+    return sorted(puntajes.items(), key=lambda item: item[1], reverse=True)
+
+
+def normalizar_consulta(consulta: str) -> str:
+    """Minúsculas y espacios colapsados: variaciones triviales comparten entrada de cache"""
+    return ' '.join(consulta.lower().split())
+
+
+class CacheLRU:
+    """Cache LRU en memoria con límite de entradas y métricas de aciertos (thread-safe)"""
+
+    def __init__(self, max_entradas: int = 512):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def obtener(self, clave):
+        with self._lock:
+            if clave in self._datos:
+                self._datos.move_to_end(clave)
+                self.aciertos += 1
+                return self._datos[clave]
+            self.fallos += 1
+            return None
+
+    def guardar(self, clave, valor):
+        if self.max_entradas <= 0:
+            return
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+                self.expulsiones += 1
+
+    def invalidar(self, predicado=None):
+        """Eliminar todas las entradas o las que cumplan predicado(clave)"""
+        with self._lock:
+            if predicado is None:
+                self._datos.clear()
+                return
+            for clave in [c for c in self._datos if predicado(c)]:
+                del self._datos[clave]
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._datos),
+                'max_entradas': self.max_entradas,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'expulsiones': self.expulsiones,
+                'tasa_aciertos': round(self.aciertos / total, 4) if total else None
+            }
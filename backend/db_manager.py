@@ -3,16 +3,23 @@ Gestor de base de datos dinámico
 Crea y gestiona tablas automáticamente según configuración de reportes
 """
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import errors
+from psycopg2.extras import RealDictCursor, execute_values, Json
 import logging
 import json
+import csv
+import io
 import pandas as pd
 from datetime import datetime
 from typing import List, Dict, Optional
 from models import ReporteConfig, CampoConfig
+from ingesta import calcular_periodos
 
 logger = logging.getLogger(__name__)
 
+# Expresión del índice GIN de texto completo (migrate_busqueda_texto.py); debe ser idéntica
+TSVECTOR_DATOS = "jsonb_to_tsvector('simple'::regconfig, datos, '[\"string\", \"numeric\"]'::jsonb)"
+
 class DatabaseManager:
     """Gestor dinámico de base de datos"""
     
@@ -66,6 +73,15 @@ class DatabaseManager:
                 ON datos_reportes(reporte_codigo);
             ''')
             
+            # Versión de datos por reporte: la incrementa cada escritura sobre datos_reportes
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS datos_version (
+                    reporte_codigo VARCHAR(100) PRIMARY KEY,
+                    version BIGINT NOT NULL DEFAULT 0,
+                    actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            ''')
+            
             # Tabla de logs de carga
             cur.execute('''
                 CREATE TABLE IF NOT EXISTS cargas_log (
@@ -279,6 +295,15 @@ class DatabaseManager:
             if 'activo' in datos:
                 campos_update.append('activo = %s')
                 valores.append(datos['activo'])
+            if 'limite_carga_mb' in datos:
+                campos_update.append('limite_carga_mb = %s')
+                valores.append(datos['limite_carga_mb'] or None)
+            if 'indexacion_registros' in datos:
+                campos_update.append('indexacion_registros = %s')
+                valores.append(datos['indexacion_registros'])
+            if 'indexacion_muestra_pct' in datos:
+                campos_update.append('indexacion_muestra_pct = %s')
+                valores.append(datos['indexacion_muestra_pct'])
             
             campos_update.append('updated_at = CURRENT_TIMESTAMP')
             valores.append(codigo)
@@ -303,8 +328,25 @@ class DatabaseManager:
             cur.close()
             conn.close()
     
-    def insertar_datos(self, reporte_codigo: str, datos_lista: List[Dict], usuario='sistema'):
-        """Insertar datos de un reporte"""
+    def _limpiar_registro(self, datos: Dict) -> Dict:
+        """Limpiar datos None y convertir a tipos compatibles con JSON"""
+        datos_limpios = {}
+        for key, value in datos.items():
+            if isinstance(value, (list, dict)):
+                datos_limpios[key] = value
+            elif pd.isna(value):
+                datos_limpios[key] = None
+            elif isinstance(value, (pd.Timestamp, datetime)):
+                datos_limpios[key] = value.isoformat()
+            else:
+                datos_limpios[key] = value
+        return datos_limpios
+    
+    def insertar_datos(self, reporte_codigo: str, datos_lista: List[Dict], usuario='sistema', tamano_lote=1000):
+        """
+        Insertar datos de un reporte en bloque (execute_values por lotes)
+        Si un lote falla se reintenta registro a registro para aislar el error
+        """
         conn = self.get_connection()
         cur = conn.cursor()
         
@@ -313,33 +355,46 @@ class DatabaseManager:
             registros_error = 0
             errores = []
             
+            # Serializar primero: un registro no convertible no debe abortar el lote
+            filas = []
             for idx, datos in enumerate(datos_lista):
                 try:
-                    # Limpiar datos None y convertir a tipos compatibles con JSON
-                    datos_limpios = {}
-                    for key, value in datos.items():
-                        if pd.isna(value):
-                            datos_limpios[key] = None
-                        elif isinstance(value, (pd.Timestamp, datetime)):
-                            datos_limpios[key] = value.isoformat()
-                        else:
-                            datos_limpios[key] = value
-                    
-                    cur.execute('''
-                        INSERT INTO datos_reportes (reporte_codigo, datos, uploaded_by)
-                        VALUES (%s, %s, %s)
-                    ''', (reporte_codigo, json.dumps(datos_limpios), usuario))
-                    registros_ok += 1
+                    filas.append((idx, json.dumps(self._limpiar_registro(datos))))
                 except Exception as e:
-                    logger.error(f"Error insertando registro {idx + 1}: {e}")
+                    logger.error(f"Error preparando registro {idx + 1}: {e}")
                     errores.append(f"Registro {idx + 1}: {str(e)}")
                     registros_error += 1
-                    # Rollback solo este registro para no abortar la transacción completa
+            
+            for inicio in range(0, len(filas), tamano_lote):
+                lote = filas[inicio:inicio + tamano_lote]
+                try:
+                    execute_values(
+                        cur,
+                        'INSERT INTO datos_reportes (reporte_codigo, datos, uploaded_by) VALUES %s',
+                        [(reporte_codigo, datos_json, usuario) for _, datos_json in lote],
+                        page_size=tamano_lote
+                    )
+                    self._incrementar_version_datos(cur, [reporte_codigo])
+                    conn.commit()
+                    registros_ok += len(lote)
+                except Exception as e:
+                    logger.warning(f"Lote de {len(lote)} registros falló, reintentando uno a uno: {e}")
                     conn.rollback()
-                    # Crear nueva transacción
-                    cur = conn.cursor()
+                    for idx, datos_json in lote:
+                        try:
+                            cur.execute('''
+                                INSERT INTO datos_reportes (reporte_codigo, datos, uploaded_by)
+                                VALUES (%s, %s, %s)
+                            ''', (reporte_codigo, datos_json, usuario))
+                            self._incrementar_version_datos(cur, [reporte_codigo])
+                            conn.commit()
+                            registros_ok += 1
+                        except Exception as e_reg:
+                            logger.error(f"Error insertando registro {idx + 1}: {e_reg}")
+                            errores.append(f"Registro {idx + 1}: {str(e_reg)}")
+                            registros_error += 1
+                            conn.rollback()
             
-            conn.commit()
             logger.info(f"Insertados {registros_ok} registros en '{reporte_codigo}'")
             
             return {
@@ -388,6 +443,480 @@ class DatabaseManager:
             cur.close()
             conn.close()
     
+    def buscar_texto_datos(self, reporte_codigo: str, consulta: str, limite: int = 10,
+                           fecha_inicio=None, fecha_fin=None, campo_fecha: str = None,
+                           carga_id=None, filtros: Dict = None, anios: List[int] = None,
+                           meses: List[int] = None) -> List[Dict]:
+        """
+        Búsqueda por texto completo en los valores de los registros (índice GIN)
+        Todas las palabras de la consulta deben aparecer; ordenado por ts_rank_cd
+        
+        Args:
+            carga_id: Una carga o lista de cargas
+            filtros: {campo: valor} o {campo: [valores]} sobre los valores de datos
+            anios, meses: Período sobre campo_fecha (fechas ISO)
+        """
+        conn = self.get_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            query = f'''
+                SELECT id, datos, created_at, carga_id,
+                       ts_rank_cd({TSVECTOR_DATOS}, q) AS rango
+                FROM datos_reportes, websearch_to_tsquery('simple', %s) q
+                WHERE reporte_codigo = %s
+                AND {TSVECTOR_DATOS} @@ q
+            '''
+            params = [consulta, reporte_codigo]
+            
+            if campo_fecha and fecha_inicio:
+                query += ' AND datos->>%s >= %s'
+                params.extend([campo_fecha, str(fecha_inicio)])
+            if campo_fecha and fecha_fin:
+                # Fechas ISO con hora: comparar contra el final del día
+                query += ' AND datos->>%s <= %s'
+                params.extend([campo_fecha, f"{fecha_fin}T23:59:59"])
+            if campo_fecha and anios:
+                query += ' AND left(datos->>%s, 4) = ANY(%s)'
+                params.extend([campo_fecha, [f"{int(a):04d}" for a in anios]])
+            if campo_fecha and meses:
+                query += ' AND substring(datos->>%s, 6, 2) = ANY(%s)'
+                params.extend([campo_fecha, [f"{int(m):02d}" for m in meses]])
+            if isinstance(carga_id, (list, tuple)):
+                query += ' AND carga_id = ANY(%s)'
+                params.append([int(c) for c in carga_id])
+            elif carga_id is not None:
+                query += ' AND carga_id = %s'
+                params.append(carga_id)
+            for campo, valor in (filtros or {}).items():
+                # Mismo texto que devuelve ->> (los booleanos JSON son true/false)
+                valores = valor if isinstance(valor, (list, tuple)) else [valor]
+                query += ' AND datos->>%s = ANY(%s)'
+                params.extend([campo, [
+                    str(v).lower() if isinstance(v, bool) else str(v) for v in valores
+                ]])
+            
+            query += ' ORDER BY rango DESC, id LIMIT %s'
+            params.append(limite)
+            
+            cur.execute(query, params)
+            return [dict(row) for row in cur.fetchall()]
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    def iterar_datos_reporte(self, reporte_codigo: str, desde_id: int = 0, carga_ids=None,
+                             tamano_pagina: int = 1000, muestra_pct: int = None,
+                             hasta_id: int = None, creados_desde=None):
+        """
+        Iterar registros definitivos en páginas por id ascendente (keyset, sin OFFSET)
+        
+        Args:
+            desde_id: Solo registros con id mayor (marca de indexación)
+            carga_ids: Limitar a una o varias cargas
+            muestra_pct: Solo una muestra determinista (id % 100 < muestra_pct)
+            hasta_id: Solo registros con id menor o igual
+            creados_desde: Solo registros con created_at desde ese instante
+        """
+        if isinstance(carga_ids, int):
+            carga_ids = [carga_ids]
+        ultimo_id = desde_id or 0
+        while True:
+            conn = self.get_connection()
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            try:
+                query = '''
+                    SELECT id, datos, created_at, uploaded_by, carga_id 
+                    FROM datos_reportes 
+                    WHERE reporte_codigo = %s AND id > %s
+                '''
+                params = [reporte_codigo, ultimo_id]
+                if carga_ids:
+                    query += ' AND carga_id = ANY(%s)'
+                    params.append(list(carga_ids))
+                if muestra_pct and muestra_pct < 100:
+                    query += ' AND id %% 100 < %s'
+                    params.append(muestra_pct)
+                if hasta_id is not None:
+                    query += ' AND id <= %s'
+                    params.append(hasta_id)
+                if creados_desde is not None:
+                    query += ' AND created_at >= %s'
+                    params.append(creados_desde)
+                query += ' ORDER BY id LIMIT %s'
+                params.append(tamano_pagina)
+                
+                cur.execute(query, params)
+                pagina = [dict(row) for row in cur.fetchall()]
+            finally:
+                cur.close()
+                conn.close()
+            
+            if not pagina:
+                break
+            yield pagina
+            ultimo_id = pagina[-1]['id']
+    
+    def consultar_datos_carga(self, reporte_codigo: str, carga_ids, tamano_pagina: int = 1000,
+                              muestra_pct: int = None):
+        """Registros definitivos de una o varias cargas en páginas (para reindexar solo lo aprobado)"""
+        return self.iterar_datos_reporte(reporte_codigo, carga_ids=carga_ids, tamano_pagina=tamano_pagina,
+                                         muestra_pct=muestra_pct)
+    
+    def resumen_periodos(self, reporte_codigo: str, campo_fecha: str, campos_numericos: List[str],
+                         dimension: str = None, top: int = 20) -> List[Dict]:
+        """
+        Totales mensuales (opcionalmente por valor de un campo categórico) calculados en SQL
+        
+        Por cada periodo devuelve los `top` valores con más registros, con conteo, suma de
+        cada campo numérico y los mismos datos del periodo anterior con datos (tendencia).
+        Las fechas inválidas (p. ej. '2024-13-45' o '2024-02-30') se omiten sin castear.
+        """
+        conn = self.get_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            params = [campo_fecha, reporte_codigo]
+            if dimension:
+                expr_valor = "COALESCE(NULLIF(datos->>%s, ''), '(sin valor)')"
+                params.append(dimension)
+            else:
+                expr_valor = "'(total)'::TEXT"
+            
+            sumas, anteriores = [], []
+            for i, campo in enumerate(campos_numericos):
+                sumas.append(
+                    f"SUM(CASE WHEN jsonb_typeof(datos->%s) = 'number' THEN (datos->>%s)::NUMERIC END) AS total_{i}"
+                )
+                anteriores.append(f"LAG(total_{i}) OVER w AS anterior_{i}")
+                params.extend([campo, campo])
+            params.append(top)
+            
+            # CASE anidados: el formato se valida antes de castear (el orden de un AND no
+            # está garantizado) y el día se compara con el último del mes
+            cur.execute(f'''
+                WITH filas AS (
+                    SELECT d.datos,
+                           CASE WHEN f.texto ~ '^[1-9]\\d{{3}}-(0[1-9]|1[0-2])-(0[1-9]|[12]\\d|3[01])' THEN
+                               CASE WHEN SUBSTRING(f.texto, 9, 2)::INT <= EXTRACT(
+                                   DAY FROM (LEFT(f.texto, 7) || '-01')::DATE + INTERVAL '1 month - 1 day'
+                               ) THEN (LEFT(f.texto, 7) || '-01')::DATE END
+                           END AS periodo
+                    FROM datos_reportes d
+                    CROSS JOIN LATERAL (SELECT d.datos->>%s AS texto) f
+                    WHERE d.reporte_codigo = %s
+                ),
+                base AS (
+                    SELECT periodo,
+                           {expr_valor} AS valor,
+                           COUNT(*) AS registros
+                           {''.join(', ' + s for s in sumas)}
+                    FROM filas
+                    WHERE periodo IS NOT NULL
+                    GROUP BY 1, 2
+                ),
+                con_tendencia AS (
+                    SELECT base.*,
+                           ROW_NUMBER() OVER (PARTITION BY periodo ORDER BY registros DESC, valor) AS posicion,
+                           LAG(periodo) OVER w AS periodo_anterior,
+                           LAG(registros) OVER w AS registros_anterior
+                           {''.join(', ' + a for a in anteriores)}
+                    FROM base
+                    WINDOW w AS (PARTITION BY valor ORDER BY periodo)
+                )
+                SELECT * FROM con_tendencia
+                WHERE posicion <= %s
+                ORDER BY periodo, posicion
+            ''', params)
+            
+            filas = []
+            for row in cur.fetchall():
+                fila = {
+                    'periodo': row['periodo'],
+                    'periodo_anterior': row['periodo_anterior'],
+                    'valor': row['valor'],
+                    'registros': row['registros'],
+                    'registros_anterior': row['registros_anterior'],
+                    'totales': {},
+                    'anteriores': {}
+                }
+                for i, campo in enumerate(campos_numericos):
+                    total, anterior = row[f'total_{i}'], row[f'anterior_{i}']
+                    fila['totales'][campo] = float(total) if total is not None else None
+                    fila['anteriores'][campo] = float(anterior) if anterior is not None else None
+                filas.append(fila)
+            return filas
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    def _incrementar_version_datos(self, cur, reporte_codigos):
+        """
+        Incrementar la versión de datos de los reportes dentro de la transacción del cursor
+        Debe ser la última sentencia antes del commit: la fila queda bloqueada hasta entonces
+        """
+        # Orden fijo: dos transacciones que tocan los mismos reportes no se bloquean en cruz
+        cur.execute('''
+            INSERT INTO datos_version (reporte_codigo, version, actualizado)
+            SELECT codigo, 1, CURRENT_TIMESTAMP FROM unnest(%s::VARCHAR[]) AS codigo
+            ORDER BY codigo
+            ON CONFLICT (reporte_codigo) DO UPDATE SET
+                version = datos_version.version + 1,
+                actualizado = CURRENT_TIMESTAMP
+        ''', (sorted(set(reporte_codigos)),))
+    
+    def version_datos_reporte(self, reporte_codigo: str) -> str:
+        """
+        Huella barata del estado de los datos del reporte: contador de cambios de datos_version
+        (inserciones, aprobaciones, rechazos y purgas) y última modificación de su configuración
+        Son dos búsquedas por clave primaria, sin recorrer datos_reportes
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                SELECT 
+                    (SELECT version FROM datos_version WHERE reporte_codigo = %s),
+                    (SELECT updated_at FROM reportes_config WHERE codigo = %s)
+            ''', (reporte_codigo, reporte_codigo))
+            version, actualizado = cur.fetchone()
+            marca_config = actualizado.strftime('%Y%m%d%H%M%S') if actualizado else '0'
+            return f"v{version or 0}:{marca_config}"
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    def obtener_analisis_cache(self, reporte_codigo: str, tipo_analisis: str, version_datos: str,
+                               version_prompt: str, ttl_horas: float) -> Optional[Dict]:
+        """Análisis guardado para la misma versión de datos y prompt, si no venció"""
+        conn = self.get_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            cur.execute('''
+                SELECT resultado, creado_en 
+                FROM analisis_cache
+                WHERE reporte_codigo = %s AND tipo_analisis = %s
+                AND version_datos = %s AND version_prompt = %s
+                AND creado_en > CURRENT_TIMESTAMP - make_interval(secs => %s)
+            ''', (reporte_codigo, tipo_analisis, version_datos, version_prompt, ttl_horas * 3600))
+            row = cur.fetchone()
+            return dict(row) if row else None
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    def guardar_analisis_cache(self, reporte_codigo: str, tipo_analisis: str, version_datos: str,
+                               version_prompt: str, resultado: Dict):
+        """Guardar un análisis y descartar los de versiones anteriores del mismo tipo"""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                DELETE FROM analisis_cache
+                WHERE reporte_codigo = %s AND tipo_analisis = %s
+                AND (version_datos, version_prompt) <> (%s, %s)
+            ''', (reporte_codigo, tipo_analisis, version_datos, version_prompt))
+            cur.execute('''
+                INSERT INTO analisis_cache (reporte_codigo, tipo_analisis, version_datos, version_prompt, resultado)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (reporte_codigo, tipo_analisis, version_datos, version_prompt) 
+                DO UPDATE SET resultado = EXCLUDED.resultado, creado_en = CURRENT_TIMESTAMP
+            ''', (reporte_codigo, tipo_analisis, version_datos, version_prompt,
+                  Json(resultado, dumps=lambda o: json.dumps(o, default=str))))
+            conn.commit()
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error guardando análisis en cache: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def obtener_marca_indexacion(self, reporte_codigo: str) -> int:
+        """Último datos_reportes.id indexado en ChromaDB para el reporte (0 si nunca)"""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute(
+                'SELECT ultimo_id FROM indexacion_estado WHERE reporte_codigo = %s',
+                (reporte_codigo,)
+            )
+            row = cur.fetchone()
+            return row[0] if row else 0
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    def avanzar_marca_indexacion(self, reporte_codigo: str, ultimo_id: int, indexados: int) -> int:
+        """
+        Avanzar la marca de indexación de forma atómica y monótona
+        (GREATEST: una ejecución concurrente más lenta nunca la hace retroceder)
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                INSERT INTO indexacion_estado (reporte_codigo, ultimo_id, total_indexados, actualizado)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (reporte_codigo) DO UPDATE SET
+                    ultimo_id = GREATEST(indexacion_estado.ultimo_id, EXCLUDED.ultimo_id),
+                    total_indexados = indexacion_estado.total_indexados + EXCLUDED.total_indexados,
+                    actualizado = CURRENT_TIMESTAMP
+                RETURNING ultimo_id
+            ''', (reporte_codigo, ultimo_id, indexados))
+            marca = cur.fetchone()[0]
+            conn.commit()
+            return marca
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error avanzando marca de indexación: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def obtener_ventana_indexacion(self, reporte_codigo: str):
+        """
+        Inicio de la ventana a revisar por debajo de la marca (pendiente_desde)
+        Los ids se asignan al insertar, no al confirmar: una transacción que seguía
+        abierta cuando se avanzó la marca puede confirmar después filas con id menor.
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute(
+                'SELECT pendiente_desde FROM indexacion_estado WHERE reporte_codigo = %s',
+                (reporte_codigo,)
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    def inicio_transacciones_abiertas(self):
+        """
+        Inicio de la transacción abierta más antigua de la base (o ahora si no hay)
+        Toda fila que todavía no sea visible tiene created_at (inicio de su transacción)
+        igual o posterior a este instante. Requiere que la aplicación use un único
+        usuario de BD: pg_stat_activity oculta xact_start de sesiones de otros roles.
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                SELECT LEAST(clock_timestamp(), MIN(xact_start))::timestamp
+                FROM pg_stat_activity
+                WHERE datname = current_database()
+                AND pid <> pg_backend_pid()
+                AND xact_start IS NOT NULL
+            ''')
+            return cur.fetchone()[0]
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    def guardar_ventana_indexacion(self, reporte_codigo: str, pendiente_desde):
+        """Guardar el inicio de la ventana que la próxima indexación debe volver a revisar"""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                INSERT INTO indexacion_estado (reporte_codigo, pendiente_desde, actualizado)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (reporte_codigo) DO UPDATE SET
+                    pendiente_desde = EXCLUDED.pendiente_desde,
+                    actualizado = CURRENT_TIMESTAMP
+            ''', (reporte_codigo, pendiente_desde))
+            conn.commit()
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error guardando ventana de indexación: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def obtener_version_resumenes(self, reporte_codigo: str) -> Optional[str]:
+        """version_datos_reporte con la que se generaron por última vez los resúmenes indexados"""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute(
+                'SELECT version_resumenes FROM indexacion_estado WHERE reporte_codigo = %s',
+                (reporte_codigo,)
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    def guardar_version_resumenes(self, reporte_codigo: str, version: str):
+        """Registrar la versión de datos con la que quedaron al día los resúmenes"""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                INSERT INTO indexacion_estado (reporte_codigo, version_resumenes, actualizado)
+                VALUES (%s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (reporte_codigo) DO UPDATE SET
+                    version_resumenes = EXCLUDED.version_resumenes,
+                    actualizado = CURRENT_TIMESTAMP
+            ''', (reporte_codigo, version))
+            conn.commit()
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error guardando versión de resúmenes: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def reiniciar_marca_indexacion(self, reporte_codigo: str):
+        """Volver la marca a 0 para reindexar el reporte completo"""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                UPDATE indexacion_estado 
+                SET ultimo_id = 0, total_indexados = 0, pendiente_desde = NULL,
+                    version_resumenes = NULL, actualizado = CURRENT_TIMESTAMP
+                WHERE reporte_codigo = %s
+            ''', (reporte_codigo,))
+            conn.commit()
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error reiniciando marca de indexación: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
     def consultar_datos_filtrado(self, reporte_codigo: str, fecha_inicio=None, fecha_fin=None, 
                                  limite=100, filtros: Optional[Dict] = None):
         """Consultar datos con filtros dinámicos"""
@@ -874,6 +1403,551 @@ class DatabaseManager:
             cur.close()
             conn.close()
     
+    def insertar_carga_temporal(
+        self,
+        reporte_codigo: str,
+        datos: List[Dict],
+        periodo_inicio,
+        periodo_fin,
+        tipo_periodo: str,
+        campo_fecha: str = None,
+        archivo_original: str = None,
+        usuario: str = None,
+        validacion_previa: Dict = None,
+        tamano_lote: int = 10000
+    ) -> int:
+        """
+        Registrar una carga y sus filas en datos_temporales en una sola transacción
+        Las filas se cargan con COPY y fecha_extraida/periodo_inicio/periodo_fin se
+        calculan vectorizados (mismo criterio que calcular_periodo), sin trigger por fila
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                INSERT INTO cargas_datos 
+                (reporte_codigo, periodo_inicio, periodo_fin, periodo_tipo, cantidad_registros, 
+                 registros_pendientes, archivo_original, usuario_carga, estado, validacion_previa)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (
+                reporte_codigo, periodo_inicio, periodo_fin, tipo_periodo, len(datos), len(datos),
+                archivo_original, usuario, 'pendiente',
+                json.dumps(validacion_previa, default=str) if validacion_previa else None
+            ))
+            carga_id = cur.fetchone()[0]
+            
+            fechas, inicios, fines = calcular_periodos(
+                [registro.get(campo_fecha) for registro in datos] if campo_fecha else [None] * len(datos),
+                tipo_periodo if campo_fecha else None
+            )
+            fechas, inicios, fines = (
+                serie.dt.strftime('%Y-%m-%d').where(serie.notna(), None).tolist()
+                for serie in (fechas, inicios, fines)
+            )
+            
+            for inicio in range(0, len(datos), tamano_lote):
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for idx in range(inicio, min(inicio + tamano_lote, len(datos))):
+                    writer.writerow([
+                        carga_id,
+                        reporte_codigo,
+                        json.dumps(self._limpiar_registro(datos[idx])),
+                        idx + 1,
+                        fechas[idx] or '',
+                        inicios[idx] or '',
+                        fines[idx] or ''
+                    ])
+                buffer.seek(0)
+                cur.copy_expert('''
+                    COPY datos_temporales 
+                    (carga_id, reporte_codigo, datos, fila_numero, fecha_extraida, periodo_inicio, periodo_fin)
+                    FROM STDIN WITH (FORMAT csv)
+                ''', buffer)
+            
+            conn.commit()
+            logger.info(f"Carga {carga_id} de '{reporte_codigo}': {len(datos)} registros en staging")
+            return carga_id
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error registrando carga temporal: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def aprobar_cargas(self, carga_ids: List[int], usuario: str, notas: str = '') -> Dict:
+        """
+        Aprobar varias cargas en una sola transacción (todo o nada)
+        Valida estados, mueve todas las filas de staging con sentencias por conjunto y
+        deja que la restricción de exclusión de periodos rechace solapamientos
+        (entre las cargas pedidas o contra las ya aprobadas).
+        
+        Returns:
+            {'success': True, 'aprobadas': [...], 'registros_movidos': n, 'por_reporte': {codigo: [ids]}}
+            o {'success': False, 'errores': [...]} sin modificar nada
+        """
+        carga_ids = sorted(set(int(i) for i in carga_ids))
+        conn = self.get_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            # Bloquear las cargas para que dos aprobaciones simultáneas no se pisen
+            cur.execute('''
+                SELECT id, reporte_codigo, estado, periodo_inicio, periodo_fin, cantidad_registros
+                FROM cargas_datos
+                WHERE id = ANY(%s)
+                ORDER BY id
+                FOR UPDATE
+            ''', (carga_ids,))
+            cargas = [dict(row) for row in cur.fetchall()]
+            
+            errores = []
+            encontradas = {c['id'] for c in cargas}
+            for faltante in sorted(set(carga_ids) - encontradas):
+                errores.append({'carga_id': faltante, 'error': 'Carga no encontrada'})
+            for carga in cargas:
+                if carga['estado'] == 'aprobado':
+                    errores.append({'carga_id': carga['id'], 'error': 'La carga ya fue aprobada'})
+                elif carga['estado'] == 'rechazado':
+                    errores.append({'carga_id': carga['id'], 'error': 'La carga fue rechazada'})
+            
+            if errores:
+                conn.rollback()
+                return {'success': False, 'errores': errores}
+            
+            # Los solapamientos de periodo los rechaza la restricción excl_periodo_aprobado
+            # (también frente a aprobaciones concurrentes); no hay verificación previa
+            cur.execute('SAVEPOINT aprobar_cargas')
+            try:
+                registros_movidos = self._mover_cargas_aprobadas(cur, carga_ids, usuario, notas)
+            except errors.ExclusionViolation:
+                cur.execute('ROLLBACK TO SAVEPOINT aprobar_cargas')
+                conflictos = self._conflictos_periodo(cur, carga_ids)
+                conn.rollback()
+                return {'success': False, 'errores': conflictos}
+            
+            self._incrementar_version_datos(cur, [c['reporte_codigo'] for c in cargas])
+            conn.commit()
+            
+            por_reporte = {}
+            for carga in cargas:
+                por_reporte.setdefault(carga['reporte_codigo'], []).append(carga['id'])
+            
+            logger.info(f"Aprobadas {len(carga_ids)} cargas ({registros_movidos} registros) por {usuario}")
+            return {
+                'success': True,
+                'aprobadas': carga_ids,
+                'registros_movidos': registros_movidos,
+                'por_reporte': por_reporte
+            }
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error aprobando cargas: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def _mover_cargas_aprobadas(self, cur, carga_ids: List[int], usuario: str, notas: str) -> int:
+        """INSERT ... SELECT del staging, actualización de estado/contadores y borrado del staging"""
+        # Mover datos de temporal a definitivo
+        cur.execute('''
+            INSERT INTO datos_reportes (reporte_codigo, datos, carga_id, fecha_periodo, periodo_inicio, periodo_fin, uploaded_by)
+            SELECT reporte_codigo, datos, carga_id, fecha_extraida, periodo_inicio, periodo_fin, %s
+            FROM datos_temporales
+            WHERE carga_id = ANY(%s)
+        ''', (usuario, carga_ids))
+        registros_movidos = cur.rowcount
+        
+        # Contadores: lo pendiente pasa a aprobado (antes de borrar el staging)
+        cur.execute('''
+            UPDATE cargas_datos c
+            SET estado = 'aprobado', 
+                fecha_aprobacion = CURRENT_TIMESTAMP, 
+                aprobado_por = %s,
+                notas = %s,
+                registros_aprobados = c.registros_aprobados
+                    + (SELECT COUNT(*) FROM datos_temporales t WHERE t.carga_id = c.id),
+                registros_pendientes = 0
+            WHERE c.id = ANY(%s)
+        ''', (usuario, notas, carga_ids))
+        
+        # Borrar datos temporales (ya están en definitiva)
+        cur.execute('DELETE FROM datos_temporales WHERE carga_id = ANY(%s)', (carga_ids,))
+        
+        return registros_movidos
+    
+    def _conflictos_periodo(self, cur, carga_ids: List[int]) -> List[Dict]:
+        """Describir qué cargas se solapan (probe && sobre el índice GiST) tras una violación de exclusión"""
+        cur.execute('''
+            SELECT c.id, e.id AS conflicto_id, e.estado, e.periodo_inicio, e.periodo_fin
+            FROM cargas_datos c
+            JOIN cargas_datos e 
+              ON e.reporte_codigo = c.reporte_codigo
+             AND e.periodo && c.periodo
+             AND e.id <> c.id
+            WHERE c.id = ANY(%s)
+            AND (e.estado IN ('aprobado', 'validado') OR e.id = ANY(%s))
+            ORDER BY c.id, e.id
+        ''', (carga_ids, carga_ids))
+        conflictos = []
+        for row in cur.fetchall():
+            origen = 'del mismo lote' if row['conflicto_id'] in carga_ids else 'aprobada'
+            conflictos.append({
+                'carga_id': row['id'],
+                'error': f"Periodo solapado con la carga {origen} {row['conflicto_id']}",
+                'periodo_conflicto': f"{row['periodo_inicio']} a {row['periodo_fin']}"
+            })
+        return conflictos or [{'carga_id': None, 'error': 'Periodo solapado con otra carga aprobada'}]
+    
+    def rechazar_carga(self, carga_id: int, razon: str, usuario: str) -> Optional[Dict]:
+        """
+        Rechazar una carga y eliminar su staging en una sola transacción
+        Si la carga ya estaba aprobada (reemplazo de un periodo) también se retiran
+        sus registros definitivos, liberando el periodo para una nueva carga.
+        
+        Returns:
+            None si la carga no existe, o {reporte_codigo, estado_anterior, registros_eliminados}
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute(
+                'SELECT reporte_codigo, estado FROM cargas_datos WHERE id = %s FOR UPDATE',
+                (carga_id,)
+            )
+            row = cur.fetchone()
+            if not row:
+                return None
+            reporte_codigo, estado_anterior = row
+            
+            registros_eliminados = 0
+            if estado_anterior == 'aprobado':
+                cur.execute('DELETE FROM datos_reportes WHERE carga_id = %s', (carga_id,))
+                registros_eliminados = cur.rowcount
+            
+            cur.execute('''
+                UPDATE cargas_datos 
+                SET estado = 'rechazado', 
+                    errores_validacion = %s,
+                    aprobado_por = %s,
+                    registros_pendientes = 0,
+                    registros_aprobados = 0
+                WHERE id = %s
+            ''', (razon, usuario, carga_id))
+            
+            cur.execute('DELETE FROM datos_temporales WHERE carga_id = %s', (carga_id,))
+            if registros_eliminados:
+                self._incrementar_version_datos(cur, [reporte_codigo])
+            conn.commit()
+            return {
+                'reporte_codigo': reporte_codigo,
+                'estado_anterior': estado_anterior,
+                'registros_eliminados': registros_eliminados
+            }
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error rechazando carga: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def purgar_datos_reporte(self, reporte_codigo: str, fecha_hasta=None, tamano_lote: int = 5000) -> List[int]:
+        """
+        Eliminar registros definitivos de un reporte (todos o los cargados hasta fecha_hasta)
+        Devuelve los ids eliminados para retirar sus vectores del índice
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            query = 'DELETE FROM datos_reportes WHERE reporte_codigo = %s'
+            params = [reporte_codigo]
+            if fecha_hasta:
+                query += ' AND created_at < %s'
+                params.append(fecha_hasta)
+            cur.execute(query + ' RETURNING id', params)
+            
+            ids = []
+            while True:
+                filas = cur.fetchmany(tamano_lote)
+                if not filas:
+                    break
+                ids.extend(fila[0] for fila in filas)
+            
+            # Los contadores de las cargas afectadas se recalculan sobre lo que quedó
+            cur.execute('''
+                UPDATE cargas_datos c
+                SET registros_aprobados = (SELECT COUNT(*) FROM datos_reportes d WHERE d.carga_id = c.id)
+                WHERE c.reporte_codigo = %s AND c.estado = 'aprobado'
+            ''', (reporte_codigo,))
+            if ids:
+                self._incrementar_version_datos(cur, [reporte_codigo])
+            conn.commit()
+            return ids
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error purgando datos de {reporte_codigo}: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def ids_datos_existentes(self, reporte_codigo: str, ids: List[int]) -> set:
+        """Subconjunto de ids que siguen existiendo en datos_reportes (reconciliación del índice)"""
+        if not ids:
+            return set()
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute(
+                'SELECT id FROM datos_reportes WHERE reporte_codigo = %s AND id = ANY(%s)',
+                (reporte_codigo, list(ids))
+            )
+            return {row[0] for row in cur.fetchall()}
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    # ============================================
+    # DEDUPLICACIÓN Y CARGAS REANUDABLES
+    # ============================================
+    
+    def buscar_archivo_cargado(self, reporte_codigo: str, sha256: str) -> Optional[Dict]:
+        """
+        Buscar un archivo ya ingerido en el reporte por su SHA-256
+        Los archivos cuya carga fue rechazada no cuentan como duplicados
+        """
+        conn = self.get_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            cur.execute('''
+                SELECT a.id, a.reporte_codigo, a.sha256, a.nombre_archivo, a.tamano_bytes,
+                       a.carga_id, a.registros_insertados, a.usuario, a.created_at, a.confirmado,
+                       c.estado AS estado_carga
+                FROM archivos_cargados a
+                LEFT JOIN cargas_datos c ON c.id = a.carga_id
+                WHERE a.reporte_codigo = %s AND a.sha256 = %s
+                AND c.estado IS DISTINCT FROM 'rechazado'
+            ''', (reporte_codigo, sha256))
+            
+            result = cur.fetchone()
+            return dict(result) if result else None
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    def reservar_archivo_cargado(self, reporte_codigo: str, sha256: str, nombre_archivo: str,
+                                 tamano_bytes: int, usuario: str = None,
+                                 vencimiento_min: int = 60) -> Optional[int]:
+        """
+        Reservar la huella de un archivo antes de procesarlo (INSERT ... ON CONFLICT)
+        La restricción única (reporte_codigo, sha256) garantiza que de dos subidas
+        simultáneas del mismo archivo solo una obtenga la reserva. Se reutiliza la fila
+        si su carga fue rechazada o si es una reserva abandonada (sin confirmar tras
+        vencimiento_min minutos). Devuelve el id de la reserva o None si ya existe.
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                INSERT INTO archivos_cargados 
+                (reporte_codigo, sha256, nombre_archivo, tamano_bytes, usuario, confirmado)
+                VALUES (%s, %s, %s, %s, %s, FALSE)
+                ON CONFLICT (reporte_codigo, sha256) DO UPDATE SET
+                    nombre_archivo = EXCLUDED.nombre_archivo,
+                    tamano_bytes = EXCLUDED.tamano_bytes,
+                    carga_id = NULL,
+                    registros_insertados = NULL,
+                    usuario = EXCLUDED.usuario,
+                    confirmado = FALSE,
+                    created_at = CURRENT_TIMESTAMP
+                WHERE archivos_cargados.carga_id IN (SELECT id FROM cargas_datos WHERE estado = 'rechazado')
+                   OR (NOT archivos_cargados.confirmado
+                       AND archivos_cargados.created_at < CURRENT_TIMESTAMP - make_interval(mins => %s))
+                RETURNING id
+            ''', (reporte_codigo, sha256, nombre_archivo, tamano_bytes, usuario, vencimiento_min))
+            fila = cur.fetchone()
+            conn.commit()
+            return fila[0] if fila else None
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error reservando archivo cargado: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def confirmar_archivo_cargado(self, archivo_id: int, carga_id: int = None,
+                                  registros_insertados: int = None):
+        """Confirmar la reserva de un archivo ingerido con su carga o registros"""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                UPDATE archivos_cargados 
+                SET carga_id = %s, registros_insertados = %s, confirmado = TRUE
+                WHERE id = %s
+            ''', (carga_id, registros_insertados, archivo_id))
+            conn.commit()
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error confirmando archivo cargado: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def liberar_archivo_cargado(self, archivo_id: int):
+        """Eliminar una reserva no confirmada (el procesamiento falló y el archivo puede reintentarse)"""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                DELETE FROM archivos_cargados WHERE id = %s AND NOT confirmado
+            ''', (archivo_id,))
+            conn.commit()
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error liberando archivo cargado: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def crear_sesion_carga(self, sesion_id: str, reporte_codigo: str, destino: str, nombre_archivo: str,
+                           tamano_total: int, sha256_esperado: str = None, usuario: str = None) -> Dict:
+        """Crear una sesión de carga por partes"""
+        conn = self.get_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            cur.execute('''
+                INSERT INTO sesiones_carga 
+                (id, reporte_codigo, destino, nombre_archivo, tamano_total, sha256_esperado, usuario)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                RETURNING *
+            ''', (sesion_id, reporte_codigo, destino, nombre_archivo, tamano_total, sha256_esperado, usuario))
+            sesion = dict(cur.fetchone())
+            conn.commit()
+            return sesion
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error creando sesión de carga: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def obtener_sesion_carga(self, sesion_id: str) -> Optional[Dict]:
+        """Obtener una sesión de carga por partes"""
+        conn = self.get_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            cur.execute('SELECT * FROM sesiones_carga WHERE id = %s', (sesion_id,))
+            result = cur.fetchone()
+            return dict(result) if result else None
+            
+        finally:
+            cur.close()
+            conn.close()
+    
+    def avanzar_sesion_carga(self, sesion_id: str, offset_esperado: int, nuevo_offset: int) -> bool:
+        """
+        Avanzar bytes_recibidos solo si nadie más lo cambió (compare-and-set)
+        Devuelve False si el offset no coincidía
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                UPDATE sesiones_carga 
+                SET bytes_recibidos = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND bytes_recibidos = %s AND estado = 'abierta'
+            ''', (nuevo_offset, sesion_id, offset_esperado))
+            actualizado = cur.rowcount == 1
+            conn.commit()
+            return actualizado
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error avanzando sesión de carga: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def expirar_sesiones_carga(self, horas: float) -> List[str]:
+        """
+        Marcar como expiradas las sesiones abiertas sin actividad en las últimas horas
+        (usa idx_sesiones_carga_estado); devuelve sus ids para borrar las partes en disco
+        """
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                UPDATE sesiones_carga 
+                SET estado = 'expirada', updated_at = CURRENT_TIMESTAMP
+                WHERE estado = 'abierta'
+                AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                RETURNING id
+            ''', (float(horas) * 3600,))
+            ids = [fila[0] for fila in cur.fetchall()]
+            conn.commit()
+            return ids
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error expirando sesiones de carga: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
+    def cerrar_sesion_carga(self, sesion_id: str, estado: str, resultado: Dict = None):
+        """Marcar una sesión como completada/duplicada guardando el resultado devuelto"""
+        conn = self.get_connection()
+        cur = conn.cursor()
+        
+        try:
+            cur.execute('''
+                UPDATE sesiones_carga 
+                SET estado = %s, resultado = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (estado, json.dumps(resultado, default=str) if resultado else None, sesion_id))
+            conn.commit()
+            
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error cerrando sesión de carga: {e}")
+            raise
+        finally:
+            cur.close()
+            conn.close()
+    
     def ejecutar_query(self, query: str, params: tuple = None, commit: bool = False):
         """
         Ejecutar query SQL personalizada
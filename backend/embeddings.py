@@ -0,0 +1,205 @@
+"""
+Proveedores de embeddings para las colecciones de ChromaDB
+- onnx: all-MiniLM-L6-v2 en CPU (el mismo modelo que usa ChromaDB por defecto) con
+  tamaño de lote e hilos intra-op configurables
+- hash: vectores deterministas por hashing de tokens, sin modelo (pruebas y entornos sin red)
+Cualquiera de los dos puede envolverse en EmbeddingsConCache, que guarda en SQLite los
+vectores ya calculados por hash del texto.
+
+Ambos producen vectores de 384 dimensiones: ChromaDB no distingue una colección de
+otra por el modelo, por eso cada proveedor expone `nombre` y el agente lo guarda en la
+metadata de la colección para detectar índices armados con otro proveedor.
+"""
+import os
+import re
+import math
+import array
+import sqlite3
+import hashlib
+import logging
+import threading
+from functools import cached_property
+from typing import List
+
+from chromadb.api.types import EmbeddingFunction
+
+logger = logging.getLogger(__name__)
+
+# Nombre del proveedor ONNX; también el de las colecciones creadas antes de guardar el
+# proveedor en la metadata (usaban la función por defecto de ChromaDB, el mismo modelo)
+NOMBRE_ONNX = 'onnx-all-MiniLM-L6-v2'
+
+
+def hash_texto(texto: str) -> str:
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+class EmbeddingsHash(EmbeddingFunction):
+    """Embeddings deterministas por hashing de palabras y bigramas (sin modelo ni red)"""
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self.nombre = f"hash-{dimension}"
+
+    def _vector(self, texto: str) -> List[float]:
+        tokens = re.findall(r'\w+', texto.lower())
+        vector = [0.0] * self.dimension
+        for token in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+            indice = int.from_bytes(digest[:4], 'little') % self.dimension
+            vector[indice] += 1.0 if digest[4] & 1 else -1.0
+        norma = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norma for v in vector]
+
+    def __call__(self, input):
+        return [self._vector(texto) for texto in input]
+
+
+def _onnx_minilm():
+    """
+    Clase ONNXMiniLM_L6_V2 de ChromaDB extendida con lote e hilos configurables
+    Usa atributos internos de esa clase (ort, DOWNLOAD_PATH, _forward...): la versión
+    de chromadb está acotada en requirements.txt por este motivo
+    """
+    from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+    class EmbeddingsOnnx(ONNXMiniLM_L6_V2):
+        def __init__(self, batch_size: int = 32, hilos: int = 0, preferred_providers=None):
+            super().__init__(preferred_providers=preferred_providers)
+            self.batch_size = batch_size
+            self.hilos = hilos
+            self.nombre = NOMBRE_ONNX
+
+        @cached_property
+        def model(self):
+            # Mismo armado de la sesión que ONNXMiniLM_L6_V2, fijando intra_op_num_threads
+            so = self.ort.SessionOptions()
+            so.log_severity_level = 3
+            so.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.hilos:
+                so.intra_op_num_threads = self.hilos
+            return self.ort.InferenceSession(
+                os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, 'model.onnx'),
+                providers=self._preferred_providers or ['CPUExecutionProvider'],
+                sess_options=so
+            )
+
+        def __call__(self, input):
+            self._download_model_if_not_exists()
+            return [list(map(float, v)) for v in self._forward(list(input), batch_size=self.batch_size)]
+
+    return EmbeddingsOnnx
+
+
+class EmbeddingsConCache(EmbeddingFunction):
+    """
+    Envuelve un proveedor y reutiliza vectores ya calculados
+    Clave: (modelo, SHA-256 del texto). Persistente en SQLite para sobrevivir reinicios.
+    """
+
+    def __init__(self, proveedor, ruta: str):
+        self.proveedor = proveedor
+        self.modelo = getattr(proveedor, 'nombre', type(proveedor).__name__)
+        self.nombre = self.modelo  # la cache no cambia los vectores: mismo nombre que el proveedor
+        self.ruta = ruta
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        conn = self._conectar()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    modelo TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (modelo, hash)
+                )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _conectar(self):
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def __call__(self, input):
+        textos = list(input)
+        hashes = [hash_texto(t) for t in textos]
+        encontrados = {}
+
+        conn = self._conectar()
+        try:
+            unicos = list(set(hashes))
+            for i in range(0, len(unicos), 500):
+                lote = unicos[i:i+500]
+                filas = conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE modelo = ? AND hash IN ({','.join('?' * len(lote))})",
+                    [self.modelo, *lote]
+                )
+                for h, blob in filas:
+                    encontrados[h] = array.array('f', blob).tolist()
+
+            # Calcular solo los textos que no estaban (una vez por texto distinto)
+            faltantes = {}
+            for texto, h in zip(textos, hashes):
+                if h not in encontrados:
+                    faltantes.setdefault(h, texto)
+            if faltantes:
+                vectores = self.proveedor(list(faltantes.values()))
+                nuevos = dict(zip(faltantes.keys(), (list(map(float, v)) for v in vectores)))
+                with self._lock:
+                    conn.executemany(
+                        'INSERT OR IGNORE INTO embeddings (modelo, hash, vector) VALUES (?, ?, ?)',
+                        [(self.modelo, h, array.array('f', v).tobytes()) for h, v in nuevos.items()]
+                    )
+                    conn.commit()
+                encontrados.update(nuevos)
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.fallos += len(faltantes)
+            self.aciertos += len(textos) - len(faltantes)
+        return [encontrados[h] for h in hashes]
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            aciertos, fallos = self.aciertos, self.fallos
+        total = aciertos + fallos
+        return {
+            'modelo': self.modelo,
+            'aciertos': aciertos,
+            'calculados': fallos,
+            'tasa_aciertos': round(aciertos / total, 4) if total else None
+        }
+
+
+def crear_proveedor_embeddings():
+    """
+    Proveedor según variables de entorno:
+    EMBEDDINGS_PROVEEDOR (onnx | hash), EMBEDDINGS_BATCH, EMBEDDINGS_HILOS,
+    EMBEDDINGS_CACHE (1/0) y EMBEDDINGS_CACHE_PATH
+    """
+    tipo = os.getenv('EMBEDDINGS_PROVEEDOR', 'onnx').lower()
+    if tipo == 'hash':
+        proveedor = EmbeddingsHash(int(os.getenv('EMBEDDINGS_DIMENSION', 384)))
+    elif tipo == 'onnx':
+        proveedor = _onnx_minilm()(
+            batch_size=int(os.getenv('EMBEDDINGS_BATCH', 32)),
+            hilos=int(os.getenv('EMBEDDINGS_HILOS', 0))
+        )
+    else:
+        raise ValueError(f"EMBEDDINGS_PROVEEDOR desconocido: {tipo}")
+
+    if os.getenv('EMBEDDINGS_CACHE', '1') in ('1', 'true', 'si'):
+        ruta = os.getenv(
+            'EMBEDDINGS_CACHE_PATH',
+            os.path.join(os.path.dirname(__file__), 'data', 'embeddings_cache.sqlite')
+        )
+        proveedor = EmbeddingsConCache(proveedor, ruta)
+
+    logger.info(f"Embeddings: {tipo} (cache {'activo' if isinstance(proveedor, EmbeddingsConCache) else 'inactivo'})")
+    return proveedor
@@ -0,0 +1,246 @@
+"""
+Cola de indexación en segundo plano
+Los trabajos de indexación en ChromaDB (reporte completo o cargas aprobadas) se
+procesan fuera de la petición HTTP. Los disparos de un mismo reporte dentro de la
+ventana de espera (debounce) se agrupan en una sola ejecución y nunca corren dos
+indexaciones del mismo reporte a la vez; entre reportes distintos la concurrencia
+está acotada por un pool de hilos. La espera se reinicia con cada disparo pero
+nunca supera max_espera_seg desde el primero, así un reporte con disparos
+continuos (webhook constante) se indexa igual de forma periódica.
+
+Los resúmenes por periodo agregan el reporte completo, así que no se regeneran en
+cada indexación: cada ejecución exitosa programa una regeneración que corre como
+mucho una vez cada intervalo_resumenes_seg por reporte, agrupando las ejecuciones
+incrementales intermedias.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class ColaIndexacion:
+    """Planificador de indexación con agrupamiento por reporte y concurrencia acotada"""
+
+    def __init__(self, agente, debounce_seg: float = 5.0, concurrencia: int = 2,
+                 max_espera_seg: float = 60.0, intervalo_resumenes_seg: float = 300.0):
+        self.agente = agente
+        self.debounce_seg = debounce_seg
+        self.max_espera_seg = max(debounce_seg, max_espera_seg)
+        self.intervalo_resumenes_seg = intervalo_resumenes_seg
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrencia), thread_name_prefix='indexador')
+        self._cond = threading.Condition()
+        self._hilo = None
+        # {codigo_reporte: {'vence', 'limite', 'reporte', 'cargas', 'disparos', 'primer_disparo'}} aún no iniciados
+        self._pendientes = {}
+        self._en_curso = {}  # {codigo_reporte: {'inicio', 'reporte', 'cargas', 'disparos'}}
+        self.ultimos_resultados = {}  # {codigo_reporte: {...}}; todos protegidos por _cond
+        self._resumenes = {}  # {codigo_reporte: {'vence', 'disparos'}} regeneraciones programadas
+        self._ultimo_resumen = {}  # {codigo_reporte: monotonic del último inicio}
+        self.ultimos_resumenes = {}  # {codigo_reporte: {...}}
+
+    def encolar(self, codigo_reporte: str, carga_ids=None) -> bool:
+        """
+        Programar indexación de una o varias cargas (carga_ids) o del reporte (None, incremental)
+        Si ya había un trabajo pendiente del reporte se agrupa con él y se reinicia la
+        ventana de espera; devuelve False en ese caso
+        """
+        if isinstance(carga_ids, int):
+            carga_ids = [carga_ids]
+        with self._cond:
+            ahora = time.monotonic()
+            trabajo = self._pendientes.get(codigo_reporte)
+            nuevo = trabajo is None
+            if nuevo:
+                trabajo = {'reporte': False, 'cargas': set(), 'disparos': 0,
+                           'primer_disparo': datetime.now().isoformat(),
+                           'limite': ahora + self.max_espera_seg}
+                self._pendientes[codigo_reporte] = trabajo
+            if carga_ids:
+                trabajo['cargas'].update(carga_ids)
+            else:
+                trabajo['reporte'] = True
+            trabajo['disparos'] += 1
+            # Reiniciar la espera con cada disparo, sin pasar del límite desde el primero
+            trabajo['vence'] = min(ahora + self.debounce_seg, trabajo['limite'])
+
+            self._despertar()
+
+        logger.info(
+            f"Indexación {'programada' if nuevo else 'agrupada'}: {codigo_reporte} "
+            f"(cargas {list(carga_ids) if carga_ids else 'todas'})"
+        )
+        return nuevo
+
+    def programar_resumenes(self, codigo_reporte: str):
+        """
+        Programar la regeneración de resúmenes del reporte: si ya hay una pendiente se
+        agrupa con ella; si no, vence tras la espera normal pero nunca antes de
+        intervalo_resumenes_seg desde la anterior
+        """
+        with self._cond:
+            programado = self._resumenes.get(codigo_reporte)
+            if programado is None:
+                anterior = self._ultimo_resumen.get(codigo_reporte)
+                vence = time.monotonic() + self.debounce_seg
+                if anterior is not None:
+                    vence = max(vence, anterior + self.intervalo_resumenes_seg)
+                programado = self._resumenes[codigo_reporte] = {'vence': vence, 'disparos': 0}
+            programado['disparos'] += 1
+            self._despertar()
+
+    def _despertar(self):
+        """Arrancar el planificador si hace falta y avisarle de un cambio (llamar con _cond tomado)"""
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._planificar, name='indexador-planificador', daemon=True)
+            self._hilo.start()
+        self._cond.notify()
+
+    def pendientes(self) -> int:
+        with self._cond:
+            return len(self._pendientes)
+
+    def estado(self, codigo_reporte: str) -> dict:
+        """Estado de indexación de un reporte: pendiente, en_progreso, completado, error o sin_actividad"""
+        with self._cond:
+            return self._estado(codigo_reporte)
+
+    def _estado(self, codigo_reporte: str) -> dict:
+        """Armar el estado de un reporte (llamar con _cond tomado)"""
+        pendiente = self._pendientes.get(codigo_reporte)
+        en_curso = self._en_curso.get(codigo_reporte)
+        ultimo = self.ultimos_resultados.get(codigo_reporte)
+
+        if en_curso:
+            estado = 'en_progreso'
+        elif pendiente:
+            estado = 'pendiente'
+        elif ultimo:
+            estado = 'error' if 'error' in ultimo else 'completado'
+        else:
+            estado = 'sin_actividad'
+
+        respuesta = {'reporte': codigo_reporte, 'estado': estado, 'ultimo': ultimo}
+        resumenes = self._resumenes.get(codigo_reporte)
+        if resumenes or codigo_reporte in self.ultimos_resumenes:
+            respuesta['resumenes'] = {
+                'ultimo': self.ultimos_resumenes.get(codigo_reporte),
+                'inicia_en_seg': round(max(0.0, resumenes['vence'] - time.monotonic()), 1) if resumenes else None
+            }
+        if en_curso:
+            respuesta['en_curso'] = self._describir(en_curso)
+        if pendiente:
+            respuesta['pendiente'] = {
+                **self._describir(pendiente),
+                'inicia_en_seg': round(max(0.0, pendiente['vence'] - time.monotonic()), 1)
+            }
+        return respuesta
+
+    def estado_general(self) -> dict:
+        """Resumen de todos los reportes con actividad de indexación"""
+        with self._cond:
+            codigos = (set(self._pendientes) | set(self._en_curso) | set(self.ultimos_resultados)
+                       | set(self._resumenes))
+            return {
+                'pendientes': len(self._pendientes),
+                'resumenes_programados': len(self._resumenes),
+                'en_progreso': len(self._en_curso),
+                'reportes': [self._estado(codigo) for codigo in sorted(codigos)]
+            }
+
+    @staticmethod
+    def _describir(trabajo: dict) -> dict:
+        if trabajo.get('resumenes'):
+            return {'tipo': 'resumenes', 'carga_ids': None, 'disparos_agrupados': trabajo['disparos']}
+        return {
+            'tipo': 'reporte' if trabajo['reporte'] else 'cargas',
+            'carga_ids': sorted(trabajo['cargas']) or None,
+            'disparos_agrupados': trabajo['disparos']
+        }
+
+    def _planificar(self):
+        """Despachar al pool los trabajos cuya ventana venció y cuyo reporte no se está indexando"""
+        while True:
+            with self._cond:
+                ahora = time.monotonic()
+                # Resúmenes vencidos primero: con disparos continuos siempre hay una indexación
+                # pendiente del reporte y, si esperaran a que no la haya, no correrían nunca
+                for codigo in [
+                    codigo for codigo, programado in self._resumenes.items()
+                    if programado['vence'] <= ahora and codigo not in self._en_curso
+                ]:
+                    trabajo = {**self._resumenes.pop(codigo), 'resumenes': True,
+                               'inicio': datetime.now().isoformat()}
+                    self._ultimo_resumen[codigo] = ahora
+                    self._en_curso[codigo] = trabajo
+                    self._pool.submit(self._ejecutar_resumenes, codigo, trabajo)
+
+                listos = [
+                    codigo for codigo, trabajo in self._pendientes.items()
+                    if trabajo['vence'] <= ahora and codigo not in self._en_curso
+                ]
+                for codigo in listos:
+                    trabajo = self._pendientes.pop(codigo)
+                    trabajo['inicio'] = datetime.now().isoformat()
+                    self._en_curso[codigo] = trabajo
+                    self._pool.submit(self._ejecutar, codigo, trabajo)
+
+                # Dormir hasta el próximo vencimiento (o hasta un nuevo disparo / fin de trabajo)
+                esperando = [
+                    trabajo['vence'] for codigo, trabajo in self._pendientes.items()
+                    if codigo not in self._en_curso
+                ] + [
+                    programado['vence'] for codigo, programado in self._resumenes.items()
+                    if codigo not in self._en_curso
+                ]
+                self._cond.wait(timeout=max(0.05, min(esperando) - ahora) if esperando else None)
+
+    def _ejecutar(self, codigo_reporte: str, trabajo: dict):
+        carga_ids = sorted(trabajo['cargas'])
+        try:
+            # La indexación incremental por marca ya incluye las filas de cargas aprobadas
+            # Los resúmenes se regeneran aparte, con su propia frecuencia
+            if trabajo['reporte']:
+                resultado = self.agente.indexar_datos_reporte(codigo_reporte, resumenes=False)
+            else:
+                resultado = self.agente.indexar_carga(codigo_reporte, carga_ids, resumenes=False)
+            ultimo = {'resultado': resultado}
+            self.programar_resumenes(codigo_reporte)
+        except Exception as e:
+            logger.error(f"Error en indexación de {codigo_reporte} (cargas {carga_ids or 'todas'}): {e}")
+            ultimo = {'error': str(e)}
+        try:
+            with self._cond:
+                self.ultimos_resultados[codigo_reporte] = {
+                    **self._describir(trabajo),
+                    **ultimo,
+                    'inicio': trabajo['inicio'],
+                    'fecha': datetime.now().isoformat()
+                }
+        finally:
+            # Liberar el reporte: disparos llegados durante la ejecución ya esperan en _pendientes
+            with self._cond:
+                self._en_curso.pop(codigo_reporte, None)
+                self._cond.notify()
+
+    def _ejecutar_resumenes(self, codigo_reporte: str, trabajo: dict):
+        try:
+            ultimo = {'resultado': self.agente.indexar_resumenes(codigo_reporte)}
+        except Exception as e:
+            logger.error(f"Error regenerando resúmenes de {codigo_reporte}: {e}")
+            ultimo = {'error': str(e)}
+        try:
+            with self._cond:
+                self.ultimos_resumenes[codigo_reporte] = {
+                    **ultimo,
+                    'disparos_agrupados': trabajo['disparos'],
+                    'inicio': trabajo['inicio'],
+                    'fecha': datetime.now().isoformat()
+                }
+        finally:
+            with self._cond:
+                self._en_curso.pop(codigo_reporte, None)
+                self._cond.notify()
@@ -0,0 +1,473 @@
+"""
+Utilidades de ingesta de datos
+Lectura incremental de payloads NDJSON, agrupación en lotes para inserción masiva,
+cálculo vectorizado de periodos y coerción de tipos por campo
+"""
+import gzip
+import hashlib
+import json
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def iterar_ndjson(stream, comprimido: bool = False,
+                  max_linea: Optional[int] = None) -> Iterator[Tuple[int, object, str]]:
+    """
+    Leer un stream NDJSON línea a línea sin cargarlo completo en memoria
+
+    Args:
+        stream: Objeto tipo archivo binario (ej: request.stream)
+        comprimido: True si el cuerpo viene comprimido con gzip
+        max_linea: Bytes máximos por línea; las más largas se descartan sin
+            cargarlas en memoria y se reportan como error
+
+    Returns:
+        Iterador de tuplas (numero_linea, registro, error). Si la línea no es
+        un objeto JSON válido, registro es None y error describe el problema.
+    """
+    fuente = gzip.GzipFile(fileobj=stream, mode='rb') if comprimido else stream
+    numero_linea = 0
+
+    while True:
+        linea = fuente.readline(max_linea + 1) if max_linea else fuente.readline()
+        if not linea:
+            break
+        numero_linea += 1
+
+        if max_linea and len(linea) > max_linea:
+            # Consumir el resto de la línea por bloques acotados
+            while linea and not linea.endswith(b'\n'):
+                linea = fuente.readline(max_linea + 1)
+            yield numero_linea, None, f"Línea {numero_linea}: excede {max_linea} bytes"
+            continue
+
+        linea = linea.strip()
+        if not linea:
+            continue
+
+        try:
+            registro = json.loads(linea)
+        except (ValueError, UnicodeDecodeError) as e:
+            yield numero_linea, None, f"Línea {numero_linea}: JSON inválido ({e})"
+            continue
+
+        if not isinstance(registro, dict):
+            yield numero_linea, None, f"Línea {numero_linea}: se esperaba un objeto JSON"
+            continue
+
+        yield numero_linea, registro, None
+
+
+def en_lotes(iterable: Iterable, tamano: int) -> Iterator[List]:
+    """Agrupar un iterable en listas de tamaño fijo (la última puede ser menor)"""
+    lote = []
+    for elemento in iterable:
+        lote.append(elemento)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def calcular_sha256(fuente, tamano_bloque: int = 1024 * 1024) -> str:
+    """
+    SHA-256 de un archivo leyendo por bloques (ruta o stream binario)
+    Si es un stream se deja el puntero al inicio para poder parsearlo después
+    """
+    digest = hashlib.sha256()
+    if isinstance(fuente, str):
+        with open(fuente, 'rb') as archivo:
+            for bloque in iter(lambda: archivo.read(tamano_bloque), b''):
+                digest.update(bloque)
+    else:
+        fuente.seek(0)
+        for bloque in iter(lambda: fuente.read(tamano_bloque), b''):
+            digest.update(bloque)
+        fuente.seek(0)
+    return digest.hexdigest()
+
+
+def calcular_periodos(valores, tipo_periodo: Optional[str]) -> Tuple[pd.Series, pd.Series, pd.Series]:
+    """
+    Calcular fecha y periodo de cada registro de forma vectorizada
+    Equivalente a calcular_periodo() / trg_actualizar_periodo_temporal en SQL:
+    con tipo 'libre' (o sin tipo) no se asigna periodo.
+
+    Args:
+        valores: Secuencia con el valor del campo fecha de cada registro
+        tipo_periodo: diario, semanal, quincenal, mensual, trimestral, anual o libre
+
+    Returns:
+        Tupla (fecha_extraida, periodo_inicio, periodo_fin) como Series datetime64 (NaT si no aplica)
+    """
+    serie = pd.Series(valores, dtype=object)
+    try:
+        fechas = pd.to_datetime(serie, errors='coerce', format='mixed')
+    except ValueError:
+        # Mezcla de fechas con y sin zona horaria
+        fechas = pd.to_datetime(serie, errors='coerce', format='mixed', utc=True)
+    if getattr(fechas.dt, 'tz', None) is not None:
+        fechas = fechas.dt.tz_localize(None)
+    fechas = fechas.dt.normalize()
+
+    if not tipo_periodo or tipo_periodo == 'libre':
+        vacio = pd.Series(pd.NaT, index=fechas.index, dtype='datetime64[ns]')
+        return vacio, vacio, vacio
+
+    if tipo_periodo == 'diario':
+        inicio, fin = fechas, fechas
+    elif tipo_periodo == 'semanal':
+        # DATE_TRUNC('week') en PostgreSQL: semana ISO que inicia el lunes
+        inicio = fechas - pd.to_timedelta(fechas.dt.weekday, unit='D')
+        fin = inicio + pd.Timedelta(days=6)
+    elif tipo_periodo == 'quincenal':
+        inicio_mes = fechas.dt.to_period('M').dt.start_time
+        fin_mes = fechas.dt.to_period('M').dt.end_time.dt.normalize()
+        primera = fechas.dt.day <= 15
+        inicio = inicio_mes.where(primera, inicio_mes + pd.Timedelta(days=15))
+        fin = (inicio_mes + pd.Timedelta(days=14)).where(primera, fin_mes)
+    elif tipo_periodo in ('mensual', 'trimestral', 'anual'):
+        frecuencia = {'mensual': 'M', 'trimestral': 'Q', 'anual': 'Y'}[tipo_periodo]
+        periodos = fechas.dt.to_period(frecuencia)
+        inicio = periodos.dt.start_time
+        fin = periodos.dt.end_time.dt.normalize()
+    else:
+        # Igual que el ELSE de calcular_periodo(): periodo de un día
+        inicio, fin = fechas, fechas
+
+    # Filas sin fecha válida quedan sin periodo
+    inicio = inicio.where(fechas.notna())
+    fin = fin.where(fechas.notna())
+    return fechas, inicio, fin
+
+
+# Alias de tipo_dato (los campos pueden venir con 'tipo' o 'tipo_dato', en español o inglés)
+ALIAS_TIPOS = {
+    'numero': 'numero', 'número': 'numero', 'number': 'numero', 'entero': 'numero', 'integer': 'numero', 'int': 'numero',
+    'decimal': 'decimal', 'float': 'decimal', 'moneda': 'decimal', 'currency': 'decimal',
+    'fecha': 'fecha', 'date': 'fecha', 'datetime': 'fecha',
+    'booleano': 'booleano', 'boolean': 'booleano', 'bool': 'booleano',
+}
+
+VALORES_VERDADEROS = {'true', '1', '1.0', 'si', 'sí', 's', 'yes', 'y', 'x', 'verdadero', 'v'}
+VALORES_FALSOS = {'false', '0', '0.0', 'no', 'n', 'falso', 'f'}
+
+
+def tipos_por_campo(campos) -> Dict[str, str]:
+    """
+    Obtener {nombre_campo: tipo} solo para los campos que requieren coerción
+    Acepta la lista de campos del reporte o su JSON serializado
+    """
+    if isinstance(campos, str):
+        try:
+            campos = json.loads(campos)
+        except ValueError:
+            return {}
+    tipos = {}
+    for campo in campos or []:
+        if not isinstance(campo, dict) or not campo.get('nombre'):
+            continue
+        tipo = str(campo.get('tipo_dato') or campo.get('tipo') or '').strip().lower()
+        if tipo in ALIAS_TIPOS:
+            tipos[campo['nombre']] = ALIAS_TIPOS[tipo]
+    return tipos
+
+
+# Un único separador seguido de exactamente tres dígitos es de miles ('$ 1.500', '1.234'):
+# así se escriben los montos en es-CO. Con parte entera 0 ('0.500') sigue siendo decimal.
+PATRON_MILES_UNICO = r'-?[1-9]\d{0,2}[.,]\d{3}'
+
+
+def _a_numero(serie: pd.Series) -> pd.Series:
+    """
+    Convertir a número admitiendo '1.234,56', '1,234.56', '$ 1.500', '$ 1.500,00' y
+    '(200)' como negativo
+    """
+    resultado = pd.to_numeric(serie, errors='coerce')
+    # to_numeric acepta '1.234' como 1.234: los textos con un solo separador de miles se reprocesan
+    es_texto = serie.map(lambda v: isinstance(v, str))
+    if es_texto.any():
+        resultado = resultado.mask(es_texto & serie.astype(str).str.strip().str.fullmatch(PATRON_MILES_UNICO))
+    pendientes = resultado.isna() & serie.notna()
+    if not pendientes.any():
+        return resultado
+
+    texto = serie[pendientes].astype(str).str.strip()
+    texto = texto.str.replace(r'^\((.*)\)$', r'-\1', regex=True)
+    texto = texto.str.replace(r'[\s $€£]|COP|USD|EUR', '', regex=True)
+
+    pos_coma = texto.str.rfind(',')
+    pos_punto = texto.str.rfind('.')
+    # El separador decimal es el último que aparece, y solo si aparece una vez y no es de miles
+    miles_unico = texto.str.fullmatch(PATRON_MILES_UNICO)
+    coma_decimal = (pos_coma > pos_punto) & (texto.str.count(',') == 1) & ~miles_unico
+    punto_decimal = (pos_punto > pos_coma) & (texto.str.count(r'\.') == 1) & ~miles_unico
+
+    # Cada variante se arma desde el texto original (no encadenar reemplazos)
+    normalizado = np.select(
+        [coma_decimal, punto_decimal],
+        [
+            texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False),
+            texto.str.replace(',', '', regex=False)
+        ],
+        texto.str.replace(r'[.,]', '', regex=True)
+    )
+
+    resultado.loc[pendientes] = pd.to_numeric(pd.Series(normalizado, index=texto.index), errors='coerce')
+    return resultado
+
+
+def _a_fecha(serie: pd.Series) -> pd.Series:
+    """Convertir a fecha canónica ('YYYY-MM-DD' o ISO con hora); números = serial de Excel"""
+    numeros = pd.to_numeric(serie, errors='coerce')
+    # Rango válido de seriales de Excel (evita tomar '20240115' como serial)
+    es_serial = numeros.between(1, 2958465) & ~serie.map(lambda v: isinstance(v, bool))
+
+    texto = serie.where(~es_serial)
+    # Copia explícita: la Series que devuelve .dt no admite asignaciones parciales
+    fechas = pd.to_datetime(texto, errors='coerce', format='ISO8601', utc=True).dt.tz_localize(None).copy()
+    pendientes = fechas.isna() & texto.notna()
+    if pendientes.any():
+        # Formatos locales (dd/mm/aaaa) para lo que no sea ISO
+        fechas.loc[pendientes] = pd.to_datetime(
+            texto[pendientes], errors='coerce', format='mixed', dayfirst=True, utc=True
+        ).dt.tz_localize(None)
+    if es_serial.any():
+        fechas.loc[es_serial] = pd.to_datetime(numeros[es_serial], unit='D', origin='1899-12-30', errors='coerce')
+
+    con_hora = fechas.notna() & (fechas != fechas.dt.normalize())
+    salida = fechas.dt.strftime('%Y-%m-%d')
+    salida = salida.where(~con_hora, fechas.dt.strftime('%Y-%m-%dT%H:%M:%S'))
+    return salida.where(fechas.notna(), None)
+
+
+def _a_booleano(serie: pd.Series) -> pd.Series:
+    """Convertir a True/False reconociendo si/no, x, 1/0, verdadero/falso"""
+    texto = serie.astype(str).str.strip().str.lower()
+    mapa = {**{v: True for v in VALORES_VERDADEROS}, **{v: False for v in VALORES_FALSOS}}
+    return texto.map(mapa).astype(object).where(serie.notna(), None)
+
+
+COERCIONES = {'numero': _a_numero, 'decimal': _a_numero, 'fecha': _a_fecha, 'booleano': _a_booleano}
+
+
+def coercionar_columnas(df: pd.DataFrame, campos) -> Tuple[pd.DataFrame, Dict[str, Dict]]:
+    """
+    Convertir cada columna una sola vez según el tipo_dato configurado del campo
+    (numero, decimal, fecha, booleano). Los valores que no se pueden convertir
+    quedan en null y se reportan por columna.
+
+    Args:
+        df: DataFrame con los registros a ingerir
+        campos: Lista de campos del reporte (o su JSON)
+
+    Returns:
+        Tupla (df_convertido, errores) donde errores es
+        {columna: {tipo, fallidos, ejemplos, filas}} solo para columnas con fallos
+    """
+    tipos = tipos_por_campo(campos)
+    if df.empty or not tipos:
+        return df, {}
+
+    df = df.copy()
+    errores = {}
+    for columna, tipo in tipos.items():
+        if columna not in df.columns:
+            continue
+        original = df[columna]
+        # Celdas vacías no cuentan como fallo
+        vacios = original.isna() | original.map(lambda v: isinstance(v, str) and not v.strip())
+        original = original.astype(object).where(~vacios, None)
+
+        convertido = COERCIONES[tipo](original)
+        if tipo == 'numero':
+            enteros = convertido.dropna()
+            if (enteros == enteros.round()).all():
+                convertido = convertido.round().astype('Int64')
+
+        fallidos = convertido.isna() & ~vacios
+        if fallidos.any():
+            errores[columna] = {
+                'tipo': tipo,
+                'fallidos': int(fallidos.sum()),
+                'ejemplos': [str(v) for v in original[fallidos].unique()[:5]],
+                'filas': [int(i) + 1 for i in fallidos[fallidos].index[:10]]
+            }
+            logger.warning(f"Coerción de '{columna}' a {tipo}: {int(fallidos.sum())} valores no convertibles")
+
+        df[columna] = convertido.astype(object).where(convertido.notna(), None)
+
+    return df, errores
+
+
+def coercionar_registros(registros: List[Dict], campos) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """Igual que coercionar_columnas pero sobre una lista de diccionarios (webhooks, carga manual)"""
+    if not registros or not tipos_por_campo(campos):
+        return registros, {}
+    df, errores = coercionar_columnas(pd.DataFrame(registros), campos)
+    return df.to_dict('records'), errores
+
+
+# ============================================
+# INFERENCIA DE ESQUEMA POR MUESTRA
+# ============================================
+
+PATRON_EMAIL = r'^[^@\s]+@[^@\s]+\.[^@\s]+$'
+PATRON_TELEFONO = r'^\+?[\d\s\-().]{7,20}$'
+# NIT con dígito de verificación ('900123456-1', '900.123.456-1'): identificador, no teléfono
+PATRON_NIT = r'^\d{1,3}(\.?\d{3}){2,3}-\d$'
+# Prefijo internacional o dígitos separados por espacios/guiones: teléfonos o
+# identificadores que _a_numero convertiría en un entero perdiendo el formato
+PATRON_NO_NUMERICO = r'^\+|\d[\s\-]+\d'
+PISTAS_FECHA = ('fecha', 'date', 'periodo', 'dia', 'día', 'mes')
+PISTAS_TELEFONO = ('tel', 'cel', 'movil', 'móvil', 'phone', 'whatsapp')
+
+
+def leer_muestra_excel(archivo, filas: int = 1000, modo: str = 'primeras',
+                       semilla: Optional[int] = None) -> Tuple[pd.DataFrame, int]:
+    """
+    Leer una muestra de la hoja de datos sin cargar el libro completo
+    Usa openpyxl en modo read_only (lectura en streaming fila a fila).
+
+    Args:
+        archivo: Ruta u objeto archivo .xlsx
+        filas: Tamaño de la muestra
+        modo: 'primeras' (primeras N filas) o 'reservorio' (muestreo uniforme de toda la hoja)
+        semilla: Semilla para el muestreo por reservorio (reproducible)
+
+    Returns:
+        Tupla (df_muestra, filas_recorridas)
+    """
+    import random
+    from openpyxl import load_workbook
+
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        normalizadas = [h.strip().lower() for h in libro.sheetnames]
+        hoja = libro.worksheets[normalizadas.index('datos')] if 'datos' in normalizadas else libro.worksheets[0]
+
+        filas_iter = hoja.iter_rows(values_only=True)
+        encabezado = next(filas_iter, None)
+        if not encabezado:
+            return pd.DataFrame(), 0
+        columnas = [str(c) if c is not None else f'columna_{i + 1}' for i, c in enumerate(encabezado)]
+
+        muestra = []
+        recorridas = 0
+        aleatorio = random.Random(semilla)
+        for fila in filas_iter:
+            if all(v is None for v in fila):
+                continue
+            recorridas += 1
+            if len(muestra) < filas:
+                muestra.append(fila)
+            elif modo == 'reservorio':
+                # Algoritmo R: cada fila vista tiene probabilidad filas/recorridas de quedar
+                j = aleatorio.randrange(recorridas)
+                if j < filas:
+                    muestra[j] = fila
+            else:
+                break
+
+        muestra = [tuple(fila[:len(columnas)]) + (None,) * (len(columnas) - len(fila)) for fila in muestra]
+        return pd.DataFrame(muestra, columns=columnas), recorridas
+    finally:
+        libro.close()
+
+
+def _puntajes_columna(serie: pd.Series, nombre: str) -> Dict[str, float]:
+    """Proporción de valores no vacíos que se pueden interpretar como cada tipo"""
+    total = len(serie)
+    if total == 0:
+        return {}
+
+    texto = serie.astype(str).str.strip()
+    numeros = _a_numero(serie)
+    es_numero = numeros.notna() & ~texto.str.contains(PATRON_NO_NUMERICO)
+    nombre = nombre.lower()
+
+    puntajes = {}
+    enteros = numeros[es_numero]
+    proporcion_numeros = es_numero.sum() / total
+    if len(enteros) and (enteros == enteros.round()).all():
+        puntajes['numero'] = proporcion_numeros
+    else:
+        puntajes['decimal'] = proporcion_numeros
+
+    # Los números sueltos no cuentan como fecha (salvo celdas fecha reales de Excel)
+    es_fecha_real = serie.map(lambda v: hasattr(v, 'year') and hasattr(v, 'month'))
+    no_numericos = serie[~es_numero | es_fecha_real]
+    puntajes['fecha'] = (_a_fecha(no_numericos).notna().sum() / total) if len(no_numericos) else 0.0
+
+    if serie.nunique() <= 2:
+        puntajes['booleano'] = _a_booleano(serie).notna().sum() / total
+
+    puntajes['email'] = texto.str.match(PATRON_EMAIL).sum() / total
+
+    telefonos = (texto.str.match(PATRON_TELEFONO) & ~texto.str.match(PATRON_NIT)
+                 & texto.str.count(r'\d').between(7, 15))
+    if any(p in nombre for p in PISTAS_TELEFONO) or (telefonos & ~es_numero).any():
+        puntajes['telefono'] = telefonos.sum() / total
+
+    return {tipo: round(float(p), 4) for tipo, p in puntajes.items()}
+
+
+def inferir_esquema(df: pd.DataFrame, umbral: float = 0.9) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Inferir tipo_dato de cada columna a partir de una muestra
+
+    Args:
+        df: Muestra de registros (ver leer_muestra_excel)
+        umbral: Proporción mínima de valores compatibles para asignar un tipo distinto de texto
+
+    Returns:
+        Tupla (columnas, campo_fecha_sugerido). Cada columna incluye tipo_dato,
+        confianza, proporcion_nulos, cardinalidad, puntajes y un ejemplo.
+    """
+    # Prioridad ante empates: lo más específico primero
+    prioridad = ['booleano', 'fecha', 'numero', 'decimal', 'email', 'telefono']
+    columnas = []
+    candidatas_fecha = []
+
+    for columna in df.columns:
+        original = df[columna]
+        vacios = original.isna() | original.map(lambda v: isinstance(v, str) and not v.strip())
+        valores = original[~vacios]
+        total = len(original)
+
+        puntajes = _puntajes_columna(valores, str(columna))
+        orden = prioridad
+        if any(p in str(columna).lower() for p in PISTAS_TELEFONO):
+            # Columna llamada como teléfono: ante empate con numero gana telefono
+            orden = ['telefono'] + [t for t in prioridad if t != 'telefono']
+        mejor = max(orden, key=lambda t: (puntajes.get(t, 0.0), -orden.index(t)))
+        confianza = puntajes.get(mejor, 0.0)
+        if confianza >= umbral:
+            tipo = mejor
+        else:
+            tipo = 'texto'
+            confianza = round(1.0 - confianza, 4)
+
+        info = {
+            'columna': str(columna),
+            'tipo_dato': tipo,
+            'confianza': confianza,
+            'proporcion_nulos': round(float(vacios.sum()) / total, 4) if total else 1.0,
+            'cardinalidad': int(valores.astype(str).nunique()),
+            'puntajes': puntajes,
+            'ejemplo': str(valores.iloc[0]) if len(valores) else ''
+        }
+        columnas.append(info)
+
+        if tipo == 'fecha':
+            pista = any(p in str(columna).lower() for p in PISTAS_FECHA)
+            candidatas_fecha.append((pista, confianza, -info['proporcion_nulos'], info['columna']))
+
+    campo_fecha = max(candidatas_fecha)[3] if candidatas_fecha else None
+    return columnas, campo_fecha
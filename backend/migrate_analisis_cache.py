@@ -0,0 +1,75 @@
+"""
+Migración: Cache de análisis IA por versión de datos
+Guarda el resultado de generar_analisis_ia por (reporte, tipo, versión de datos,
+versión del prompt) para que exportaciones y correos reutilicen el análisis
+mientras los datos del reporte no cambien.
+
+La versión de datos es un contador por reporte (datos_version) que incrementan en
+su misma transacción las inserciones, aprobaciones, rechazos y purgas: leerla es
+una búsqueda por clave, sin recorrer datos_reportes.
+"""
+
+MIGRATION_SQL = """
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS analisis_cache (
+    reporte_codigo VARCHAR(100) NOT NULL,
+    tipo_analisis VARCHAR(50) NOT NULL,
+    version_datos VARCHAR(100) NOT NULL,
+    version_prompt VARCHAR(50) NOT NULL,
+    resultado JSONB NOT NULL,
+    creado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (reporte_codigo, tipo_analisis, version_datos, version_prompt)
+);
+
+COMMENT ON TABLE analisis_cache IS 'Resultados de análisis IA reutilizables mientras los datos no cambien';
+
+CREATE TABLE IF NOT EXISTS datos_version (
+    reporte_codigo VARCHAR(100) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE datos_version IS 'Contador de cambios de datos_reportes por reporte (versión de datos de las caches)';
+
+COMMIT;
+"""
+
+if __name__ == '__main__':
+    import psycopg2
+    import os
+    
+    db_config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': int(os.getenv('DB_PORT', 5432)),
+        'database': os.getenv('DB_NAME', 'informes_db'),
+        'user': os.getenv('DB_USER', 'admin'),
+        'password': os.getenv('DB_PASSWORD', 'admin123')
+    }
+    
+    try:
+        conn = psycopg2.connect(**db_config)
+        conn.autocommit = False
+        cur = conn.cursor()
+        
+        print("Ejecutando migración de cache de análisis...")
+        print("=" * 60)
+        cur.execute(MIGRATION_SQL)
+        conn.commit()
+        
+        print("\n✓ Migración completada exitosamente\n")
+        print("Cambios aplicados:")
+        print("  ✓ Tabla analisis_cache")
+        print("  ✓ Tabla datos_version (contador de cambios por reporte)")
+        print("\n" + "=" * 60)
+        
+        cur.close()
+        conn.close()
+        
+    except Exception as e:
+        print(f"\n✗ Error en migración: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,59 @@
+"""
+Migración: Búsqueda por texto completo sobre datos_reportes
+Índice GIN sobre los valores (texto y números) de cada registro para búsquedas
+exactas (número de factura, NIT, ...) y para el modo híbrido de /buscar.
+El índice es de expresión: no agrega columnas ni reescribe la tabla.
+"""
+
+MIGRATION_SQL = """
+BEGIN;
+
+-- btree_gin permite incluir reporte_codigo (igualdad) en el mismo índice GIN
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+-- Configuración 'simple': sin stemming ni stopwords, conserva identificadores tal cual.
+-- La expresión debe coincidir con TSVECTOR_DATOS en db_manager.py
+CREATE INDEX IF NOT EXISTS idx_datos_reportes_texto ON datos_reportes
+USING GIN (reporte_codigo, jsonb_to_tsvector('simple'::regconfig, datos, '["string", "numeric"]'::jsonb));
+
+COMMIT;
+"""
+
+if __name__ == '__main__':
+    import psycopg2
+    import os
+    
+    db_config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': int(os.getenv('DB_PORT', 5432)),
+        'database': os.getenv('DB_NAME', 'informes_db'),
+        'user': os.getenv('DB_USER', 'admin'),
+        'password': os.getenv('DB_PASSWORD', 'admin123')
+    }
+    
+    try:
+        conn = psycopg2.connect(**db_config)
+        conn.autocommit = False
+        cur = conn.cursor()
+        
+        print("Ejecutando migración de búsqueda por texto...")
+        print("=" * 60)
+        cur.execute(MIGRATION_SQL)
+        conn.commit()
+        
+        print("\n✓ Migración completada exitosamente\n")
+        print("Cambios aplicados:")
+        print("  ✓ Extensión btree_gin")
+        print("  ✓ Índice GIN de texto completo en datos_reportes (idx_datos_reportes_texto)")
+        print("\n" + "=" * 60)
+        
+        cur.close()
+        conn.close()
+        
+    except Exception as e:
+        print(f"\n✗ Error en migración: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        import traceback
+        traceback.print_exc()
+        exit(1)
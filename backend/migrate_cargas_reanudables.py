@@ -0,0 +1,92 @@
+"""
+Migración: Deduplicación de archivos por SHA-256 y cargas reanudables por partes
+- archivos_cargados: huella de cada archivo ingerido por reporte (referencia a la carga original)
+- sesiones_carga: estado de las subidas por partes (init → PUT partes → completar)
+"""
+
+MIGRATION_SQL = """
+BEGIN;
+
+-- 1. Archivos ya ingeridos por reporte
+CREATE TABLE IF NOT EXISTS archivos_cargados (
+    id SERIAL PRIMARY KEY,
+    reporte_codigo VARCHAR(100) NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    nombre_archivo VARCHAR(255),
+    tamano_bytes BIGINT,
+    carga_id INTEGER REFERENCES cargas_datos(id) ON DELETE SET NULL,
+    registros_insertados INTEGER,
+    usuario VARCHAR(100),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT unique_archivo_reporte UNIQUE (reporte_codigo, sha256)
+);
+
+-- 2. Sesiones de carga reanudable
+CREATE TABLE IF NOT EXISTS sesiones_carga (
+    id VARCHAR(36) PRIMARY KEY,
+    reporte_codigo VARCHAR(100) NOT NULL,
+    destino VARCHAR(20) NOT NULL DEFAULT 'upload',  -- upload | cargar-datos
+    nombre_archivo VARCHAR(255),
+    tamano_total BIGINT NOT NULL,
+    bytes_recibidos BIGINT NOT NULL DEFAULT 0,
+    sha256_esperado CHAR(64),
+    estado VARCHAR(20) NOT NULL DEFAULT 'abierta',  -- abierta | completada | duplicada | expirada
+    resultado JSONB,
+    usuario VARCHAR(100),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT check_destino_sesion CHECK (destino IN ('upload', 'cargar-datos')),
+    CONSTRAINT check_bytes_sesion CHECK (bytes_recibidos <= tamano_total)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sesiones_carga_estado ON sesiones_carga(estado, updated_at);
+
+-- 3. Reserva de la huella antes de procesar (dos subidas simultáneas del mismo archivo:
+--    solo una gana el INSERT ... ON CONFLICT); las filas existentes quedan confirmadas
+ALTER TABLE archivos_cargados ADD COLUMN IF NOT EXISTS confirmado BOOLEAN NOT NULL DEFAULT TRUE;
+
+COMMENT ON TABLE archivos_cargados IS 'SHA-256 de archivos ingeridos por reporte para evitar reprocesar el mismo archivo';
+COMMENT ON TABLE sesiones_carga IS 'Subidas por partes reanudables (init, PUT partes, completar)';
+
+COMMIT;
+"""
+
+if __name__ == '__main__':
+    import psycopg2
+    import os
+    
+    db_config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': int(os.getenv('DB_PORT', 5432)),
+        'database': os.getenv('DB_NAME', 'informes_db'),
+        'user': os.getenv('DB_USER', 'admin'),
+        'password': os.getenv('DB_PASSWORD', 'admin123')
+    }
+    
+    try:
+        conn = psycopg2.connect(**db_config)
+        conn.autocommit = False
+        cur = conn.cursor()
+        
+        print("Ejecutando migración de cargas reanudables...")
+        print("=" * 60)
+        cur.execute(MIGRATION_SQL)
+        conn.commit()
+        
+        print("\n✓ Migración completada exitosamente\n")
+        print("Tablas creadas:")
+        print("  ✓ archivos_cargados (deduplicación SHA-256 por reporte)")
+        print("  ✓ sesiones_carga (subidas por partes reanudables)")
+        print("  ✓ archivos_cargados.confirmado (reserva atómica del SHA-256)")
+        print("\n" + "=" * 60)
+        
+        cur.close()
+        conn.close()
+        
+    except Exception as e:
+        print(f"\n✗ Error en migración: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        import traceback
+        traceback.print_exc()
+        exit(1)
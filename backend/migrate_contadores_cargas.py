@@ -0,0 +1,105 @@
+"""
+Migración: Contadores de registros en cargas_datos
+registros_pendientes / registros_aprobados se mantienen en la misma transacción
+que el staging y la aprobación, y v_resumen_cargas los lee directamente en lugar
+de ejecutar dos COUNT(*) correlacionados por cada carga.
+"""
+
+MIGRATION_SQL = """
+BEGIN;
+
+-- 1. Columnas contador
+ALTER TABLE cargas_datos 
+ADD COLUMN IF NOT EXISTS registros_pendientes INTEGER NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS registros_aprobados INTEGER NOT NULL DEFAULT 0;
+
+COMMENT ON COLUMN cargas_datos.registros_pendientes IS 'Filas de la carga en datos_temporales (mantenido por el backend)';
+COMMENT ON COLUMN cargas_datos.registros_aprobados IS 'Filas de la carga en datos_reportes (mantenido por el backend)';
+
+-- 2. Backfill con conteos agrupados (una pasada por tabla)
+UPDATE cargas_datos c
+SET registros_pendientes = t.total
+FROM (SELECT carga_id, COUNT(*) AS total FROM datos_temporales GROUP BY carga_id) t
+WHERE t.carga_id = c.id;
+
+UPDATE cargas_datos c
+SET registros_aprobados = d.total
+FROM (
+    SELECT carga_id, COUNT(*) AS total 
+    FROM datos_reportes 
+    WHERE carga_id IS NOT NULL 
+    GROUP BY carga_id
+) d
+WHERE d.carga_id = c.id;
+
+-- 3. Vista sin subconsultas correlacionadas (mismas columnas y orden)
+DROP VIEW IF EXISTS v_resumen_cargas;
+
+CREATE VIEW v_resumen_cargas AS
+SELECT 
+    c.id,
+    c.reporte_codigo,
+    rc.nombre as reporte_nombre,
+    c.periodo_tipo,
+    c.periodo_inicio,
+    c.periodo_fin,
+    c.cantidad_registros,
+    c.estado,
+    c.usuario_carga,
+    c.fecha_carga,
+    c.fecha_aprobacion,
+    c.aprobado_por,
+    c.archivo_original,
+    c.registros_pendientes,
+    c.registros_aprobados
+FROM cargas_datos c
+LEFT JOIN reportes_config rc ON c.reporte_codigo = rc.codigo
+ORDER BY c.fecha_carga DESC;
+
+COMMENT ON VIEW v_resumen_cargas IS 'Vista resumen de cargas con estado actual';
+
+-- 4. Índice para el historial por reporte
+CREATE INDEX IF NOT EXISTS idx_cargas_reporte_fecha ON cargas_datos(reporte_codigo, fecha_carga DESC);
+
+COMMIT;
+"""
+
+if __name__ == '__main__':
+    import psycopg2
+    import os
+    
+    db_config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': int(os.getenv('DB_PORT', 5432)),
+        'database': os.getenv('DB_NAME', 'informes_db'),
+        'user': os.getenv('DB_USER', 'admin'),
+        'password': os.getenv('DB_PASSWORD', 'admin123')
+    }
+    
+    try:
+        conn = psycopg2.connect(**db_config)
+        conn.autocommit = False
+        cur = conn.cursor()
+        
+        print("Ejecutando migración de contadores de cargas...")
+        print("=" * 60)
+        cur.execute(MIGRATION_SQL)
+        conn.commit()
+        
+        print("\n✓ Migración completada exitosamente\n")
+        print("Cambios aplicados:")
+        print("  ✓ Columnas registros_pendientes / registros_aprobados en cargas_datos")
+        print("  ✓ Contadores inicializados desde datos_temporales y datos_reportes")
+        print("  ✓ Vista v_resumen_cargas lee los contadores")
+        print("\n" + "=" * 60)
+        
+        cur.close()
+        conn.close()
+        
+    except Exception as e:
+        print(f"\n✗ Error en migración: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        import traceback
+        traceback.print_exc()
+        exit(1)
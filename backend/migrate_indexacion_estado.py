@@ -0,0 +1,72 @@
+"""
+Migración: Marca de indexación por reporte
+Guarda el último datos_reportes.id indexado en ChromaDB para que cada
+indexación procese solo los registros nuevos
+"""
+
+MIGRATION_SQL = """
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS indexacion_estado (
+    reporte_codigo VARCHAR(100) PRIMARY KEY,
+    ultimo_id BIGINT NOT NULL DEFAULT 0,
+    total_indexados BIGINT NOT NULL DEFAULT 0,
+    actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE indexacion_estado IS 'Marca (último id indexado) de la indexación incremental en ChromaDB';
+
+-- Recorrido por id dentro de cada reporte (keyset)
+CREATE INDEX IF NOT EXISTS idx_datos_reportes_codigo_id ON datos_reportes(reporte_codigo, id);
+
+-- Ventana de revisión bajo la marca: los ids se asignan al insertar y no al confirmar,
+-- así que filas de transacciones que seguían abiertas pueden quedar por debajo de ella
+ALTER TABLE indexacion_estado ADD COLUMN IF NOT EXISTS pendiente_desde TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_datos_reportes_codigo_created ON datos_reportes(reporte_codigo, created_at);
+
+-- Versión de datos con la que se generaron los resúmenes por periodo (se omiten si no cambió)
+ALTER TABLE indexacion_estado ADD COLUMN IF NOT EXISTS version_resumenes TEXT;
+
+COMMIT;
+"""
+
+if __name__ == '__main__':
+    import psycopg2
+    import os
+    
+    db_config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': int(os.getenv('DB_PORT', 5432)),
+        'database': os.getenv('DB_NAME', 'informes_db'),
+        'user': os.getenv('DB_USER', 'admin'),
+        'password': os.getenv('DB_PASSWORD', 'admin123')
+    }
+    
+    try:
+        conn = psycopg2.connect(**db_config)
+        conn.autocommit = False
+        cur = conn.cursor()
+        
+        print("Ejecutando migración de estado de indexación...")
+        print("=" * 60)
+        cur.execute(MIGRATION_SQL)
+        conn.commit()
+        
+        print("\n✓ Migración completada exitosamente\n")
+        print("Cambios aplicados:")
+        print("  ✓ Tabla indexacion_estado (marca por reporte)")
+        print("  ✓ Índice (reporte_codigo, id) en datos_reportes")
+        print("  ✓ indexacion_estado.pendiente_desde + índice (reporte_codigo, created_at)")
+        print("  ✓ indexacion_estado.version_resumenes")
+        print("\n" + "=" * 60)
+        
+        cur.close()
+        conn.close()
+        
+    except Exception as e:
+        print(f"\n✗ Error en migración: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,55 @@
+"""
+Script de migración para agregar límite de tamaño de carga por reporte
+(limite_carga_mb NULL = usar el límite global MAX_UPLOAD_MB)
+"""
+import psycopg2
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'postgres'),
+    'port': os.getenv('DB_PORT', 5432),
+    'user': os.getenv('DB_USER', 'admin'),
+    'password': os.getenv('DB_PASSWORD', 'admin123'),
+    'database': os.getenv('DB_NAME', 'informes_db')
+}
+
+def migrar_limites_carga():
+    """Agregar columna limite_carga_mb a reportes_config"""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    try:
+        print("🔄 Agregando límite de carga por reporte a reportes_config...")
+        
+        cur.execute("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name = 'reportes_config' AND column_name = 'limite_carga_mb'
+        """)
+        
+        if not cur.fetchone():
+            print("   📝 Agregando columna limite_carga_mb...")
+            cur.execute("ALTER TABLE reportes_config ADD COLUMN limite_carga_mb INTEGER CHECK (limite_carga_mb > 0)")
+            print("   ✅ Columna limite_carga_mb agregada")
+        else:
+            print("   ℹ️  Columna limite_carga_mb ya existe")
+        
+        conn.commit()
+        print("\n✅ ¡Migración completada exitosamente!")
+        return True
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"\n❌ Error en migración: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == '__main__':
+    migrar_limites_carga()
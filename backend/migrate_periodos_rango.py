@@ -0,0 +1,125 @@
+"""
+Migración: Periodos como daterange con exclusión GiST
+- cargas_datos.periodo: daterange generado a partir de periodo_inicio/periodo_fin
+- Restricción de exclusión: un reporte no puede tener dos cargas aprobadas solapadas
+  (la base de datos lo garantiza también con aprobaciones concurrentes)
+- validar_periodo() pasa a ser una consulta indexada con &&
+"""
+
+MIGRATION_SQL = """
+BEGIN;
+
+-- 1. btree_gist permite combinar igualdad (reporte_codigo) y rangos en un índice GiST
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+-- 2. Columna de rango (inclusiva en ambos extremos, como periodo_inicio/periodo_fin)
+ALTER TABLE cargas_datos
+ADD COLUMN IF NOT EXISTS periodo DATERANGE
+    GENERATED ALWAYS AS (daterange(periodo_inicio, periodo_fin, '[]')) STORED;
+
+COMMENT ON COLUMN cargas_datos.periodo IS 'Rango [periodo_inicio, periodo_fin] para búsquedas de solapamiento';
+
+-- 3. La unicidad exacta queda cubierta por la exclusión (y bloqueaba recargar periodos rechazados)
+ALTER TABLE cargas_datos DROP CONSTRAINT IF EXISTS unique_periodo_reporte;
+
+-- 4. Exclusión: sin solapamientos entre cargas aprobadas/validadas del mismo reporte
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'excl_periodo_aprobado'
+    ) THEN
+        ALTER TABLE cargas_datos
+        ADD CONSTRAINT excl_periodo_aprobado
+        EXCLUDE USING GIST (reporte_codigo WITH =, periodo WITH &&)
+        WHERE (estado IN ('aprobado', 'validado'));
+    END IF;
+END $$;
+
+-- Índice GiST general (incluye pendientes) para validar_periodo y listados por rango
+CREATE INDEX IF NOT EXISTS idx_cargas_periodo_gist ON cargas_datos USING GIST (reporte_codigo, periodo);
+DROP INDEX IF EXISTS idx_cargas_periodo;
+
+-- 5. validar_periodo con && sobre el índice GiST
+CREATE OR REPLACE FUNCTION validar_periodo(
+    p_reporte_codigo VARCHAR,
+    p_periodo_inicio DATE,
+    p_periodo_fin DATE,
+    p_carga_id INTEGER DEFAULT NULL
+)
+RETURNS TABLE(
+    valido BOOLEAN,
+    mensaje TEXT,
+    cargas_conflicto INTEGER[]
+) AS $$
+DECLARE
+    conflictos INTEGER[];
+BEGIN
+    -- Cargas aprobadas cuyo rango se solapa con el propuesto
+    -- Excluir la carga actual si se está editando
+    SELECT ARRAY_AGG(id) INTO conflictos
+    FROM cargas_datos
+    WHERE reporte_codigo = p_reporte_codigo
+    AND estado IN ('aprobado', 'validado')
+    AND (p_carga_id IS NULL OR id != p_carga_id)
+    AND periodo && daterange(p_periodo_inicio, p_periodo_fin, '[]');
+    
+    IF conflictos IS NOT NULL AND array_length(conflictos, 1) > 0 THEN
+        RETURN QUERY SELECT 
+            false,
+            'El periodo se solapa con cargas existentes: ' || array_to_string(conflictos, ', '),
+            conflictos;
+    ELSE
+        RETURN QUERY SELECT 
+            true,
+            'Periodo válido - no hay solapamientos',
+            ARRAY[]::INTEGER[];
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION validar_periodo IS 'Valida que un periodo no se solape con cargas ya aprobadas (probe && indexado)';
+
+COMMIT;
+"""
+
+if __name__ == '__main__':
+    import psycopg2
+    import os
+    
+    db_config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': int(os.getenv('DB_PORT', 5432)),
+        'database': os.getenv('DB_NAME', 'informes_db'),
+        'user': os.getenv('DB_USER', 'admin'),
+        'password': os.getenv('DB_PASSWORD', 'admin123')
+    }
+    
+    try:
+        conn = psycopg2.connect(**db_config)
+        conn.autocommit = False
+        cur = conn.cursor()
+        
+        print("Ejecutando migración de periodos como rango...")
+        print("=" * 60)
+        cur.execute(MIGRATION_SQL)
+        conn.commit()
+        
+        print("\n✓ Migración completada exitosamente\n")
+        print("Cambios aplicados:")
+        print("  ✓ Extensión btree_gist")
+        print("  ✓ Columna cargas_datos.periodo (daterange) e índice GiST")
+        print("  ✓ Restricción excl_periodo_aprobado (sin solapamientos entre aprobadas)")
+        print("  ✓ Función validar_periodo() con &&")
+        print("\n" + "=" * 60)
+        
+        cur.close()
+        conn.close()
+        
+    except Exception as e:
+        print(f"\n✗ Error en migración: {e}")
+        print("  Si ya existen cargas aprobadas solapadas, corríjalas antes de crear la restricción.")
+        if 'conn' in locals():
+            conn.rollback()
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,69 @@
+"""
+Script de migración para la política de indexación de registros por reporte
+- indexacion_registros: 'todos' (por defecto), 'muestra' o 'ninguno'
+- indexacion_muestra_pct: porcentaje de registros indexados con la política 'muestra'
+Los documentos de resumen por periodo se indexan con cualquier política.
+"""
+import psycopg2
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'postgres'),
+    'port': os.getenv('DB_PORT', 5432),
+    'user': os.getenv('DB_USER', 'admin'),
+    'password': os.getenv('DB_PASSWORD', 'admin123'),
+    'database': os.getenv('DB_NAME', 'informes_db')
+}
+
+COLUMNAS = {
+    'indexacion_registros': """
+        ALTER TABLE reportes_config ADD COLUMN indexacion_registros VARCHAR(10) NOT NULL DEFAULT 'todos'
+        CHECK (indexacion_registros IN ('todos', 'muestra', 'ninguno'))
+    """,
+    'indexacion_muestra_pct': """
+        ALTER TABLE reportes_config ADD COLUMN indexacion_muestra_pct SMALLINT NOT NULL DEFAULT 10
+        CHECK (indexacion_muestra_pct BETWEEN 1 AND 100)
+    """
+}
+
+def migrar_politica_indexacion():
+    """Agregar columnas de política de indexación a reportes_config"""
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    
+    try:
+        print("🔄 Agregando política de indexación por reporte a reportes_config...")
+        
+        for columna, ddl in COLUMNAS.items():
+            cur.execute("""
+                SELECT column_name 
+                FROM information_schema.columns 
+                WHERE table_name = 'reportes_config' AND column_name = %s
+            """, (columna,))
+            
+            if not cur.fetchone():
+                print(f"   📝 Agregando columna {columna}...")
+                cur.execute(ddl)
+                print(f"   ✅ Columna {columna} agregada")
+            else:
+                print(f"   ℹ️  Columna {columna} ya existe")
+        
+        conn.commit()
+        print("\n✅ ¡Migración completada exitosamente!")
+        return True
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"\n❌ Error en migración: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == '__main__':
+    migrar_politica_indexacion()
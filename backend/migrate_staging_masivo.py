@@ -0,0 +1,133 @@
+"""
+Migración: Staging masivo de cargas (COPY + periodos calculados por lote)
+El backend ahora calcula fecha_extraida/periodo_inicio/periodo_fin al cargar
+datos_temporales, por lo que el trigger por fila pasa a ser opcional.
+Uso:
+    python migrate_staging_masivo.py                     # desactiva el trigger por fila
+    python migrate_staging_masivo.py --restaurar-trigger # vuelve a crear el trigger
+"""
+import sys
+
+MIGRATION_SQL = """
+BEGIN;
+
+-- 1. Quitar el trigger por fila (consultaba reportes_config y calcular_periodo en cada INSERT)
+--    La función actualizar_periodo_temporal() se conserva para poder restaurarlo.
+DROP TRIGGER IF EXISTS trg_actualizar_periodo_temporal ON datos_temporales;
+
+-- 2. Recalcular periodos de una carga en una sola sentencia (UPDATE ... FROM)
+--    Útil para filas cargadas por otras herramientas sin periodo calculado
+CREATE OR REPLACE FUNCTION recalcular_periodos_carga(p_carga_id INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    v_actualizadas INTEGER;
+BEGIN
+    WITH fechas AS (
+        SELECT
+            t.id,
+            rc.tipo_periodo,
+            (t.datos->>rc.campo_fecha)::DATE AS fecha
+        FROM datos_temporales t
+        JOIN reportes_config rc ON rc.codigo = t.reporte_codigo
+        WHERE t.carga_id = p_carga_id
+        AND rc.tipo_periodo IS NOT NULL
+        AND rc.tipo_periodo != 'libre'
+        AND rc.campo_fecha IS NOT NULL
+    )
+    UPDATE datos_temporales t
+    SET fecha_extraida = f.fecha,
+        periodo_inicio = CASE f.tipo_periodo
+            WHEN 'semanal' THEN DATE_TRUNC('week', f.fecha::TIMESTAMP)::DATE
+            WHEN 'quincenal' THEN
+                CASE WHEN EXTRACT(DAY FROM f.fecha) <= 15
+                    THEN DATE_TRUNC('month', f.fecha::TIMESTAMP)::DATE
+                    ELSE (DATE_TRUNC('month', f.fecha::TIMESTAMP) + INTERVAL '15 days')::DATE
+                END
+            WHEN 'mensual' THEN DATE_TRUNC('month', f.fecha::TIMESTAMP)::DATE
+            WHEN 'trimestral' THEN DATE_TRUNC('quarter', f.fecha::TIMESTAMP)::DATE
+            WHEN 'anual' THEN DATE_TRUNC('year', f.fecha::TIMESTAMP)::DATE
+            ELSE f.fecha
+        END,
+        periodo_fin = CASE f.tipo_periodo
+            WHEN 'semanal' THEN (DATE_TRUNC('week', f.fecha::TIMESTAMP) + INTERVAL '6 days')::DATE
+            WHEN 'quincenal' THEN
+                CASE WHEN EXTRACT(DAY FROM f.fecha) <= 15
+                    THEN (DATE_TRUNC('month', f.fecha::TIMESTAMP) + INTERVAL '14 days')::DATE
+                    ELSE (DATE_TRUNC('month', f.fecha::TIMESTAMP) + INTERVAL '1 month - 1 day')::DATE
+                END
+            WHEN 'mensual' THEN (DATE_TRUNC('month', f.fecha::TIMESTAMP) + INTERVAL '1 month - 1 day')::DATE
+            WHEN 'trimestral' THEN (DATE_TRUNC('quarter', f.fecha::TIMESTAMP) + INTERVAL '3 months - 1 day')::DATE
+            WHEN 'anual' THEN (DATE_TRUNC('year', f.fecha::TIMESTAMP) + INTERVAL '1 year - 1 day')::DATE
+            ELSE f.fecha
+        END
+    FROM fechas f
+    WHERE t.id = f.id;
+
+    GET DIAGNOSTICS v_actualizadas = ROW_COUNT;
+    RETURN v_actualizadas;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION recalcular_periodos_carga IS 'Calcula en bloque fecha y periodo de las filas en staging de una carga';
+
+COMMIT;
+"""
+
+RESTAURAR_TRIGGER_SQL = """
+BEGIN;
+
+DROP TRIGGER IF EXISTS trg_actualizar_periodo_temporal ON datos_temporales;
+
+CREATE TRIGGER trg_actualizar_periodo_temporal
+BEFORE INSERT ON datos_temporales
+FOR EACH ROW
+EXECUTE FUNCTION actualizar_periodo_temporal();
+
+COMMIT;
+"""
+
+if __name__ == '__main__':
+    import psycopg2
+    import os
+
+    db_config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'port': int(os.getenv('DB_PORT', 5432)),
+        'database': os.getenv('DB_NAME', 'informes_db'),
+        'user': os.getenv('DB_USER', 'admin'),
+        'password': os.getenv('DB_PASSWORD', 'admin123')
+    }
+
+    restaurar = '--restaurar-trigger' in sys.argv
+
+    try:
+        conn = psycopg2.connect(**db_config)
+        conn.autocommit = False
+        cur = conn.cursor()
+
+        print("Ejecutando migración de staging masivo...")
+        print("=" * 60)
+        cur.execute(MIGRATION_SQL)
+        if restaurar:
+            cur.execute(RESTAURAR_TRIGGER_SQL)
+        conn.commit()
+
+        print("\n✓ Migración completada exitosamente\n")
+        print("Cambios aplicados:")
+        print("  ✓ Función recalcular_periodos_carga() creada")
+        if restaurar:
+            print("  ✓ Trigger trg_actualizar_periodo_temporal restaurado")
+        else:
+            print("  ✓ Trigger trg_actualizar_periodo_temporal eliminado (periodos calculados en el backend)")
+        print("\n" + "=" * 60)
+
+        cur.close()
+        conn.close()
+
+    except Exception as e:
+        print(f"\n✗ Error en migración: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+        import traceback
+        traceback.print_exc()
+        exit(1)
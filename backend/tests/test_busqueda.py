@@ -0,0 +1,48 @@
+"""
+Pruebas de los filtros de búsqueda (sin base de datos ni ChromaDB)
+Ejecutar desde backend/: python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from busqueda import (construir_where, extraer_filtros_pregunta,  # noqa: E402
+                      extraer_periodo_pregunta, traducir_where)
+
+
+def test_extraer_periodo_pregunta():
+    assert extraer_periodo_pregunta('ventas de marzo y enero 2024') == ([2024], [1, 3])
+    assert extraer_periodo_pregunta('facturas pendientes') == ([], [])
+    assert extraer_filtros_pregunta('ventas de marzo 2024') == {'$and': [{'anio': 2024}, {'mes': 3}]}
+
+
+def test_traducir_where_equivale_a_construir_where():
+    where = construir_where(fecha_inicio='2024-01-01', fecha_fin='2024-01-31', carga_id=[3, 4],
+                            filtros={'ciudad': 'Cali', 'estado': ['abierta', 'vencida']}, mes=1)
+    assert traducir_where(where) == {
+        'fecha_inicio': '2024-01-01',
+        'fecha_fin': '2024-01-31',
+        'meses': [1],
+        'carga_id': [3, 4],
+        'filtros': {'ciudad': ['Cali'], 'estado': ['abierta', 'vencida']},
+    }
+
+
+def test_traducir_where_condicion_simple():
+    assert traducir_where({'campo_ciudad': 'Cali'}) == {'filtros': {'ciudad': ['Cali']}}
+
+
+@pytest.mark.parametrize('where', [
+    {'$or': [{'anio': 2024}, {'mes': 1}]},
+    {'campo_ciudad': {'$ne': 'Cali'}},
+    {'fecha_periodo': 20240101},
+    {'otro': 1},
+    {'$and': [{'anio': 2024}, {'anio': 2023}]},
+    {},
+])
+def test_traducir_where_no_admitido(where):
+    with pytest.raises(ValueError):
+        traducir_where(where)
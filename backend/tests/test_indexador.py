@@ -0,0 +1,73 @@
+"""
+Pruebas de la cola de indexación con un agente falso (sin ChromaDB ni base de datos)
+Ejecutar desde backend/: python -m pytest -q tests
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from indexador import ColaIndexacion  # noqa: E402
+
+
+class AgenteFalso:
+    def __init__(self):
+        self.llamadas = []
+        self._lock = threading.Lock()
+
+    def _registrar(self, tipo, **kwargs):
+        with self._lock:
+            self.llamadas.append((tipo, kwargs))
+        time.sleep(0.01)
+        return {}
+
+    def indexar_datos_reporte(self, codigo, resumenes=True):
+        return self._registrar('reporte', resumenes=resumenes)
+
+    def indexar_carga(self, codigo, carga_ids, resumenes=True):
+        return self._registrar('cargas', resumenes=resumenes)
+
+    def indexar_resumenes(self, codigo):
+        return self._registrar('resumenes')
+
+    def contar(self, tipo):
+        with self._lock:
+            return sum(1 for t, _ in self.llamadas if t == tipo)
+
+
+def _esperar(condicion, limite=3.0):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        if condicion():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_disparos_continuos_respetan_espera_maxima():
+    agente = AgenteFalso()
+    cola = ColaIndexacion(agente, debounce_seg=0.2, max_espera_seg=0.3, intervalo_resumenes_seg=60)
+    fin = time.monotonic() + 1.0
+    while time.monotonic() < fin:
+        cola.encolar('R')
+        time.sleep(0.02)
+    # Sin tope, la espera se reiniciaría con cada disparo y no correría nunca
+    assert agente.contar('reporte') >= 2
+
+
+def test_resumenes_aparte_y_agrupados():
+    agente = AgenteFalso()
+    cola = ColaIndexacion(agente, debounce_seg=0.01, max_espera_seg=0.02, intervalo_resumenes_seg=60)
+    for _ in range(5):
+        cola.encolar('R', carga_ids=[1])
+        assert _esperar(lambda: not cola.pendientes() and cola.estado('R')['estado'] == 'completado')
+    assert _esperar(lambda: agente.contar('resumenes') == 1)
+    time.sleep(0.1)
+
+    # Cada indexación corre sin resúmenes; las cinco comparten una sola regeneración
+    assert agente.contar('cargas') == 5
+    assert all(not kwargs['resumenes'] for tipo, kwargs in agente.llamadas if tipo != 'resumenes')
+    assert agente.contar('resumenes') == 1
+    assert cola.estado_general()['resumenes_programados'] == 1
@@ -0,0 +1,107 @@
+"""
+Pruebas de las conversiones puras de ingesta (sin base de datos)
+Ejecutar desde backend/: python -m pytest -q tests
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ingesta import _a_fecha, _a_numero, calcular_periodos, inferir_esquema  # noqa: E402
+
+
+@pytest.mark.parametrize('valor, esperado', [
+    ('1,234.56', 1234.56),
+    ('1.234,56', 1234.56),
+    ('$ 1.500,00', 1500.0),
+    ('$ 1.500', 1500.0),
+    ('1.234', 1234.0),
+    ('1,500', 1500.0),
+    ('-2.500', -2500.0),
+    ('0.500', 0.5),
+    ('1.5', 1.5),
+    ('12,50', 12.5),
+    ('1.234.567', 1234567.0),
+    ('1,234,567.5', 1234567.5),
+    ('COP 2.000.000', 2000000.0),
+    ('(200)', -200.0),
+    ('12,5', 12.5),
+    (42, 42.0),
+])
+def test_a_numero_formatos(valor, esperado):
+    assert _a_numero(pd.Series([valor], dtype=object)).iloc[0] == pytest.approx(esperado)
+
+
+def test_a_numero_no_convertible_queda_nulo():
+    resultado = _a_numero(pd.Series(['abc', None], dtype=object))
+    assert resultado.isna().all()
+
+
+def test_a_fecha_formatos():
+    serie = pd.Series(['2024-01-15', '15/02/2024', 45000, '2024-01-15T10:20:00', 'x', None], dtype=object)
+    assert _a_fecha(serie).tolist() == [
+        '2024-01-15', '2024-02-15', '2023-03-15', '2024-01-15T10:20:00', None, None
+    ]
+
+
+def test_a_fecha_sin_advertencias():
+    with pd.option_context('mode.chained_assignment', 'raise'):
+        _a_fecha(pd.Series(['15/02/2024', 45000], dtype=object))
+
+
+@pytest.mark.parametrize('tipo, inicio, fin', [
+    ('diario', '2024-02-20', '2024-02-20'),
+    ('semanal', '2024-02-19', '2024-02-25'),
+    ('quincenal', '2024-02-16', '2024-02-29'),
+    ('mensual', '2024-02-01', '2024-02-29'),
+    ('trimestral', '2024-01-01', '2024-03-31'),
+    ('anual', '2024-01-01', '2024-12-31'),
+])
+def test_calcular_periodos(tipo, inicio, fin):
+    fechas, inicios, fines = calcular_periodos(['2024-02-20'], tipo)
+    assert fechas.iloc[0] == pd.Timestamp('2024-02-20')
+    assert inicios.iloc[0] == pd.Timestamp(inicio)
+    assert fines.iloc[0] == pd.Timestamp(fin)
+
+
+def test_calcular_periodos_quincena_primera():
+    _, inicios, fines = calcular_periodos(['2024-02-03'], 'quincenal')
+    assert (inicios.iloc[0], fines.iloc[0]) == (pd.Timestamp('2024-02-01'), pd.Timestamp('2024-02-15'))
+
+
+def test_calcular_periodos_libre_y_fecha_invalida():
+    _, inicios, fines = calcular_periodos(['2024-02-20'], 'libre')
+    assert inicios.isna().all() and fines.isna().all()
+
+    fechas, inicios, _ = calcular_periodos(['no es fecha'], 'mensual')
+    assert fechas.isna().all() and inicios.isna().all()
+
+
+def _tipos_inferidos(columnas: dict) -> dict:
+    inferidas, _ = inferir_esquema(pd.DataFrame(columnas))
+    return {c['columna']: c['tipo_dato'] for c in inferidas}
+
+
+def test_inferir_telefonos():
+    tipos = _tipos_inferidos({
+        'tel': ['+57 300 123 4567', '+57 310 555 1234', '+57 321 000 1111'],
+        'celular': ['3001234567', '3105551234', '3210001111'],
+        'contacto': ['300-123-4567', '310-555-1234', '321-000-1111'],
+    })
+    assert tipos == {'tel': 'telefono', 'celular': 'telefono', 'contacto': 'telefono'}
+
+
+def test_inferir_nit_no_es_telefono_ni_numero():
+    tipos = _tipos_inferidos({'nit': ['900123456-1', '800.222.333-4', '901999888-0']})
+    assert tipos == {'nit': 'texto'}
+
+
+def test_inferir_precios_cop():
+    tipos = _tipos_inferidos({
+        'precio': ['$ 1.500', '$ 250.000', '$ 1.200.000'],
+        'valor': ['1.234,56', '10,5', '3.000'],
+    })
+    assert tipos == {'precio': 'numero', 'valor': 'decimal'}
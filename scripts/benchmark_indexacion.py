@@ -0,0 +1,168 @@
+"""
+Benchmark de indexación: plantilla detallada vs compacta
+Mide tamaño de documento y docs/seg (render + embeddings y, opcionalmente, escritura
+en un ChromaDB embebido temporal) sobre registros sintéticos, sin base de datos.
+
+Uso:
+    python scripts/benchmark_indexacion.py --registros 2000
+    python scripts/benchmark_indexacion.py --registros 5000 --chroma
+    EMBEDDINGS_PROVEEDOR=hash python scripts/benchmark_indexacion.py
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+# Medir el cálculo real de embeddings, no la cache
+os.environ.setdefault('EMBEDDINGS_CACHE', '0')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from analysis_agent import DataAnalysisAgent  # noqa: E402
+from embeddings import crear_proveedor_embeddings  # noqa: E402
+
+CAMPOS = [
+    {'nombre': 'fecha', 'etiqueta': 'Fecha', 'tipo_dato': 'fecha',
+     'descripcion': 'Fecha de emisión de la factura'},
+    {'nombre': 'numero_factura', 'etiqueta': 'Número de factura', 'tipo_dato': 'texto',
+     'descripcion': 'Consecutivo de la factura electrónica emitida ante la DIAN'},
+    {'nombre': 'nit', 'etiqueta': 'NIT', 'tipo_dato': 'texto',
+     'descripcion': 'Número de identificación tributaria del cliente'},
+    {'nombre': 'cliente', 'etiqueta': 'Cliente', 'tipo_dato': 'texto',
+     'descripcion': 'Razón social del cliente al que se factura el servicio'},
+    {'nombre': 'sede', 'etiqueta': 'Sede', 'tipo_dato': 'texto',
+     'descripcion': 'Sede que presta el servicio facturado'},
+    {'nombre': 'servicio', 'etiqueta': 'Servicio', 'tipo_dato': 'texto',
+     'descripcion': 'Descripción del servicio o procedimiento facturado'},
+    {'nombre': 'vr_total', 'etiqueta': 'Valor total', 'tipo_dato': 'decimal',
+     'descripcion': 'Valor total de la factura incluyendo impuestos'},
+]
+
+CONTEXTO = (
+    "Reporte de facturación emitida de manera unitaria por las sedes de la red. "
+    "Se usa para seguimiento de ingresos, cartera por cliente y cumplimiento de metas "
+    "mensuales de cada sede, y como soporte para conciliaciones con las aseguradoras."
+)
+
+
+def generar_registros(n, semilla=42):
+    rnd = random.Random(semilla)
+    clientes = [f"Cliente {i} S.A.S." for i in range(50)]
+    sedes = ['Norte', 'Sur', 'Centro', 'Occidente']
+    servicios = ['Consulta general', 'Laboratorio clínico', 'Imagenología', 'Urgencias', 'Hospitalización']
+    inicio = date(2024, 1, 1)
+    return [
+        {
+            'id': i + 1,
+            'created_at': '2026-01-01T00:00:00',
+            'carga_id': 1,
+            'datos': {
+                'fecha': (inicio + timedelta(days=rnd.randint(0, 730))).isoformat(),
+                'numero_factura': f"FE-{100000 + i}",
+                'nit': f"{rnd.randint(800000000, 999999999)}-{rnd.randint(0, 9)}",
+                'cliente': rnd.choice(clientes),
+                'sede': rnd.choice(sedes),
+                'servicio': rnd.choice(servicios),
+                'vr_total': round(rnd.uniform(50000, 5000000), 2),
+            }
+        }
+        for i in range(n)
+    ]
+
+
+def contexto_indexacion(plantilla):
+    return {
+        'codigo': 'benchmark',
+        'reporte': {'nombre': 'Facturación emitida (benchmark)'},
+        'contexto': CONTEXTO,
+        'descripcion': 'Facturas emitidas una a una',
+        'campos_config': CAMPOS,
+        'docs_campos': {
+            c['nombre']: {'etiqueta': c['etiqueta'], 'descripcion': c['descripcion'],
+                          'tipo': c['tipo_dato'], 'ejemplo': ''}
+            for c in CAMPOS
+        },
+        'campo_fecha': 'fecha',
+        'campos_filtro': ['sede', 'cliente'],
+        'plantilla': plantilla,
+    }
+
+
+def medir(agente, registros, plantilla, usar_chroma):
+    ctx = contexto_indexacion(plantilla)
+
+    t0 = time.perf_counter()
+    documentos = [agente._documento_registro(ctx, r) for r in registros]
+    t_render = time.perf_counter() - t0
+
+    textos = [d[0] for d in documentos]
+    caracteres = sum(len(t) for t in textos)
+
+    t0 = time.perf_counter()
+    if usar_chroma:
+        # Escritura real (embeddings incluidos) con el mismo camino que la indexación
+        collection = agente.chroma_client.get_or_create_collection(
+            name=f"benchmark_{plantilla}", embedding_function=agente.embedding_function
+        )
+        agente._upsert_documentos(collection, documentos)
+    else:
+        tamano = 256
+        for i in range(0, len(textos), tamano):
+            agente.embedding_function(textos[i:i+tamano])
+    t_indexar = time.perf_counter() - t0
+
+    total = t_render + t_indexar
+    return {
+        'plantilla': plantilla,
+        'chars_promedio': caracteres / len(textos),
+        'render_seg': t_render,
+        'indexar_seg': t_indexar,
+        'docs_seg': len(textos) / total if total else float('inf'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de plantillas de indexación')
+    parser.add_argument('--registros', type=int, default=2000)
+    parser.add_argument('--chroma', action='store_true',
+                        help='Escribir en un ChromaDB embebido temporal (no solo embeddings)')
+    args = parser.parse_args()
+
+    directorio = None
+    if args.chroma:
+        directorio = tempfile.mkdtemp(prefix='bench_chroma_')
+        os.environ['CHROMA_MODE'] = 'local'
+        os.environ['CHROMA_PATH'] = directorio
+
+    agente = DataAnalysisAgent(db_manager=None, embedding_function=crear_proveedor_embeddings())
+    registros = generar_registros(args.registros)
+
+    print("\n" + "=" * 70)
+    print(f"  📊 BENCHMARK DE INDEXACIÓN ({args.registros} registros, "
+          f"embeddings: {os.getenv('EMBEDDINGS_PROVEEDOR', 'onnx')}, chroma: {'sí' if args.chroma else 'no'})")
+    print("=" * 70)
+
+    try:
+        # Calentar el modelo para no cargar su inicialización a la primera plantilla
+        agente.embedding_function(['calentamiento'])
+        resultados = [medir(agente, registros, p, args.chroma) for p in ('detallada', 'compacta')]
+    finally:
+        if directorio:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    print(f"\n{'Plantilla':<12}{'Chars/doc':>12}{'Render (s)':>12}{'Indexar (s)':>13}{'Docs/seg':>12}")
+    print("-" * 61)
+    for r in resultados:
+        print(f"{r['plantilla']:<12}{r['chars_promedio']:>12.0f}{r['render_seg']:>12.3f}"
+              f"{r['indexar_seg']:>13.3f}{r['docs_seg']:>12.1f}")
+
+    antes, despues = resultados
+    print(f"\n✅ Tamaño de documento: {despues['chars_promedio'] / antes['chars_promedio']:.0%} del formato detallado")
+    print(f"✅ Throughput: x{despues['docs_seg'] / antes['docs_seg']:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -26,7 +26,9 @@ def print_respuesta(respuesta_json):
     print("-" * 70)
     
     if respuesta_json.get('funciones_ejecutadas'):
-        print(f"\n🔧 Funciones ejecutadas: {', '.join(respuesta_json['funciones_ejecutadas'])}")
+        print(f"\n🔧 Funciones ejecutadas ({respuesta_json.get('pasos', 1)} pasos, {respuesta_json.get('duracion_seg', 0)}s):")
+        for funcion in respuesta_json['funciones_ejecutadas']:
+            print(f"   • Paso {funcion['paso']}: {funcion['nombre']} ({funcion['duracion_seg']}s)")
     
     print(f"📊 Session ID: {respuesta_json.get('session_id', 'N/A')}")
     return respuesta_json
@@ -28,7 +28,8 @@ if response.status_code == 200:
     print(f"\n🤖 Agente: {data.get('respuesta', '')[:200]}...")
     
     if data.get('funciones_ejecutadas'):
-        print(f"\n🔧 Funciones ejecutadas: {', '.join(data['funciones_ejecutadas'])}")
+        funciones = [f"{f['nombre']} (paso {f['paso']}, {f['duracion_seg']}s)" for f in data['funciones_ejecutadas']]
+        print(f"\n🔧 Funciones ejecutadas: {', '.join(funciones)}")
         print("✅ FUNCTION CALLING FUNCIONANDO!")
     else:
         print("⚠️ No se ejecutaron funciones (puede ser normal si respondió directamente)")